@@ -1,684 +1,6512 @@
-import tkinter as tk
-from tkinter import ttk, messagebox, scrolledtext
-import threading
-import time
-import psycopg2
-from datetime import datetime
-from queue import Queue
-from ping3 import ping, verbose_ping
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import socket
-
-class DarkModeTheme:
-    @staticmethod
-    def apply(root):
-        root.tk_setPalette(
-            background='#1a1a1a', foreground='#ffffff',
-            activeBackground='#404040', activeForeground='#ffffff',
-            selectColor='#3a3a3a', selectBackground='#3a3a3a',
-            insertBackground='#ffffff'
-        )
-        
-        style = ttk.Style()
-        style.theme_use('clam')
-        
-        # Configure colors
-        style.configure('.', background='#1a1a1a', foreground='#ffffff')
-        style.configure('TFrame', background='#1a1a1a')
-        style.configure('TLabel', background='#1a1a1a', foreground='#ffffff')
-        style.configure('TButton', background='#3a3a3a', foreground='#ffffff', borderwidth=1)
-        style.configure('TEntry', fieldbackground='#2a2a2a', foreground='#ffffff')
-        style.configure('TCombobox', fieldbackground='#2a2a2a', foreground='#ffffff')
-        style.map('TButton', 
-                background=[('active', '#404040'), ('pressed', '#505050')],
-                foreground=[('active', '#ffffff'), ('pressed', '#ffffff')])
-        style.map('TCombobox', 
-                fieldbackground=[('readonly', '#2a2a2a')],
-                foreground=[('readonly', '#ffffff')])
-        
-        # Scrollbar style
-        style.configure('Vertical.TScrollbar', background='#2a2a2a', troughcolor='#1a1a1a')
-        style.configure('Horizontal.TScrollbar', background='#2a2a2a', troughcolor='#1a1a1a')
-        
-        # Treeview style
-        style.configure("Treeview", 
-                      background="#2a2a2a", 
-                      foreground="#ffffff",
-                      fieldbackground="#2a2a2a",
-                      rowheight=25)
-        style.map('Treeview', background=[('selected', '#3a3a3a')])
-        style.configure("Treeview.Heading", 
-                      background="#3a3a3a", 
-                      foreground="#ffffff",
-                      relief="flat")
-        style.map("Treeview.Heading", 
-                background=[('active', '#4a4a4a')])
-
-class PingMonitorApp:
-    def __init__(self, root):
-        self.root = root
-        self.root.title("VICS Ping Monitor")
-        self.root.geometry("1200x800")
-        
-        # Database connection parameters
-        self.db_params = {
-            "host": "172.20.200.253",
-            "database": "postgres",
-            "user": "postgres",
-            "password": "yamaha1*"
-        }
-        
-        # Initialize variables
-        self.targets = []
-        self.ping_thread = None
-        self.stop_ping = False
-        self.message_queue = Queue()
-        self.ttl_days = 30
-        self.ping_interval = 3  # Ping interval in seconds
-        self.max_workers = 50   # Max concurrent ping threads
-        self.ping_attempts = 2  # Number of ping attempts before declaring failure
-        self.ping_timeout = 0.5   # Timeout in seconds for each ping
-        
-        # Thread pool for concurrent pinging
-        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
-        
-        # Setup UI
-        self.setup_ui()
-        
-        # Check for messages from other threads
-        self.check_queue()
-        
-        # Initialize database
-        self.initialize_database()
-        
-        # Load targets from database
-        self.load_targets_from_db()
-    
-    def setup_ui(self):
-        # Apply dark mode
-        DarkModeTheme.apply(self.root)
-        
-        # Main container
-        main_frame = ttk.Frame(self.root, padding="10")
-        main_frame.pack(fill=tk.BOTH, expand=True)
-        
-        # Left panel (controls)
-        left_panel = ttk.Frame(main_frame, width=350)
-        left_panel.pack(side=tk.LEFT, fill=tk.Y, padx=(0, 10))
-        
-        # Right panel (results)
-        right_panel = ttk.Frame(main_frame)
-        right_panel.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
-        
-        # Targets section
-        targets_frame = ttk.LabelFrame(left_panel, text="Target Management", padding="10")
-        targets_frame.pack(fill=tk.X, pady=(0, 10))
-        
-        # Target entry
-        ttk.Label(targets_frame, text="Target (IP/Hostname):").pack(anchor=tk.W)
-        self.target_entry = ttk.Entry(targets_frame)
-        self.target_entry.pack(fill=tk.X, pady=(0, 5))
-        
-        # Add/Remove buttons
-        button_frame = ttk.Frame(targets_frame)
-        button_frame.pack(fill=tk.X)
-        
-        add_btn = ttk.Button(button_frame, text="Add Target", command=self.add_target)
-        add_btn.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 5))
-        
-        remove_btn = ttk.Button(button_frame, text="Remove Selected", command=self.remove_target)
-        remove_btn.pack(side=tk.LEFT, fill=tk.X, expand=True)
-        
-        # Targets list
-        self.targets_listbox = tk.Listbox(
-            targets_frame, 
-            height=10,
-            bg="#2a2a2a", 
-            fg="#ffffff", 
-            selectbackground="#3a3a3a",
-            selectforeground="#ffffff"
-        )
-        self.targets_listbox.pack(fill=tk.BOTH, expand=True, pady=(5, 0))
-        
-        # Control buttons
-        control_frame = ttk.LabelFrame(left_panel, text="Monitoring Control", padding="10")
-        control_frame.pack(fill=tk.X, pady=(10, 0))
-        
-        self.start_btn = ttk.Button(control_frame, text="Start Monitoring", command=self.start_monitoring)
-        self.start_btn.pack(fill=tk.X, pady=(0, 5))
-        
-        self.stop_btn = ttk.Button(control_frame, text="Stop Monitoring", command=self.stop_monitoring, state=tk.DISABLED)
-        self.stop_btn.pack(fill=tk.X)
-        
-        # Settings frame
-        settings_frame = ttk.LabelFrame(left_panel, text="Ping Settings", padding="10")
-        settings_frame.pack(fill=tk.X, pady=(10, 0))
-        
-        # TTL settings
-        ttk.Label(settings_frame, text="Data Retention (days):").pack(anchor=tk.W)
-        self.ttl_var = tk.IntVar(value=self.ttl_days)
-        ttk.Spinbox(
-            settings_frame, 
-            from_=1, 
-            to=365, 
-            textvariable=self.ttl_var,
-            command=self.update_ttl
-        ).pack(fill=tk.X)
-        
-        # Ping attempts
-        ttk.Label(settings_frame, text="Ping Attempts:").pack(anchor=tk.W)
-        self.attempts_var = tk.IntVar(value=self.ping_attempts)
-        ttk.Spinbox(
-            settings_frame, 
-            from_=1, 
-            to=5, 
-            textvariable=self.attempts_var,
-            command=self.update_attempts
-        ).pack(fill=tk.X)
-        
-        # Ping timeout
-        ttk.Label(settings_frame, text="Ping Timeout (sec):").pack(anchor=tk.W)
-        self.timeout_var = tk.IntVar(value=self.ping_timeout)
-        ttk.Spinbox(
-            settings_frame, 
-            from_=1, 
-            to=10, 
-            textvariable=self.timeout_var,
-            command=self.update_timeout
-        ).pack(fill=tk.X)
-        
-        # Log section
-        log_frame = ttk.LabelFrame(left_panel, text="Activity Log", padding="10")
-        log_frame.pack(fill=tk.BOTH, expand=True, pady=(10, 0))
-        
-        self.log_text = scrolledtext.ScrolledText(
-            log_frame,
-            wrap=tk.WORD,
-            height=10,
-            bg="#2a2a2a",
-            fg="#ffffff",
-            insertbackground="#ffffff"
-        )
-        self.log_text.pack(fill=tk.BOTH, expand=True)
-        
-        # Status section
-        status_frame = ttk.LabelFrame(right_panel, text="Current Status", padding="10")
-        status_frame.pack(fill=tk.BOTH, expand=True)
-        
-        # Create treeview with scrollbars
-        tree_frame = ttk.Frame(status_frame)
-        tree_frame.pack(fill=tk.BOTH, expand=True)
-        
-        # Vertical scrollbar
-        tree_scroll_y = ttk.Scrollbar(tree_frame)
-        tree_scroll_y.pack(side=tk.RIGHT, fill=tk.Y)
-        
-        # Horizontal scrollbar
-        tree_scroll_x = ttk.Scrollbar(tree_frame, orient=tk.HORIZONTAL)
-        tree_scroll_x.pack(side=tk.BOTTOM, fill=tk.X)
-        
-        # Create treeview
-        self.status_tree = ttk.Treeview(
-            tree_frame,
-            columns=("target", "status", "last_response", "last_check", "success_rate", "attempts"),
-            show="headings",
-            selectmode="extended",
-            yscrollcommand=tree_scroll_y.set,
-            xscrollcommand=tree_scroll_x.set
-        )
-        
-        # Configure columns
-        self.status_tree.heading("target", text="Target", anchor=tk.W)
-        self.status_tree.heading("status", text="Status", anchor=tk.CENTER)
-        self.status_tree.heading("last_response", text="Response (ms)", anchor=tk.CENTER)
-        self.status_tree.heading("last_check", text="Last Check", anchor=tk.CENTER)
-        self.status_tree.heading("success_rate", text="Success Rate", anchor=tk.CENTER)
-        self.status_tree.heading("attempts", text="Attempts", anchor=tk.CENTER)
-        
-        self.status_tree.column("target", width=200, stretch=tk.YES)
-        self.status_tree.column("status", width=100, stretch=tk.NO, anchor=tk.CENTER)
-        self.status_tree.column("last_response", width=100, stretch=tk.NO, anchor=tk.CENTER)
-        self.status_tree.column("last_check", width=150, stretch=tk.NO, anchor=tk.CENTER)
-        self.status_tree.column("success_rate", width=100, stretch=tk.NO, anchor=tk.CENTER)
-        self.status_tree.column("attempts", width=80, stretch=tk.NO, anchor=tk.CENTER)
-        
-        self.status_tree.pack(fill=tk.BOTH, expand=True)
-        
-        # Configure scrollbars
-        tree_scroll_y.config(command=self.status_tree.yview)
-        tree_scroll_x.config(command=self.status_tree.xview)
-        
-        # Status bar
-        self.status_bar = ttk.Label(right_panel, text="Ready", relief=tk.SUNKEN)
-        self.status_bar.pack(fill=tk.X, pady=(5, 0))
-    
-    def initialize_database(self):
-        conn = None
-        try:
-            conn = self.get_db_connection()
-            conn.autocommit = True
-            
-            with conn.cursor() as cur:
-                # Create targets table if not exists
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS ping_targets (
-                        id SERIAL PRIMARY KEY,
-                        target VARCHAR(255) NOT NULL UNIQUE,
-                        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                
-                # Create results table if not exists
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS ping_results (
-                        id SERIAL PRIMARY KEY,
-                        target VARCHAR(255) NOT NULL,
-                        status BOOLEAN NOT NULL,
-                        response_time FLOAT,
-                        attempts INTEGER NOT NULL,
-                        timestamp TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                
-                # Create indexes
-                cur.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_ping_results_timestamp 
-                    ON ping_results(timestamp)
-                """)
-                cur.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_ping_results_target 
-                    ON ping_results(target)
-                """)
-                
-                # Create cleanup function
-                cur.execute(f"""
-                    CREATE OR REPLACE FUNCTION clean_old_ping_results()
-                    RETURNS TRIGGER AS $$
-                    BEGIN
-                        DELETE FROM ping_results 
-                        WHERE timestamp < NOW() - INTERVAL '{self.ttl_days} days';
-                        RETURN NULL;
-                    END;
-                    $$ LANGUAGE plpgsql
-                """)
-                
-                # Create or replace trigger
-                cur.execute("""
-                    DROP TRIGGER IF EXISTS trigger_clean_old_ping_results ON ping_results
-                """)
-                
-                cur.execute("""
-                    CREATE TRIGGER trigger_clean_old_ping_results
-                    AFTER INSERT ON ping_results
-                    EXECUTE FUNCTION clean_old_ping_results()
-                """)
-                
-                self.log("Database initialized successfully")
-                
-        except Exception as e:
-            self.log(f"Database initialization error: {str(e)}")
-            messagebox.showerror("Database Error", f"Cannot initialize database:\n{str(e)}")
-        finally:
-            if conn:
-                conn.close()
-    
-    def update_ttl(self):
-        self.ttl_days = self.ttl_var.get()
-        self.initialize_database()
-    
-    def update_attempts(self):
-        self.ping_attempts = self.attempts_var.get()
-    
-    def update_timeout(self):
-        self.ping_timeout = self.timeout_var.get()
-    
-    def get_db_connection(self):
-        return psycopg2.connect(**self.db_params)
-    
-    def load_targets_from_db(self):
-        conn = None
-        try:
-            conn = self.get_db_connection()
-            with conn.cursor() as cur:
-                cur.execute("SELECT target FROM ping_targets ORDER BY target")
-                self.targets = [row[0] for row in cur.fetchall()]
-                
-                # Update listbox
-                self.targets_listbox.delete(0, tk.END)
-                for target in self.targets:
-                    self.targets_listbox.insert(tk.END, target)
-                    # Add to status tree with default values
-                    self.status_tree.insert("", tk.END, values=(
-                        target, 
-                        "Unknown", 
-                        "N/A", 
-                        "Never", 
-                        "N/A",
-                        "0"
-                    ))
-                
-                self.log(f"Loaded {len(self.targets)} targets from database")
-                
-        except Exception as e:
-            self.log(f"Error loading targets: {str(e)}")
-        finally:
-            if conn:
-                conn.close()
-    
-    def add_target(self):
-        target = self.target_entry.get().strip()
-        if not target:
-            return
-            
-        if target in self.targets:
-            self.log(f"Target already exists: {target}")
-            return
-            
-        conn = None
-        try:
-            conn = self.get_db_connection()
-            with conn.cursor() as cur:
-                cur.execute(
-                    "INSERT INTO ping_targets (target) VALUES (%s)",
-                    (target,)
-                )
-                conn.commit()
-                
-                self.targets.append(target)
-                self.targets_listbox.insert(tk.END, target)
-                self.target_entry.delete(0, tk.END)
-                self.log(f"Added target: {target}")
-                
-                # Add to status tree with default values
-                self.status_tree.insert("", tk.END, values=(
-                    target, 
-                    "Unknown", 
-                    "N/A", 
-                    "Never", 
-                    "N/A",
-                    "0"
-                ))
-                
-        except psycopg2.IntegrityError:
-            self.log(f"Target already exists in database: {target}")
-        except Exception as e:
-            self.log(f"Error adding target: {str(e)}")
-        finally:
-            if conn:
-                conn.close()
-    
-    def remove_target(self):
-        selection = self.targets_listbox.curselection()
-        if not selection:
-            return
-            
-        index = selection[0]
-        target = self.targets_listbox.get(index)
-        
-        conn = None
-        try:
-            conn = self.get_db_connection()
-            with conn.cursor() as cur:
-                # Remove from targets table
-                cur.execute(
-                    "DELETE FROM ping_targets WHERE target = %s",
-                    (target,)
-                )
-                
-                # Remove from results table
-                cur.execute(
-                    "DELETE FROM ping_results WHERE target = %s",
-                    (target,)
-                )
-                
-                conn.commit()
-                
-                # Update UI
-                self.targets_listbox.delete(index)
-                self.targets.remove(target)
-                
-                # Remove from status tree
-                for item in self.status_tree.get_children():
-                    if self.status_tree.item(item, 'values')[0] == target:
-                        self.status_tree.delete(item)
-                        break
-                
-                self.log(f"Removed target: {target}")
-                
-        except Exception as e:
-            self.log(f"Error removing target: {str(e)}")
-        finally:
-            if conn:
-                conn.close()
-    
-    def reliable_ping(self, target):
-        attempts = 0
-        response_time = None
-        start_time = time.time()
-        
-        # Try multiple attempts
-        for attempt in range(self.ping_attempts):
-            try:
-                # First try with DNS resolution
-                response_time = ping(target, timeout=self.ping_timeout, unit='ms')
-                if response_time is not None:
-                    attempts = attempt + 1
-                    break
-                
-                # If failed, try with direct IP if it's a hostname
-                try:
-                    ip_addr = socket.gethostbyname(target)
-                    if ip_addr != target:  # Only try if we got a different IP
-                        response_time = ping(ip_addr, timeout=self.ping_timeout, unit='ms')
-                        if response_time is not None:
-                            attempts = attempt + 1
-                            break
-                except socket.gaierror:
-                    pass
-                
-            except Exception as e:
-                self.log(f"Ping attempt {attempt+1} failed for {target}: {str(e)}")
-            
-            if attempt < self.ping_attempts - 1:
-                time.sleep(0.5)  # Small delay between attempts
-        
-        status = response_time is not None
-        duration = int((time.time() - start_time) * 1000)
-        
-        return {
-            "target": target,
-            "status": status,
-            "response_time": response_time if status else None,
-            "attempts": attempts,
-            "duration": duration
-        }
-    
-    def ping_all_targets(self):
-        while not self.stop_ping:
-            cycle_start = time.time()
-            
-            # Submit all ping tasks to thread pool
-            futures = {self.executor.submit(self.reliable_ping, target): target for target in self.targets}
-            
-            # Process results as they complete
-            for future in as_completed(futures):
-                result = future.result()
-                target = result["target"]
-                status = result["status"]
-                response_time = result["response_time"]
-                attempts = result["attempts"]
-                duration = result["duration"]
-                
-                # Save to database
-                self.save_ping_result(target, status, response_time, attempts)
-                
-                # Get success rate
-                success_rate = self.get_success_rate(target)
-                
-                # Prepare UI update
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                response_str = f"{response_time:.2f}" if status else "Timeout"
-                status_str = "Online" if status else "Offline"
-                
-                self.message_queue.put(("update_status", (
-                    target,
-                    status_str,
-                    response_str,
-                    timestamp,
-                    f"{success_rate:.1f}%",
-                    f"{attempts}/{self.ping_attempts}"
-                )))
-                
-                # Log the result
-                log_msg = (f"Ping {target}: {'Success' if status else 'Timeout'} "
-                         f"(Response: {response_str}ms, Attempts: {attempts}, Duration: {duration}ms)")
-                self.message_queue.put(("log", log_msg))
-            
-            # Calculate time taken and adjust sleep time
-            cycle_time = time.time() - cycle_start
-            sleep_time = max(0, self.ping_interval - cycle_time)
-            time.sleep(sleep_time)
-    
-    def save_ping_result(self, target, status, response_time, attempts):
-        conn = None
-        try:
-            conn = self.get_db_connection()
-            with conn.cursor() as cur:
-                if response_time is not None:
-                    cur.execute(
-                        """INSERT INTO ping_results 
-                        (target, status, response_time, attempts) 
-                        VALUES (%s, %s, %s, %s)""",
-                        (target, status, float(response_time), attempts)
-                    )
-                else:
-                    cur.execute(
-                        """INSERT INTO ping_results 
-                        (target, status, response_time, attempts) 
-                        VALUES (%s, %s, NULL, %s)""",
-                        (target, status, attempts)
-                    )
-                conn.commit()
-        except Exception as e:
-            self.message_queue.put(("log", f"Database error: {str(e)}"))
-        finally:
-            if conn:
-                conn.close()
-    
-    def get_success_rate(self, target):
-        conn = None
-        try:
-            conn = self.get_db_connection()
-            with conn.cursor() as cur:
-                # Get total pings in last 24 hours
-                cur.execute("""
-                    SELECT COUNT(*) FROM ping_results 
-                    WHERE target = %s 
-                    AND timestamp >= NOW() - INTERVAL '24 hours'
-                """, (target,))
-                total = cur.fetchone()[0]
-                
-                if total == 0:
-                    return 0.0
-                
-                # Get successful pings
-                cur.execute("""
-                    SELECT COUNT(*) FROM ping_results 
-                    WHERE target = %s 
-                    AND status = TRUE
-                    AND timestamp >= NOW() - INTERVAL '24 hours'
-                """, (target,))
-                success = cur.fetchone()[0]
-                
-                return (success / total) * 100
-                
-        except Exception as e:
-            self.log(f"Error calculating success rate: {str(e)}")
-            return 0.0
-        finally:
-            if conn:
-                conn.close()
-    
-    def update_status_display(self, target, status, response_time, timestamp, success_rate, attempts):
-        # Find the item in the treeview
-        for item in self.status_tree.get_children():
-            values = self.status_tree.item(item, 'values')
-            if values[0] == target:
-                # Update the values
-                self.status_tree.item(item, values=(
-                    target,
-                    status,
-                    response_time,
-                    timestamp,
-                    success_rate,
-                    attempts
-                ))
-                
-                # Update color based on status
-                if status == "Online":
-                    self.status_tree.tag_configure('online', foreground='#7e57c2')
-                    self.status_tree.item(item, tags=('online',))
-                else:
-                    self.status_tree.tag_configure('offline', foreground='#ff5252')
-                    self.status_tree.item(item, tags=('offline',))
-                
-                # Bring to top to show most recent first
-                self.status_tree.move(item, '', 0)
-                break
-    
-    def start_monitoring(self):
-        if not self.targets:
-            messagebox.showwarning("Warning", "Please add at least one target to monitor.")
-            return
-            
-        if self.ping_thread and self.ping_thread.is_alive():
-            return
-            
-        self.stop_ping = False
-        self.start_btn.config(state=tk.DISABLED)
-        self.stop_btn.config(state=tk.NORMAL)
-        
-        self.ping_thread = threading.Thread(target=self.ping_all_targets, daemon=True)
-        self.ping_thread.start()
-        
-        self.log("Monitoring started (concurrent mode with retries)")
-        self.status_bar.config(text="Monitoring active - concurrent pinging with retries")
-    
-    def stop_monitoring(self):
-        self.stop_ping = True
-        if self.ping_thread and self.ping_thread.is_alive():
-            self.ping_thread.join(timeout=1)
-            
-        self.start_btn.config(state=tk.NORMAL)
-        self.stop_btn.config(state=tk.DISABLED)
-        self.log("Monitoring stopped")
-        self.status_bar.config(text="Monitoring stopped")
-    
-    def log(self, message):
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.log_text.insert(tk.END, f"[{timestamp}] {message}\n")
-        self.log_text.see(tk.END)
-    
-    def check_queue(self):
-        while not self.message_queue.empty():
-            message_type, content = self.message_queue.get()
-            
-            if message_type == "log":
-                self.log(content)
-            elif message_type == "update_status":
-                self.update_status_display(*content)
-        
-        self.root.after(100, self.check_queue)
-    
-    def on_closing(self):
-        self.stop_ping = True
-        if self.ping_thread and self.ping_thread.is_alive():
-            self.ping_thread.join(timeout=1)
-        self.executor.shutdown(wait=False)
-        self.root.destroy()
-
-if __name__ == "__main__":
-    root = tk.Tk()
-    app = PingMonitorApp(root)
-    root.protocol("WM_DELETE_WINDOW", app.on_closing)
-    root.mainloop()
\ No newline at end of file
+try:
+    import tkinter as tk
+    from tkinter import ttk, messagebox, scrolledtext, filedialog
+except ImportError:  # headless hosts without Tk
+    tk = None
+try:
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+except ImportError:  # history charts need matplotlib (and Tk)
+    Figure = None
+import threading
+import time
+import psycopg2
+import psycopg2.pool
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from queue import Queue, Empty, Full
+import argparse
+import asyncio
+from array import array
+from collections import deque
+import configparser
+import cProfile
+import csv
+import ctypes
+import functools
+import heapq
+import http.server
+import io
+import ipaddress
+import itertools
+import json
+import math
+import multiprocessing
+import multiprocessing.connection
+import os
+import platform
+import pstats
+import random
+import re
+import shutil
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import urllib.request
+import zlib
+
+# Reference point for time-to-first-probe
+PROCESS_STARTED = time.monotonic()
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+ICMP_PAYLOAD = b"VICS-PING-MONITOR-PAYLOAD-0123456"
+
+
+def icmp_checksum(data):
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def build_echo_request(ident, seq, payload=ICMP_PAYLOAD):
+    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    checksum = icmp_checksum(header + payload)
+    return struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, checksum, ident, seq) + payload
+
+
+class TimerWheel:
+    # Hashed timing wheel: O(1) schedule/cancel and a single loop callback
+    # per tick, no matter how many probes are in flight.
+    def __init__(self, loop, tick=0.005, size=1024):
+        self.loop = loop
+        self.tick = tick
+        self.slots = [{} for _ in range(size)]
+        self.position = 0
+        self.pending = 0
+        self.handles = itertools.count(1)
+        self.next_tick = None
+        self.timer = None
+
+    def schedule(self, delay, callback, *args):
+        ticks = max(1, int(math.ceil(delay / self.tick)))
+        index = (self.position + ticks) % len(self.slots)
+        handle = (index, next(self.handles))
+        self.slots[index][handle[1]] = [(ticks - 1) // len(self.slots), callback, args]
+        self.pending += 1
+        if self.timer is None:
+            self.next_tick = self.loop.time() + self.tick
+            self.timer = self.loop.call_at(self.next_tick, self._advance)
+        return handle
+
+    def cancel(self, handle):
+        index, key = handle
+        if self.slots[index].pop(key, None) is not None:
+            self.pending -= 1
+
+    def _advance(self):
+        self.timer = None
+        now = self.loop.time()
+        # Catch up on every tick we missed if the loop was busy
+        while self.next_tick <= now and self.pending:
+            self.position = (self.position + 1) % len(self.slots)
+            slot = self.slots[self.position]
+            expired = []
+            for key, entry in slot.items():
+                if entry[0] == 0:
+                    expired.append(key)
+                else:
+                    entry[0] -= 1
+            for key in expired:
+                _, callback, args = slot.pop(key)
+                self.pending -= 1
+                callback(*args)
+            self.next_tick += self.tick
+        if self.pending:
+            self.timer = self.loop.call_at(self.next_tick, self._advance)
+
+
+class RawIcmpTransport:
+    # Privileged SOCK_RAW socket: replies carry the IP header and every
+    # ICMP packet on the host, so we filter on our own identifier.
+    kind = "raw"
+    header_included = True
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, self.socket_type(), socket.IPPROTO_ICMP)
+        self.sock.setblocking(False)
+        for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+            try:
+                self.sock.setsockopt(socket.SOL_SOCKET, option, 4 * 1024 * 1024)
+            except OSError:
+                pass
+        self.ident = os.getpid() & 0xFFFF
+        self.backlog = []
+        self.loop = None
+        self.on_reply = None
+        if self.header_included:
+            self.attach_ident_filter()
+
+    @staticmethod
+    def socket_type():
+        return socket.SOCK_RAW
+
+    def attach_ident_filter(self):
+        # Classic BPF: accept only echo replies carrying our identifier, so
+        # several prober processes don't each parse every reply on the host
+        program = [
+            (0xb1, 0, 0, 0),                # ldxb 4*([0]&0xf)   IP header length
+            (0x50, 0, 0, 0),                # ldb [x+0]          ICMP type
+            (0x15, 0, 3, ICMP_ECHO_REPLY),  # jeq #0, next, reject
+            (0x48, 0, 0, 4),                # ldh [x+4]          identifier
+            (0x15, 0, 1, self.ident),       # jeq #ident, next, reject
+            (0x06, 0, 0, 0x40000),          # ret #262144        accept
+            (0x06, 0, 0, 0),                # ret #0             reject
+        ]
+        instructions = b"".join(struct.pack("HBBI", *instruction) for instruction in program)
+        self.filter_buffer = ctypes.create_string_buffer(instructions)
+        fprog = struct.pack("HL", len(program), ctypes.addressof(self.filter_buffer))
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, getattr(socket, "SO_ATTACH_FILTER", 26), fprog)
+        except OSError:
+            pass  # not Linux; _read() filters in userspace anyway
+
+    def open(self, loop, on_reply):
+        self.loop = loop
+        self.on_reply = on_reply
+        loop.add_reader(self.sock.fileno(), self._read)
+
+    def send(self, addr, seq):
+        packet = build_echo_request(self.ident, seq)
+        if self.backlog:
+            self.backlog.append((addr, packet))
+            return
+        try:
+            self.sock.sendto(packet, (addr, 0))
+        except (BlockingIOError, InterruptedError):
+            self.backlog.append((addr, packet))
+            self.loop.add_writer(self.sock.fileno(), self._flush)
+
+    def _flush(self):
+        while self.backlog:
+            addr, packet = self.backlog[0]
+            try:
+                self.sock.sendto(packet, (addr, 0))
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                pass
+            self.backlog.pop(0)
+        self.loop.remove_writer(self.sock.fileno())
+
+    def _read(self):
+        while True:
+            try:
+                data, (addr, _) = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            received = time.perf_counter()
+            if self.header_included:
+                data = data[(data[0] & 0x0F) * 4:]
+            if len(data) < 8:
+                continue
+            icmp_type, _, _, ident, seq = struct.unpack("!BBHHH", data[:8])
+            if icmp_type != ICMP_ECHO_REPLY:
+                continue
+            if self.header_included and ident != self.ident:
+                continue
+            self.on_reply(addr, seq, received)
+
+    def close(self):
+        if self.loop is not None:
+            self.loop.remove_reader(self.sock.fileno())
+            self.loop.remove_writer(self.sock.fileno())
+        self.sock.close()
+
+
+class DatagramIcmpTransport(RawIcmpTransport):
+    # Unprivileged ICMP (net.ipv4.ping_group_range): the kernel owns the
+    # identifier and strips the IP header, so replies match on sequence.
+    kind = "dgram"
+    header_included = False
+
+    @staticmethod
+    def socket_type():
+        return socket.SOCK_DGRAM
+
+
+class LoopbackTransport:
+    # In-process stand-in network for tests and setups without ICMP
+    # privileges. rtt(addr) returns seconds, or None to drop the probe.
+    kind = "loopback"
+
+    def __init__(self, rtt=None, loss=0.0):
+        self.rtt = rtt or (lambda addr: 0.001)
+        self.loss = loss
+        self.loop = None
+        self.on_reply = None
+
+    def open(self, loop, on_reply):
+        self.loop = loop
+        self.on_reply = on_reply
+
+    def send(self, addr, seq):
+        delay = self.rtt(addr)
+        if delay is None or (self.loss and random.random() < self.loss):
+            return
+        self.loop.call_later(delay, self._deliver, addr, seq)
+
+    def _deliver(self, addr, seq):
+        self.on_reply(addr, seq, time.perf_counter())
+
+    def close(self):
+        pass
+
+
+ICMP_TRANSPORTS = {
+    "raw": RawIcmpTransport,
+    "dgram": DatagramIcmpTransport,
+    "loopback": LoopbackTransport,
+}
+
+
+def open_icmp_transport(kind="auto"):
+    if not isinstance(kind, str):
+        return kind
+    kinds = ("raw", "dgram") if kind == "auto" else (kind,)
+    error = None
+    for name in kinds:
+        try:
+            return ICMP_TRANSPORTS[name]()
+        except OSError as e:
+            error = e
+    raise error
+
+
+class DnsCache:
+    # Hostname resolution for the ICMP engine's event loop. Answers are
+    # cached for `ttl` seconds and failures for `negative_ttl`; entries are
+    # refreshed in the background once `refresh_ahead` of their TTL has
+    # passed, so probes keep using the cached address instead of waiting on
+    # the resolver. Concurrent lookups of one name share a single query, and
+    # at most `concurrency` queries run at once (getaddrinfo occupies an
+    # executor thread for as long as the resolver takes). `resolver`, an
+    # async callable returning an IPv4 address, replaces getaddrinfo.
+    def __init__(self, loop, ttl=300, negative_ttl=30, refresh_ahead=0.8, timeout=5.0, concurrency=16,
+                 resolver=None):
+        self.loop = loop
+        self.resolver = resolver
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.refresh_ahead = refresh_ahead
+        self.timeout = timeout
+        self.entries = {}  # name -> (address, error, refresh_at, expires_at)
+        self.in_flight = {}
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.queries = 0
+        self.failures = 0
+
+    async def resolve(self, name):
+        # Returns (address, None), or (None, error message) on DNS failure
+        try:
+            return str(ipaddress.IPv4Address(name)), None
+        except ValueError:
+            pass
+        entry = self.entries.get(name)
+        if entry is not None:
+            address, error, refresh_at, expires_at = entry
+            now = self.loop.time()
+            if now < expires_at:
+                if now >= refresh_at:
+                    self.refresh(name)
+                return address, error
+            if address is not None:
+                # Expired but known: probe the last address while refreshing
+                self.refresh(name)
+                return address, None
+        return await self.refresh(name)
+
+    def refresh(self, name):
+        task = self.in_flight.get(name)
+        if task is None:
+            task = self.loop.create_task(self.lookup(name))
+            self.in_flight[name] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(name, None))
+        return task
+
+    async def lookup(self, name):
+        async with self.semaphore:
+            self.queries += 1
+            try:
+                if self.resolver is not None:
+                    address = await asyncio.wait_for(self.resolver(name), self.timeout)
+                else:
+                    info = await asyncio.wait_for(
+                        self.loop.getaddrinfo(name, None, family=socket.AF_INET, type=socket.SOCK_RAW),
+                        self.timeout)
+                    address = info[0][4][0]
+                error = None
+            except asyncio.TimeoutError:
+                address, error = None, "resolver timeout"
+            except socket.gaierror as e:
+                address, error = None, e.strerror or str(e)
+            except (IndexError, UnicodeError) as e:
+                address, error = None, str(e) or "no address"
+        now = self.loop.time()
+        if address is not None:
+            ttl = self.ttl
+        else:
+            self.failures += 1
+            ttl = self.negative_ttl
+            previous = self.entries.get(name)
+            if previous is not None and previous[0] is not None and error == "resolver timeout":
+                # A slow resolver does not make a known host vanish; keep the
+                # old address and ask again after the negative TTL
+                address, error = previous[0], None
+        self.entries[name] = (address, error, now + ttl * self.refresh_ahead, now + ttl)
+        return address, error
+
+    def retain(self, names):
+        # Forget hosts that are no longer monitored (address targets have
+        # no entries, so the sizes say nothing about what was removed)
+        for name in set(self.entries) - set(names):
+            del self.entries[name]
+
+
+def burst_stats(rtts):
+    # Summary of one burst, RTTs in send order (None = lost): min/avg/max
+    # and standard deviation of the replies, jitter as the mean difference
+    # between consecutive replies, and how many echoes were lost
+    received = [rtt for rtt in rtts if rtt is not None]
+    stats = {
+        "response_time": None,
+        "packets_sent": len(rtts),
+        "packets_lost": len(rtts) - len(received),
+        "rtt_min": None,
+        "rtt_max": None,
+        "rtt_stddev": None,
+        "jitter": None
+    }
+    if received:
+        mean = sum(received) / len(received)
+        stats.update(
+            response_time=mean,
+            rtt_min=min(received),
+            rtt_max=max(received),
+            rtt_stddev=math.sqrt(sum((rtt - mean) ** 2 for rtt in received) / len(received))
+        )
+    if len(received) > 1:
+        stats["jitter"] = sum(abs(b - a) for a, b in zip(received, received[1:])) / (len(received) - 1)
+    return stats
+
+
+class IcmpEngine:
+    # Single event loop ICMP prober. All echo requests go out over one
+    # socket, replies are matched by (address, sequence) and per-probe
+    # timeouts are driven by a timer wheel, so thousands of targets cost
+    # one thread instead of one worker each. A probe is a single (possibly
+    # hedged) echo, or with burst > 1 a burst of echoes burst_spacing
+    # seconds apart whose replies are all awaited together; retries are
+    # scheduled by the caller.
+    def __init__(self, transport="auto", send_batch=64, dns_ttl=300, dns_negative_ttl=30,
+                 burst=1, burst_spacing=0.02, resolver=None, message_queue=None):
+        self.transport = open_icmp_transport(transport)
+        self.message_queue = message_queue
+        self.resolver = resolver
+        self.send_batch = send_batch
+        self.burst = burst
+        self.burst_spacing = burst_spacing
+        self.dns_ttl = dns_ttl
+        self.dns_negative_ttl = dns_negative_ttl
+        self.dns = None
+        self.loop = None
+        self.thread = None
+        self.wheel = None
+        self.in_flight = {}
+        self.sequence = itertools.count(1)
+        self.hedges = 0
+        self.hedged = {}  # future -> echoes still waiting for a reply
+        self.probe_errors = 0
+        self.error_logged_at = -math.inf
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._open(), self.loop).result()
+
+    async def _open(self):
+        self.wheel = TimerWheel(self.loop)
+        self.dns = DnsCache(self.loop, self.dns_ttl, self.dns_negative_ttl, resolver=self.resolver)
+        self.transport.open(self.loop, self._on_reply)
+
+    def describe(self):
+        return f"{self.transport.kind} socket"
+
+    def close(self):
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self._shutdown)
+        self.thread.join(timeout=1)
+        self.loop = None
+
+    def _shutdown(self):
+        # Abandon probes still in flight, then stop the loop
+        self.transport.close()
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        finished = asyncio.gather(*tasks, return_exceptions=True)
+        finished.add_done_callback(lambda _: self.loop.stop())
+
+    def sync(self, targets):
+        # The monitored target list changed; drop DNS entries of removed hosts
+        self.loop.call_soon_threadsafe(self.dns.retain, list(targets))
+
+    def submit(self, targets, timeout, hedge_after, deliver):
+        # Non-blocking entry point for the scheduler: probes start on the
+        # loop and deliver(result) is called on the loop thread as each ends
+        asyncio.run_coroutine_threadsafe(
+            self.launch(list(targets), timeout, hedge_after, deliver), self.loop)
+
+    def ping_many(self, targets, timeout, hedge_after=None):
+        # Blocking one-off probe of a whole list
+        future = asyncio.run_coroutine_threadsafe(
+            self.probe_all(targets, timeout, hedge_after), self.loop)
+        return future.result()
+
+    async def launch(self, targets, timeout, hedge_after=None, deliver=None):
+        # Start probes in small batches and yield between them so the
+        # reader drains replies instead of overflowing the receive buffer
+        tasks = []
+        for index, target in enumerate(targets):
+            task = self.loop.create_task(self.probe(target, timeout, hedge_after))
+            if deliver is not None:
+                task.add_done_callback(functools.partial(self.probe_done, target, deliver))
+            tasks.append(task)
+            if index % self.send_batch == self.send_batch - 1:
+                await asyncio.sleep(0)
+        return tasks
+
+    async def probe_all(self, targets, timeout, hedge_after=None):
+        results = await asyncio.gather(*await self.launch(targets, timeout, hedge_after),
+                                       return_exceptions=True)
+        return [self.probe_failed(target, result) if isinstance(result, BaseException) else result
+                for target, result in zip(targets, results)]
+
+    def probe_done(self, target, deliver, task):
+        # A probe that raised still delivers a (failed) result, so the
+        # scheduler sees the check end and plans the next one
+        if task.cancelled():
+            return
+        error = task.exception()
+        deliver(task.result() if error is None else self.probe_failed(target, error))
+
+    def probe_failed(self, target, error):
+        self.probe_errors += 1
+        detail = f"{type(error).__name__}: {error}"
+        now = time.monotonic()
+        if self.message_queue is not None and now - self.error_logged_at >= 60:
+            # At most one line a minute, in case every probe fails
+            self.error_logged_at = now
+            self.message_queue.put(("log", ("error", f"Probe of {target} failed ({self.probe_errors} "
+                                                     f"probe errors so far): {detail}")))
+        finished = time.time()
+        return {
+            "target": target,
+            "status": False,
+            "response_time": None,
+            "attempts": 0,
+            "duration": 0,
+            "dns_error": None,
+            "address": None,
+            "burst": None,
+            "dns_time": 0.0,
+            "echo_time": None,
+            "finished": finished,
+            # Set only here; worker processes pass it on for their parent to log
+            "error": detail
+        }
+
+    async def probe(self, target, timeout, hedge_after=None):
+        start_time = time.time()
+        response_time = None
+        stats = None
+        addr, dns_error = await self.dns.resolve(target)
+        resolved = time.time()
+        if addr is not None:
+            if self.burst > 1:
+                stats = burst_stats(await self.echo_burst(addr, timeout))
+                response_time = stats["response_time"]
+            else:
+                response_time = await self.echo(addr, timeout, hedge_after)
+        finished = time.time()
+        status = response_time is not None
+        return {
+            "target": target,
+            "status": status,
+            "response_time": response_time if status else None,
+            "attempts": 1 if status else 0,
+            "duration": int((finished - start_time) * 1000),
+            # Set when the name did not resolve, i.e. nothing was probed
+            "dns_error": dns_error,
+            # Address probed, for grouping failures by subnet
+            "address": addr,
+            # burst_stats() of a burst probe, None for single echoes
+            "burst": stats,
+            # Stage timings for EngineInstruments (seconds, wall clock)
+            "dns_time": resolved - start_time,
+            "echo_time": finished - resolved if addr is not None else None,
+            "finished": finished
+        }
+
+    async def echo_burst(self, addr, timeout):
+        # RTTs in ms (None = lost) of burst echoes sent burst_spacing apart
+        futures = []
+        for index in range(self.burst):
+            if index:
+                await asyncio.sleep(self.burst_spacing)
+            future = self.loop.create_future()
+            self._send_echo(future, addr, timeout)
+            futures.append(future)
+        return await asyncio.gather(*futures)
+
+    async def echo(self, addr, timeout, hedge_after=None):
+        # Returns the round-trip time in ms, or None on timeout. With
+        # hedge_after, a second echo goes out if the first has no reply by
+        # then; whichever answers first wins, both give up at `timeout`.
+        future = self.loop.create_future()
+        self._send_echo(future, addr, timeout)
+        if hedge_after and hedge_after < timeout:
+            self.wheel.schedule(hedge_after, self._hedge, future, addr, timeout - hedge_after)
+        return await future
+
+    def _send_echo(self, future, addr, timeout):
+        seq = next(self.sequence) & 0xFFFF
+        if seq == 0:
+            seq = next(self.sequence) & 0xFFFF
+        key = (addr, seq)
+        sent = time.perf_counter()
+        handle = self.wheel.schedule(timeout, self._on_timeout, key)
+        self.in_flight[key] = (future, sent, handle)
+        try:
+            self.transport.send(addr, seq)
+        except OSError:
+            self._on_timeout(key)
+            self.wheel.cancel(handle)
+
+    def _hedge(self, future, addr, timeout):
+        if not future.done():
+            self.hedges += 1
+            self.hedged[future] = 2
+            self._send_echo(future, addr, timeout)
+
+    def _on_reply(self, addr, seq, received):
+        probe = self.in_flight.pop((addr, seq), None)
+        if probe is None:
+            return
+        future, sent, handle = probe
+        self.wheel.cancel(handle)
+        if not future.done():
+            self.hedged.pop(future, None)
+            future.set_result((received - sent) * 1000)
+
+    def _on_timeout(self, key):
+        probe = self.in_flight.pop(key, None)
+        if probe is None or probe[0].done():
+            return
+        # A hedged probe fails only when its last echo times out
+        future = probe[0]
+        if future in self.hedged:
+            self.hedged[future] -= 1
+            if self.hedged[future]:
+                return
+            del self.hedged[future]
+        future.set_result(None)
+
+
+def probe_worker(conn, transport, dns_ttl, dns_negative_ttl, burst, burst_spacing):
+    # Body of a ShardedProber worker process: owns one ICMP engine, probes
+    # the targets it is asked to and streams results back in batches as
+    # they complete. The shard's target list only scopes the DNS cache.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        icmp = IcmpEngine(transport, dns_ttl=dns_ttl, dns_negative_ttl=dns_negative_ttl,
+                          burst=burst, burst_spacing=burst_spacing)
+        icmp.start()
+    except OSError as e:
+        conn.send(("error", str(e)))
+        return
+    conn.send(("ready", icmp.transport.kind))
+    outbox = Queue()
+    
+    def send_results():
+        while True:
+            item = outbox.get()
+            if item is None:
+                return
+            batch = [item]
+            while len(batch) < 1000:
+                try:
+                    item = outbox.get_nowait()
+                except Empty:
+                    break
+                if item is None:
+                    outbox.put(None)
+                    break
+                batch.append(item)
+            try:
+                conn.send(("results", batch))
+            except OSError:
+                return
+    
+    sender = threading.Thread(target=send_results, daemon=True)
+    sender.start()
+    targets = {}
+    try:
+        while True:
+            command = conn.recv()
+            if command[0] == "assign":
+                targets = dict.fromkeys(command[1])
+                icmp.sync(targets)
+            elif command[0] == "add":
+                targets.update(dict.fromkeys(command[1]))
+            elif command[0] == "remove":
+                for target in command[1]:
+                    targets.pop(target, None)
+                icmp.sync(targets)
+            elif command[0] == "probe":
+                _, tag, batch, timeout, hedge_after = command
+                icmp.submit(batch, timeout, hedge_after, lambda result, tag=tag: outbox.put((tag, result)))
+            elif command[0] == "stop":
+                break
+    except (EOFError, OSError):
+        pass
+    finally:
+        outbox.put(None)
+        icmp.close()
+
+
+class ShardedProber:
+    # Spreads probing over worker processes, one ICMP engine each. Targets
+    # are hash-partitioned onto shards; the parent keeps every shard's
+    # target list and sends only additions/removals to the workers. Probe
+    # requests go to the owning worker and a reader thread hands results
+    # back as they arrive. A worker that dies or stops answering within the
+    # probe budget is replaced by the reader thread (outside the lock, with
+    # backoff while starting fails) with its shard, and its outstanding
+    # probes are re-issued. Same sync()/submit()/ping_many() interface as
+    # IcmpEngine.
+    def __init__(self, workers, transport="auto", reply_margin=5.0, dns_ttl=300, dns_negative_ttl=30,
+                 burst=1, burst_spacing=0.02, message_queue=None):
+        self.workers = workers
+        self.transport_kind = transport
+        self.burst = burst
+        self.burst_spacing = burst_spacing
+        self.dns_ttl = dns_ttl
+        self.dns_negative_ttl = dns_negative_ttl
+        self.reply_margin = reply_margin
+        self.context = multiprocessing.get_context("spawn")
+        self.processes = [None] * workers
+        self.pipes = [None] * workers
+        self.shards = [dict() for _ in range(workers)]
+        # Per shard: (tag, target) -> (timeout, hedge_after, deadline)
+        self.outstanding = [dict() for _ in range(workers)]
+        self.deliveries = {}  # tag -> [deliver, results still due]
+        self.tags = itertools.count(1)
+        self.lock = threading.RLock()
+        self.reader = None
+        self.stopping = False
+        self.kind = None
+        self.restarts = 0
+        self.message_queue = message_queue
+        self.respawn_at = [None] * workers    # monotonic time a stopped worker is started again
+        self.respawn_delay = [1.0] * workers  # seconds before the next attempt if that fails
+        self.probe_errors = 0
+        self.error_logged_at = -math.inf
+
+    def shard_of(self, target):
+        return zlib.crc32(target.encode("utf-8")) % self.workers
+
+    def start(self):
+        for index in range(self.workers):
+            self.install(index, *self.spawn(index))
+        self.reader = threading.Thread(target=self.collect, daemon=True)
+        self.reader.start()
+
+    def spawn(self, index):
+        # Start a worker and wait for its handshake (up to 30s). Touches no
+        # shared state, so it runs without the lock.
+        parent, child = self.context.Pipe()
+        process = self.context.Process(
+            target=probe_worker,
+            args=(child, self.transport_kind, self.dns_ttl, self.dns_negative_ttl,
+                  self.burst, self.burst_spacing),
+            name=f"probe-shard-{index}",
+            daemon=True
+        )
+        process.start()
+        child.close()
+        if not parent.poll(30):
+            process.terminate()
+            raise OSError(f"Probe worker {index} did not start")
+        status, detail = parent.recv()
+        if status == "error":
+            process.join(timeout=1)
+            raise OSError(detail)
+        return process, parent, detail
+
+    def install(self, index, process, pipe, kind):
+        # Hand a started worker its shard and re-issue everything the
+        # previous one still owed us
+        with self.lock:
+            self.kind = kind
+            self.processes[index] = process
+            self.pipes[index] = pipe
+            self.respawn_at[index] = None
+            self.respawn_delay[index] = 1.0
+            if self.shards[index]:
+                self.send(index, ("assign", list(self.shards[index])))
+            requests = {}
+            for (tag, target), (timeout, hedge_after, _) in self.outstanding[index].items():
+                requests.setdefault((tag, timeout, hedge_after), []).append(target)
+            for (tag, timeout, hedge_after), targets in requests.items():
+                self.request(index, tag, targets, timeout, hedge_after)
+
+    def restart(self, index):
+        # With the lock held: stop the worker and have the reader thread
+        # start a new one. Until then commands for the shard are dropped;
+        # the new worker gets the shard and the outstanding probes.
+        process = self.processes[index]
+        if process is not None and process.is_alive():
+            process.terminate()
+            process.join(timeout=1)
+        if self.pipes[index] is not None:
+            self.pipes[index].close()
+        self.processes[index] = None
+        self.pipes[index] = None
+        if self.respawn_at[index] is None:
+            self.respawn_at[index] = time.monotonic()
+        self.restarts += 1
+
+    def respawn(self):
+        # Reader thread: start the workers that are due, outside the lock
+        # so submit() is not held up for a slow handshake
+        now = time.monotonic()
+        with self.lock:
+            due = [index for index, at in enumerate(self.respawn_at) if at is not None and at <= now]
+        for index in due:
+            if self.stopping:
+                return
+            try:
+                started = self.spawn(index)
+            except Exception as e:
+                delay = self.respawn_delay[index]
+                with self.lock:
+                    self.respawn_at[index] = time.monotonic() + delay
+                    self.respawn_delay[index] = min(delay * 2, 60.0)
+                if self.message_queue is not None:
+                    self.message_queue.put(("log", ("error", f"Probe worker {index} did not restart "
+                                                             f"({str(e)}), retrying in {delay:g}s")))
+                continue
+            self.install(index, *started)
+
+    def describe(self):
+        return f"{self.workers} worker processes, {self.kind} sockets"
+
+    def budget(self, timeout):
+        return timeout + (self.burst - 1) * self.burst_spacing + self.reply_margin
+
+    def sync(self, targets):
+        # Diff the wanted target list against the shards and ship the deltas
+        wanted = set(targets)
+        added = [[] for _ in range(self.workers)]
+        removed = [[] for _ in range(self.workers)]
+        with self.lock:
+            for index, shard in enumerate(self.shards):
+                for target in shard:
+                    if target not in wanted:
+                        removed[index].append(target)
+            for target in targets:
+                index = self.shard_of(target)
+                if target not in self.shards[index]:
+                    added[index].append(target)
+            for index in range(self.workers):
+                for target in removed[index]:
+                    del self.shards[index][target]
+                for target in added[index]:
+                    self.shards[index][target] = None
+                if removed[index]:
+                    self.send(index, ("remove", removed[index]))
+                if added[index]:
+                    self.send(index, ("add", added[index]))
+
+    def send(self, index, command):
+        # A restarted worker gets its shard and outstanding probes anyway
+        pipe = self.pipes[index]
+        if pipe is None:
+            return
+        try:
+            pipe.send(command)
+        except OSError:
+            self.restart(index)
+
+    def request(self, index, tag, targets, timeout, hedge_after):
+        deadline = time.monotonic() + self.budget(timeout)
+        for target in targets:
+            self.outstanding[index][(tag, target)] = (timeout, hedge_after, deadline)
+        self.send(index, ("probe", tag, targets, timeout, hedge_after))
+
+    def submit(self, targets, timeout, hedge_after, deliver):
+        # deliver(result) is called on the reader thread
+        if not targets:
+            return
+        batches = [[] for _ in range(self.workers)]
+        for target in targets:
+            batches[self.shard_of(target)].append(target)
+        with self.lock:
+            tag = next(self.tags)
+            self.deliveries[tag] = [deliver, len(targets)]
+            for index, batch in enumerate(batches):
+                if batch:
+                    self.request(index, tag, batch, timeout, hedge_after)
+
+    def ping_many(self, targets, timeout, hedge_after=None):
+        results = Queue()
+        self.submit(targets, timeout, hedge_after, results.put)
+        collected = []
+        deadline = time.monotonic() + 2 * self.budget(timeout)
+        while len(collected) < len(targets):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                collected.append(results.get(timeout=remaining))
+            except Empty:
+                break
+        return collected
+
+    def collect(self):
+        # Reader thread: route results to their submitters, restart workers
+        # whose pipe broke or whose probes are overdue
+        while not self.stopping:
+            with self.lock:
+                waiting = {pipe: index for index, pipe in enumerate(self.pipes) if pipe is not None}
+            for pipe in multiprocessing.connection.wait(list(waiting), 0.5):
+                index = waiting[pipe]
+                try:
+                    message = pipe.recv()
+                except (EOFError, OSError):
+                    with self.lock:
+                        if not self.stopping and self.pipes[index] is pipe:
+                            self.restart(index)
+                    continue
+                if message[0] == "results":
+                    self.deliver(index, message[1])
+            now = time.monotonic()
+            with self.lock:
+                for index, outstanding in enumerate(self.outstanding):
+                    if (not self.stopping and self.pipes[index] is not None
+                            and any(entry[2] < now for entry in outstanding.values())):
+                        self.restart(index)
+            self.respawn()
+
+    def deliver(self, index, results):
+        ready = []
+        with self.lock:
+            for tag, result in results:
+                # Results re-issued after a restart may arrive twice
+                if self.outstanding[index].pop((tag, result["target"]), None) is None:
+                    continue
+                entry = self.deliveries[tag]
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.deliveries[tag]
+                ready.append((entry[0], result))
+        for deliver, result in ready:
+            if "error" in result:
+                self.probe_failed(result)
+            deliver(result)
+
+    def probe_failed(self, result):
+        self.probe_errors += 1
+        now = time.monotonic()
+        if self.message_queue is not None and now - self.error_logged_at >= 60:
+            self.error_logged_at = now
+            self.message_queue.put(("log", ("error", f"Probe of {result['target']} failed "
+                                                     f"({self.probe_errors} probe errors so far): "
+                                                     f"{result['error']}")))
+
+    def close(self):
+        self.stopping = True
+        for index, pipe in enumerate(self.pipes):
+            if pipe is None:
+                continue
+            try:
+                pipe.send(("stop",))
+            except OSError:
+                pass
+        for process in self.processes:
+            if process is not None:
+                process.join(timeout=1)
+                if process.is_alive():
+                    process.terminate()
+        if self.reader:
+            self.reader.join(timeout=1)
+
+
+class RetryPolicy:
+    # How one check of a target is retried: up to `attempts` echoes spaced
+    # retry_delay seconds apart, each hedged with a second echo after
+    # hedge_after seconds without a reply (None or 0 = no hedging)
+    def __init__(self, attempts=2, retry_delay=0.5, hedge_after=None):
+        self.attempts = attempts
+        self.retry_delay = retry_delay
+        self.hedge_after = hedge_after or None
+
+    def override(self, attempts=None, retry_delay=None, hedge_after=None):
+        # Per-target settings on top of this policy; None keeps ours
+        return RetryPolicy(
+            attempts or self.attempts,
+            self.retry_delay if retry_delay is None else retry_delay,
+            self.hedge_after if hedge_after is None else hedge_after
+        )
+
+    def cost(self, burst=1):
+        # Echo requests one attempt may send (bursts are never hedged)
+        if burst > 1:
+            return burst
+        return 2 if self.hedge_after else 1
+
+
+class TargetSchedule:
+    __slots__ = ("interval", "policy", "due", "failures", "history", "in_flight", "attempt", "started", "lag")
+
+    def __init__(self, interval=None, policy=None):
+        self.interval = interval  # Override of the default interval
+        self.policy = policy      # (attempts, retry_delay, hedge_after) overrides
+        self.due = None
+        self.failures = 0         # Consecutive failed checks
+        self.history = 0          # Last 8 check outcomes, newest in bit 0
+        self.in_flight = False
+        self.attempt = 0          # Attempt number within the current check
+        self.started = 0.0
+        self.lag = 0.0            # Launch delay of the check's first attempt
+
+
+class ProbeScheduler:
+    # Deadline scheduler for per-target probe cadence. A heap keyed by
+    # next-due time decides what to probe; every target is rescheduled from
+    # its own result, so a dead host with retries no longer holds up the
+    # rest. Healthy targets run at their interval, just-failed and flapping
+    # ones are re-checked at min_interval, and targets down for longer back
+    # off exponentially up to max_interval. Jitter keeps targets from
+    # falling into step, and a token bucket caps the rate at max_pps echo
+    # requests per second.
+    #
+    # Retries are follow-up entries on the same heap: a failed attempt is
+    # due again retry_delay later and only the last attempt of a check (or
+    # the first success) produces a result, so nothing waits in between.
+    fast_retries = 3     # Failures re-checked quickly before backing off
+    flap_transitions = 3  # Status changes within the last 8 results
+
+    def __init__(self, interval=3, min_interval=1, max_interval=300, max_pps=10000,
+                 backoff=2.0, jitter=0.1, burst=1, instruments=None):
+        self.interval = interval
+        self.instruments = instruments
+        self.burst = burst
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_pps = max_pps
+        self.backoff = backoff
+        self.jitter = jitter
+        self.heap = []
+        self.state = {}
+        self.tokens = 0.0
+        self.refilled = time.monotonic()
+        self.retries = 0
+        self.launched = 0   # Attempts handed to the prober
+        self.max_lag = 0.0  # Worst launch delay past the deadline, reset by readers
+
+    def sync(self, targets, intervals=None, policies=None):
+        # New targets start evenly spread over their first interval, the
+        # first one right away, so a large list does not go out in one burst
+        intervals = intervals or {}
+        policies = policies or {}
+        now = time.monotonic()
+        wanted = set(targets)
+        for target in [target for target in self.state if target not in wanted]:
+            del self.state[target]
+        added = []
+        for target in targets:
+            state = self.state.get(target)
+            if state is None:
+                state = self.state[target] = TargetSchedule(intervals.get(target), policies.get(target))
+                added.append(target)
+            else:
+                state.interval = intervals.get(target)
+                state.policy = policies.get(target)
+        for index, target in enumerate(added):
+            self.push(target, now + self.base_interval(self.state[target]) * index / len(added))
+
+    def base_interval(self, state):
+        return state.interval or self.interval
+
+    def policy_of(self, target, default):
+        state = self.state.get(target)
+        if state is None or state.policy is None:
+            return default
+        return default.override(*state.policy)
+
+    def push(self, target, due):
+        self.state[target].due = due
+        heapq.heappush(self.heap, (due, target))
+
+    def refill(self, now):
+        # Bucket holds 50ms worth of budget, and at least one probe
+        capacity = max(2, self.burst, self.max_pps * 0.05)
+        self.tokens = min(capacity, self.tokens + (now - self.refilled) * self.max_pps)
+        self.refilled = now
+
+    def due(self, default):
+        # Pop the targets whose deadline passed, as far as the budget
+        # allows. Returns {hedge_after: [target, ...]}.
+        now = time.monotonic()
+        self.refill(now)
+        batches = {}
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            due, target = heap[0]
+            state = self.state.get(target)
+            if state is None or state.due != due or state.in_flight:
+                heapq.heappop(heap)
+                continue  # removed or rescheduled since
+            policy = self.policy_of(target, default)
+            cost = policy.cost(self.burst)
+            if self.tokens < cost:
+                break
+            heapq.heappop(heap)
+            self.tokens -= cost
+            self.launched += 1
+            lag = now - due
+            self.max_lag = max(self.max_lag, lag)
+            if self.instruments:
+                self.instruments.record("schedule", lag)
+            state.in_flight = True
+            if state.attempt == 0:
+                state.attempt = 1
+                state.started = now
+                state.lag = lag
+            batches.setdefault(policy.hedge_after, []).append(target)
+        return batches
+
+    def next_wakeup(self):
+        # Seconds until the next target is due and affordable
+        heap = self.heap
+        while heap:
+            due, target = heap[0]
+            state = self.state.get(target)
+            if state is not None and state.due == due and not state.in_flight:
+                break
+            heapq.heappop(heap)
+        if not heap:
+            return None
+        wait = heap[0][0] - time.monotonic()
+        if self.tokens < self.burst:
+            wait = max(wait, (self.burst - self.tokens) / self.max_pps)
+        return max(0.0, wait)
+
+    def complete(self, result, default):
+        # Account for one finished attempt. Returns the check's result once
+        # it is final, None while a retry is pending or the target is gone.
+        target = result["target"]
+        state = self.state.get(target)
+        if state is None or not state.in_flight:
+            return None
+        state.in_flight = False
+        now = time.monotonic()
+        succeeded = result["status"]
+        policy = self.policy_of(target, default)
+        if not succeeded and not result.get("dns_error") and state.attempt < policy.attempts:
+            state.attempt += 1
+            self.retries += 1
+            self.push(target, now + policy.retry_delay)
+            return None
+        result = dict(result,
+                      attempts=state.attempt if succeeded else 0,
+                      duration=int((now - state.started) * 1000),
+                      lag=state.lag)
+        state.attempt = 0
+        state.history = ((state.history << 1) | (1 if succeeded else 0)) & 0xFF
+        base = self.base_interval(state)
+        if succeeded:
+            state.failures = 0
+            if bin((state.history ^ (state.history >> 1)) & 0x7F).count("1") >= self.flap_transitions:
+                interval = min(base, self.min_interval)
+            else:
+                interval = base
+        else:
+            state.failures += 1
+            if state.failures <= self.fast_retries:
+                interval = min(base, self.min_interval)
+            else:
+                interval = min(self.max_interval,
+                               base * self.backoff ** (state.failures - self.fast_retries))
+        interval *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        self.push(target, now + interval)
+        return result
+
+
+def copy_escape(value):
+    # Text-format COPY field
+    if value is None:
+        return "\\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+class ResultWal:
+    # Append-only local write-ahead log for results the database did not
+    # take. Rows are COPY text lines in numbered segment files; the active
+    # segment is sealed once it reaches segment_bytes (or when replay wants
+    # it), and sealed segments are replayed oldest first and deleted once
+    # their rows are committed. A torn last line from a crash is skipped.
+    def __init__(self, directory, segment_bytes=16 * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        self.active = None
+        self.active_size = 0
+        os.makedirs(directory, exist_ok=True)
+        numbers = self.numbers()
+        self.next_number = numbers[-1] + 1 if numbers else 1
+        self.adopt_legacy_spill()
+
+    def numbers(self):
+        return sorted(int(name[4:-4]) for name in os.listdir(self.directory)
+                      if name.startswith("seg-") and name.endswith(".wal"))
+
+    def path(self, number):
+        return os.path.join(self.directory, f"seg-{number:012d}.wal")
+
+    def adopt_legacy_spill(self):
+        # Spill files of older versions (next to the WAL) become segments
+        base = os.path.join(os.path.dirname(os.path.abspath(self.directory)), "ping_results.spill")
+        for path in (base + ".replay", base):
+            if os.path.exists(path):
+                os.replace(path, self.path(self.next_number))
+                self.next_number += 1
+
+    def append(self, lines):
+        # lines: COPY text rows, each ending in a newline
+        if not lines:
+            return
+        data = "".join(lines).encode("utf-8")
+        with self.lock:
+            if self.active is None:
+                self.active = open(self.path(self.next_number), "ab")
+                self.active_size = 0
+                self.next_number += 1
+            self.active.write(data)
+            self.active.flush()
+            os.fsync(self.active.fileno())
+            self.active_size += len(data)
+            if self.active_size >= self.segment_bytes:
+                self.seal_locked()
+
+    def seal_locked(self):
+        if self.active is not None:
+            self.active.close()
+            self.active = None
+
+    def sealed(self):
+        # Segments ready for replay, sealing the active one if needed
+        with self.lock:
+            self.seal_locked()
+            return [self.path(number) for number in self.numbers()]
+
+    def pending(self):
+        return bool(self.numbers()) or self.active is not None
+
+    def size(self):
+        return sum(os.path.getsize(self.path(number)) for number in self.numbers())
+
+    @staticmethod
+    def read(path, start=0):
+        # Complete lines from byte offset `start`: yields (line, end offset)
+        with open(path, "rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                offset += len(line)
+                if not line.endswith(b"\n"):
+                    return
+                yield line.decode("utf-8"), offset
+
+    def close(self):
+        with self.lock:
+            self.seal_locked()
+
+
+class ResultWriter:
+    # Write-behind pipeline for ping results. The probe loop only enqueues;
+    # a writer thread drains the bounded queue and flushes batches with
+    # COPY over a pooled connection. When the queue is full or the database
+    # is unreachable, rows go to the local ResultWal and are replayed after
+    # reconnect, at most replay_rate rows per second and between live
+    # batches. Queued and WAL rows have the `columns` layout, by target
+    # name; they are stored in the compact `stored_columns` layout against
+    # ping_targets.id, and rows of targets no longer in ping_targets are
+    # dropped. Replay skips rows whose (target, timestamp, agent) is
+    # already stored (a unique index), so a batch that reached the database before a failure is
+    # never doubled. result_key only identifies rows in memory (traces).
+    columns = ("target", "status", "response_time", "attempts", "timestamp", "agent",
+               "packets_sent", "packets_lost", "rtt_min", "rtt_max", "rtt_stddev", "jitter",
+               "result_key")
+    burst_columns = columns[6:12]
+    stored_columns = ("timestamp", "target_id", "response_time", "rtt_min", "rtt_max", "rtt_stddev",
+                      "jitter", "attempts", "packets_sent", "packets_lost", "status", "agent")
+
+    def __init__(self, db_params, message_queue, batch_size=1000, flush_interval=1.0,
+                 max_pending=50000, wal_dir="ping_results.wal", retry_interval=5.0,
+                 agent_id=None, replay_rate=20000, replay_batch=5000, instruments=None):
+        self.db_params = db_params
+        self.instruments = instruments
+        self.agent_id = agent_id
+        self.message_queue = message_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self.replay_rate = replay_rate
+        self.replay_batch = replay_batch
+        self.queue = Queue(maxsize=max_pending)
+        self.wal = ResultWal(wal_dir)
+        self.replay_position = None  # (segment path, byte offset) of the next row
+        self.replay_allowed_at = 0.0
+        self.replaying = False
+        # 31 random bits + 32-bit counter: unique per writer run, positive BIGINT
+        self.key_prefix = random.getrandbits(31) << 32
+        self.keys = itertools.count()
+        self.pool = None
+        self.target_ids = {}  # target -> ping_targets.id
+        self.targets_generation = None  # (row count, highest id) of ping_targets the ids are from
+        self.schema_ready = threading.Event()  # set once the engine has created or upgraded the schema
+        self.thread = None
+        self.stopping = False
+        self.db_down_since = None
+        self.rows_written = 0
+        self.rows_replayed = 0
+        self.rows_dropped = 0
+        self.late_after = 60  # seconds; older batches mark their range for the rollups
+        self.last_flush_latency = 0.0
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        self.stopping = True
+        if self.thread:
+            self.thread.join(timeout=timeout)
+        if self.pool:
+            self.pool.closeall()
+            self.pool = None
+        self.wal.close()
+
+    @staticmethod
+    def stored(row, target_id):
+        # A queued row in stored_columns order
+        (target, status, response_time, attempts, timestamp, agent,
+         packets_sent, packets_lost, rtt_min, rtt_max, rtt_stddev, jitter, _) = row
+        return (timestamp, target_id, response_time, rtt_min, rtt_max, rtt_stddev, jitter,
+                attempts, packets_sent, packets_lost, status, agent)
+
+    def forget(self, targets):
+        # Removed targets get a new id if they are added again
+        for target in targets:
+            self.target_ids.pop(target, None)
+
+    def submit(self, target, status, response_time, attempts, timestamp=None, burst=None):
+        # burst: burst_stats() of a burst probe; single echoes leave those
+        # columns NULL. Returns the row's result_key.
+        key = self.key_prefix | (next(self.keys) & 0xFFFFFFFF)
+        row = ((target, status, response_time, attempts, timestamp or datetime.now().astimezone(),
+                self.agent_id) +
+               (tuple(burst[column] for column in self.burst_columns) if burst else
+                (None,) * len(self.burst_columns)) +
+               (key,))
+        try:
+            self.queue.put_nowait(row)
+        except Full:
+            # Backpressure: never block the probe loop on a slow database
+            self.spill([row])
+        return key
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def run(self):
+        while not (self.stopping and self.queue.empty()):
+            if self.instruments:
+                self.instruments.profile_point("result writer")
+            if not self.schema_ready.is_set():
+                # Results wait in the queue (overflow goes to the WAL)
+                # until the schema is in place; on stop they are spilled
+                if self.stopping:
+                    batch = self.drain()
+                    if batch:
+                        self.spill(batch)
+                else:
+                    self.schema_ready.wait(self.flush_interval)
+                continue
+            batch = self.drain()
+            if self.db_down_since is not None:
+                if batch:
+                    self.spill(batch)
+                if time.time() - self.db_down_since < self.retry_interval and not self.stopping:
+                    continue
+                batch = []
+            if batch or self.db_down_since is not None:
+                self.flush(batch)
+            if self.db_down_since is None and not self.stopping and self.wal.pending():
+                self.replay_step()
+            if self.stopping and self.db_down_since is not None:
+                break
+
+    def drain(self):
+        batch = []
+        # Come back sooner while there is a backlog to replay
+        wait = self.flush_interval if self.replay_position is None and not self.wal.pending() else 0.05
+        deadline = time.time() + wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def connection(self):
+        if self.pool is None:
+            self.pool = psycopg2.pool.ThreadedConnectionPool(1, 2, **self.db_params)
+        return self.pool.getconn()
+
+    def flush(self, batch):
+        conn = None
+        try:
+            conn = self.connection()
+            start = time.time()
+            if self.db_down_since is not None:
+                self.db_down_since = None
+                self.message_queue.put(("log", "Database reachable again, result writer resumed"))
+            rejected = []
+            if batch:
+                try:
+                    self.copy_rows(conn, batch)
+                except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+                    # Bad rows, not an outage: write the rest, drop those
+                    rejected = self.isolate(conn, batch, self.copy_rows, e)
+                    self.report_rejected(batch, rejected)
+                self.rows_written += len(batch) - len(rejected)
+            self.last_flush_latency = time.time() - start
+            if batch and self.instruments:
+                self.instruments.committed(batch, self.last_flush_latency)
+            self.pool.putconn(conn)
+        except Exception as e:
+            # Connection loss (OperationalError, InterfaceError) or anything
+            # else that is not about the rows: keep them and retry later
+            self.connection_failed(conn, e)
+            self.spill(batch)
+
+    def isolate(self, conn, rows, write, error):
+        # write(conn, rows) failed on the data: retry in halves so only the
+        # offending rows are lost. Returns [(row, error)] of those.
+        conn.rollback()
+        if len(rows) == 1:
+            return [(rows[0], error)]
+        rejected = []
+        half = len(rows) // 2
+        for part in (rows[:half], rows[half:]):
+            try:
+                write(conn, part)
+            except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+                rejected += self.isolate(conn, part, write, e)
+        return rejected
+
+    def report_rejected(self, rows, rejected):
+        # Nothing is left when the error was a target removed meanwhile
+        # (its rows are skipped once the ids are looked up again)
+        if not rejected:
+            return
+        self.rows_dropped += len(rejected)
+        error = " ".join(str(rejected[0][1]).split())
+        self.message_queue.put(("log", ("error", f"Database rejected {len(rejected)} of {len(rows)} results, "
+                                                 f"dropped them: {error}")))
+
+    def connection_failed(self, conn, error):
+        if conn is not None and self.pool is not None:
+            self.pool.putconn(conn, close=True)
+        if self.db_down_since is None:
+            self.message_queue.put(("log", ("warning", f"Database error, buffering results to disk: {str(error)}")))
+        self.db_down_since = time.time()
+
+    def copy_rows(self, conn, rows):
+        ids = self.lookup_ids(conn, rows)
+        buffer = io.StringIO()
+        kept = 0
+        for row in rows:
+            target_id = ids.get(row[0])
+            if target_id is None:
+                continue
+            buffer.write("\t".join(copy_escape(value) for value in self.stored(row, target_id)))
+            buffer.write("\n")
+            kept += 1
+        buffer.seek(0)
+        with conn.cursor() as cur:
+            cur.copy_expert(
+                f"COPY ping_results ({', '.join(self.stored_columns)}) FROM STDIN", buffer)
+            # Rows held back (schema not ready, backlog) may be behind the
+            # rollups already
+            oldest = min(row[4] for row in rows)
+            if time.time() - oldest.timestamp() > self.late_after:
+                RollupJob.mark_dirty(cur, oldest, max(row[4] for row in rows))
+        conn.commit()
+        self.rows_dropped += len(rows) - kept
+
+    def lookup_ids(self, conn, rows):
+        # The cached ids are dropped whenever ping_targets lost or gained a
+        # row since the last batch (its row count or highest id changed),
+        # so a target removed and added again by another client is not
+        # written under its old id. Runs in the COPY's transaction.
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*), coalesce(max(id), 0) FROM ping_targets")
+            generation = cur.fetchone()
+            if generation != self.targets_generation:
+                self.targets_generation = generation
+                self.target_ids = {}
+            ids = self.target_ids
+            missing = list({row[0] for row in rows if row[0] not in ids})
+            if missing:
+                cur.execute("SELECT target, id FROM ping_targets WHERE target = ANY(%s)", (missing,))
+                ids.update(cur.fetchall())
+        return ids
+
+    def spill(self, rows):
+        self.wal.append(["\t".join(copy_escape(value) for value in row) + "\n" for row in rows])
+
+    def replay_step(self):
+        # Replay up to replay_batch rows from the WAL, no faster than
+        # replay_rate rows per second
+        now = time.time()
+        if now < self.replay_allowed_at:
+            return
+        if self.replay_position is None:
+            segments = self.wal.sealed()
+            if not segments:
+                return
+            self.replay_position = (segments[0], 0)
+            if not self.replaying:
+                self.replaying = True
+                self.message_queue.put(("log", f"Replaying buffered results ({len(segments)} WAL segments)"))
+        path, offset = self.replay_position
+        lines = []
+        end = offset
+        for line, end in ResultWal.read(path, offset):
+            # Rows from older versions lack the newer columns; pad with NULLs
+            line = line.rstrip("\n")
+            lines.append(line + "\t\\N" * (len(self.columns) - 1 - line.count("\t")) + "\n")
+            if len(lines) >= self.replay_batch:
+                break
+        conn = None
+        try:
+            conn = self.connection()
+            if lines:
+                try:
+                    self.insert_replayed(conn, lines)
+                except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+                    # A bad row must not hold up the rest of the WAL
+                    self.report_rejected(lines, self.isolate(conn, lines, self.insert_replayed, e))
+            self.pool.putconn(conn)
+        except Exception as e:
+            self.connection_failed(conn, e)
+            return
+        self.rows_replayed += len(lines)
+        self.replay_allowed_at = now + len(lines) / self.replay_rate
+        if len(lines) < self.replay_batch:
+            os.remove(path)
+            self.replay_position = None
+            if not self.wal.pending():
+                self.replaying = False
+                self.message_queue.put(("log", f"Buffered results replayed ({self.rows_replayed} rows in total)"))
+        else:
+            self.replay_position = (path, end)
+
+    def insert_replayed(self, conn, lines):
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS ping_results_replay (
+                    target VARCHAR(255),
+                    status BOOLEAN,
+                    response_time REAL,
+                    attempts SMALLINT,
+                    timestamp TIMESTAMP WITH TIME ZONE,
+                    agent VARCHAR(64),
+                    packets_sent SMALLINT,
+                    packets_lost SMALLINT,
+                    rtt_min REAL,
+                    rtt_max REAL,
+                    rtt_stddev REAL,
+                    jitter REAL,
+                    result_key BIGINT
+                ) ON COMMIT DELETE ROWS
+            """)
+            cur.copy_expert(f"COPY ping_results_replay ({', '.join(self.columns)}) FROM STDIN",
+                            io.StringIO("".join(lines)))
+            cur.execute(f"""
+                INSERT INTO ping_results ({', '.join(self.stored_columns)})
+                SELECT r.timestamp, t.id, r.response_time, r.rtt_min, r.rtt_max, r.rtt_stddev, r.jitter,
+                       r.attempts, r.packets_sent, r.packets_lost, r.status, r.agent
+                FROM ping_results_replay r
+                JOIN ping_targets t ON t.target = r.target
+                ON CONFLICT DO NOTHING
+            """)
+            cur.execute("SELECT min(timestamp), max(timestamp) FROM ping_results_replay")
+            low, high = cur.fetchone()
+            if low is not None:
+                RollupJob.mark_dirty(cur, low, high)
+        conn.commit()
+
+
+class RollingWindow:
+    # Ring of fixed-width time buckets for one target, with running totals
+    # so the window success rate and mean RTT are O(1) to read and update.
+    __slots__ = ("total", "success", "rtt_sum", "rtt_min", "rtt_max", "head",
+                 "window_total", "window_success", "window_rtt_sum")
+
+    def __init__(self, buckets):
+        self.total = array("H", bytes(2 * buckets))
+        self.success = array("H", bytes(2 * buckets))
+        self.rtt_sum = array("f", bytes(4 * buckets))
+        self.rtt_min = array("f", bytes(4 * buckets))
+        self.rtt_max = array("f", bytes(4 * buckets))
+        self.head = None
+        self.window_total = 0
+        self.window_success = 0
+        self.window_rtt_sum = 0.0
+
+    def advance(self, bucket):
+        # Expire every bucket between the current head and `bucket`
+        if self.head is None:
+            self.head = bucket
+            return
+        size = len(self.total)
+        steps = min(bucket - self.head, size)
+        for step in range(1, steps + 1):
+            index = (self.head + step) % size
+            self.window_total -= self.total[index]
+            self.window_success -= self.success[index]
+            self.window_rtt_sum -= self.rtt_sum[index]
+            self.total[index] = self.success[index] = 0
+            self.rtt_sum[index] = self.rtt_min[index] = self.rtt_max[index] = 0.0
+        if steps > 0:
+            self.head = bucket
+
+    def add(self, bucket, total, success, rtt_sum, rtt_min, rtt_max):
+        self.advance(bucket)
+        if self.head - bucket >= len(self.total):
+            return
+        index = bucket % len(self.total)
+        if success:
+            if self.success[index]:
+                self.rtt_min[index] = min(self.rtt_min[index], rtt_min)
+                self.rtt_max[index] = max(self.rtt_max[index], rtt_max)
+            else:
+                self.rtt_min[index] = rtt_min
+                self.rtt_max[index] = rtt_max
+        self.total[index] = min(self.total[index] + total, 0xFFFF)
+        self.success[index] = min(self.success[index] + success, 0xFFFF)
+        self.rtt_sum[index] += rtt_sum
+        self.window_total += total
+        self.window_success += success
+        self.window_rtt_sum += rtt_sum
+
+
+class SuccessRateAggregator:
+    # Per-target rolling window (default 1440 one-minute buckets = 24 hours)
+    # fed from the probe loop and warm-started once from the database.
+    # Memory is 16 bytes per bucket per target (~23 KB per target at the
+    # default resolution).
+    def __init__(self, bucket_seconds=60, buckets=1440):
+        self.bucket_seconds = bucket_seconds
+        self.buckets = buckets
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def bucket_of(self, timestamp):
+        return int(timestamp // self.bucket_seconds)
+
+    def window(self, target):
+        window = self.windows.get(target)
+        if window is None:
+            window = self.windows[target] = RollingWindow(self.buckets)
+        return window
+
+    def record(self, target, status, response_time, timestamp=None):
+        bucket = self.bucket_of(timestamp if timestamp is not None else time.time())
+        rtt = float(response_time) if status and response_time is not None else 0.0
+        with self.lock:
+            self.window(target).add(bucket, 1, 1 if status else 0, rtt, rtt, rtt)
+
+    def remove(self, target):
+        with self.lock:
+            self.windows.pop(target, None)
+
+    def success_rate(self, target):
+        with self.lock:
+            window = self.windows.get(target)
+            if window is None:
+                return 0.0
+            window.advance(self.bucket_of(time.time()))
+            if window.window_total == 0:
+                return 0.0
+            return (window.window_success / window.window_total) * 100
+
+    def stats(self, target):
+        with self.lock:
+            window = self.windows.get(target)
+            if window is None:
+                return {"total": 0, "success": 0, "success_rate": 0.0,
+                        "rtt_avg": None, "rtt_min": None, "rtt_max": None}
+            window.advance(self.bucket_of(time.time()))
+            answered = [i for i, count in enumerate(window.success) if count]
+            return {
+                "total": window.window_total,
+                "success": window.window_success,
+                "success_rate": (window.window_success / window.window_total * 100
+                                 if window.window_total else 0.0),
+                "rtt_avg": (window.window_rtt_sum / window.window_success
+                            if window.window_success else None),
+                "rtt_min": min((window.rtt_min[i] for i in answered), default=None),
+                "rtt_max": max((window.rtt_max[i] for i in answered), default=None)
+            }
+
+    def warm_start(self, conn, until=None):
+        # One grouped pass over the window instead of per-target queries.
+        # With `until`, later rows are left out: results recorded live
+        # since then are already counted. The lock is taken per chunk so
+        # live results are not held up behind a slow query.
+        window_seconds = self.bucket_seconds * self.buckets
+        with conn.cursor(name="rolling_window_warm_start") as cur:
+            cur.itersize = 10000
+            # Grouped by target id; names are joined to the groups only
+            cur.execute("""
+                SELECT t.target, w.bucket, w.total, w.success, w.rtt_sum, w.rtt_min, w.rtt_max
+                FROM (
+                    SELECT target_id,
+                           floor(extract(epoch FROM timestamp) / %s)::bigint AS bucket,
+                           count(*) AS total,
+                           count(*) FILTER (WHERE status) AS success,
+                           coalesce(sum(response_time) FILTER (WHERE status), 0) AS rtt_sum,
+                           min(response_time) FILTER (WHERE status) AS rtt_min,
+                           max(response_time) FILTER (WHERE status) AS rtt_max
+                    FROM ping_results
+                    WHERE timestamp >= NOW() - make_interval(secs => %s)
+                      AND timestamp < coalesce(%s, 'infinity')
+                    GROUP BY 1, 2
+                ) w
+                JOIN ping_targets t ON t.id = w.target_id
+                ORDER BY 2
+            """, (self.bucket_seconds, window_seconds, until))
+            rows = 0
+            while True:
+                chunk = cur.fetchmany(10000)
+                if not chunk:
+                    break
+                with self.lock:
+                    for target, bucket, total, success, rtt_sum, rtt_min, rtt_max in chunk:
+                        self.window(target).add(bucket, total, success, rtt_sum,
+                                                rtt_min or 0.0, rtt_max or 0.0)
+                rows += len(chunk)
+        return rows
+
+
+class SampleHistory:
+    # Recent raw samples of every target in column rings: timestamps as
+    # uint32 tenths of a second since `base`, RTT as float32 (NaN when
+    # lost) and status as one bit per sample, i.e. 8.125 bytes a sample.
+    # A ring is one or more rows of `capacity` samples in 2-D numpy arrays
+    # that grow by doubling up to the memory budget, so fleet-wide queries
+    # run as array operations. One row covers `window` seconds at the base
+    # interval; a target probed faster (flapping or just failed, down to
+    # min_interval) gets another row whenever its ring would otherwise
+    # overwrite a sample younger than `window`, up to `stretch` rows.
+    # snapshot()/load() keep the rings in a file that is memory-mapped
+    # (copy-on-write) on startup, so a restart does not need the database
+    # to warm up.
+    bytes_per_sample = 4 + 4 + 1 / 8
+    magic = b"PINGHIST2\n"
+
+    def __init__(self, capacity, memory_budget=512 * 1024 * 1024, base=None, window=None, stretch=1):
+        self.capacity = int(capacity)
+        self.max_rows = max(1, int(memory_budget // self.footprint(1, self.capacity)))
+        self.base = base if base is not None else time.time()
+        self.window = window
+        self.stretch = max(1, int(stretch))
+        self.slots = {}
+        self.free = []
+        self.rows = 0  # Rows handed out so far, free ones included
+        self.offsets = np.zeros((0, self.capacity), dtype=np.uint32)
+        self.rtt = np.zeros((0, self.capacity), dtype=np.float32)
+        self.status = np.zeros((0, (self.capacity + 7) // 8), dtype=np.uint8)
+        self.head = np.zeros(0, dtype=np.int64)
+        self.count = np.zeros(0, dtype=np.int64)
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def footprint(cls, rows, capacity):
+        # Bytes needed for `rows` rows of `capacity` samples
+        return int(rows * capacity * cls.bytes_per_sample)
+
+    def grow(self, rows):
+        extra = rows - len(self.head)
+        self.offsets = np.vstack([self.offsets, np.zeros((extra, self.capacity), dtype=np.uint32)])
+        self.rtt = np.vstack([self.rtt, np.zeros((extra, self.capacity), dtype=np.float32)])
+        self.status = np.vstack([self.status, np.zeros((extra, self.status.shape[1]), dtype=np.uint8)])
+        self.head = np.concatenate([self.head, np.zeros(extra, dtype=np.int64)])
+        self.count = np.concatenate([self.count, np.zeros(extra, dtype=np.int64)])
+
+    def take(self):
+        # An empty row, or None once the memory budget is used up
+        if self.free:
+            row = self.free.pop()
+        else:
+            if self.rows >= self.max_rows:
+                return None
+            if self.rows >= len(self.head):
+                self.grow(min(self.max_rows, max(1024, 2 * len(self.head))))
+            row = self.rows
+            self.rows += 1
+        self.head[row] = self.count[row] = 0
+        return row
+
+    def slot(self, target):
+        rows = self.slots.get(target)
+        if rows is None:
+            row = self.take()
+            if row is None:
+                return None
+            rows = self.slots[target] = [row]
+        return rows
+
+    def widen(self, rows, row):
+        # Append `row` to a full ring, first rotating the ring so its oldest
+        # sample comes first and new samples continue into the new row
+        shift = self.head[rows[0]]
+        if shift:
+            shape = (len(rows), self.capacity)
+            for column in (self.offsets, self.rtt):
+                column[rows] = np.roll(column[rows].reshape(-1), -shift).reshape(shape)
+            bits = np.unpackbits(self.status[rows], axis=1, bitorder="little")[:, :self.capacity]
+            bits = np.roll(bits.reshape(-1), -shift).reshape(shape)
+            self.status[rows] = np.packbits(bits, axis=1, bitorder="little")
+        self.head[rows[0]] = len(rows) * self.capacity
+        rows.append(row)
+
+    def record(self, target, timestamp, status, rtt):
+        with self.lock:
+            rows = self.slot(target)
+            if rows is None:
+                self.dropped += 1
+                return
+            offset = max(0, int((timestamp - self.base) * 10))
+            index = self.head[rows[0]]
+            if (self.window and len(rows) < self.stretch and self.count[rows[-1]] == self.capacity
+                    and offset - self.offsets[rows[index // self.capacity], index % self.capacity]
+                    < self.window * 10):
+                row = self.take()
+                if row is not None:
+                    self.widen(rows, row)
+                    index = self.head[rows[0]]
+            row, column = rows[index // self.capacity], index % self.capacity
+            self.offsets[row, column] = offset
+            self.rtt[row, column] = rtt if status and rtt is not None else np.nan
+            if status:
+                self.status[row, column >> 3] |= 1 << (column & 7)
+            else:
+                self.status[row, column >> 3] &= ~(1 << (column & 7)) & 0xFF
+            self.head[rows[0]] = (index + 1) % (len(rows) * self.capacity)
+            self.count[row] = min(self.count[row] + 1, self.capacity)
+
+    def remove(self, target):
+        with self.lock:
+            rows = self.slots.pop(target, None)
+            if rows is not None:
+                self.free.extend(rows)
+
+    def retain(self, targets):
+        targets = set(targets)
+        with self.lock:
+            for target in [target for target in self.slots if target not in targets]:
+                self.free.extend(self.slots.pop(target))
+
+    def samples(self, target, start=None, end=None):
+        # (timestamps, rtt, status) of one target in time order, optionally
+        # limited to [start, end)
+        with self.lock:
+            rows = self.slots.get(target)
+            if rows is None:
+                return np.zeros(0), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=bool)
+            count, head = self.count[rows].sum(), self.head[rows[0]]
+            order = np.arange(head - count, head) % (len(rows) * self.capacity)
+            row, column = np.array(rows)[order // self.capacity], order % self.capacity
+            offsets = self.offsets[row, column]
+            rtt = self.rtt[row, column]
+            status = (self.status[row, column >> 3] >> (column & 7) & 1).astype(bool)
+        lo = 0 if start is None else np.searchsorted(offsets, (start - self.base) * 10, "left")
+        hi = len(offsets) if end is None else np.searchsorted(offsets, (end - self.base) * 10, "left")
+        return self.base + offsets[lo:hi] / 10.0, rtt[lo:hi], status[lo:hi]
+
+    def percentile(self, target, q, start=None, end=None):
+        _, rtt, status = self.samples(target, start, end)
+        rtt = rtt[status]
+        return float(np.percentile(rtt, q)) if len(rtt) else None
+
+    def loss_rate(self, target, start=None, end=None):
+        _, _, status = self.samples(target, start, end)
+        return float(1.0 - status.mean()) * 100 if len(status) else None
+
+    def loss_rates(self, start=None, end=None):
+        # Loss % of every target in [start, end) in one pass over the columns
+        lo = 0 if start is None else max(0, (start - self.base) * 10)
+        hi = np.inf if end is None else (end - self.base) * 10
+        with self.lock:
+            if not self.slots:
+                return {}
+            valid = np.arange(self.capacity) < self.count[:, None]
+            in_range = valid & (self.offsets >= lo) & (self.offsets < hi)
+            answered = np.unpackbits(self.status, axis=1, bitorder="little")[:, :self.capacity].astype(bool)
+            total = in_range.sum(axis=1)
+            lost = (in_range & ~answered).sum(axis=1)
+            slots = {target: list(rows) for target, rows in self.slots.items()}
+        rates = {}
+        for target, rows in slots.items():
+            samples = total[rows].sum()
+            if samples:
+                rates[target] = float(lost[rows].sum()) / samples * 100
+        return rates
+
+    def memory_usage(self):
+        return self.offsets.nbytes + self.rtt.nbytes + self.status.nbytes
+
+    def snapshot(self, path):
+        # Header line (JSON) followed by the raw column arrays; written to a
+        # temporary file and renamed so a crash never leaves a torn snapshot
+        with self.lock:
+            header = {
+                "capacity": self.capacity,
+                "base": self.base,
+                "rows": len(self.head),
+                "slots": self.slots,
+                "head": self.head.tolist(),
+                "count": self.count.tolist()
+            }
+            temp_path = path + ".tmp"
+            with open(temp_path, "wb") as f:
+                f.write(self.magic)
+                f.write(json.dumps(header).encode("utf-8") + b"\n")
+                for column in (self.offsets, self.rtt, self.status):
+                    f.write(column.tobytes())
+            try:
+                os.replace(temp_path, path)
+            except PermissionError:
+                # Windows will not replace a file that is still mapped:
+                # read the rings into memory and let go of the old map
+                self.offsets, self.rtt, self.status = (np.array(column) for column in
+                                                       (self.offsets, self.rtt, self.status))
+                os.replace(temp_path, path)
+
+    def load(self, path):
+        # Map a snapshot copy-on-write (pages are read as they are touched,
+        # writes stay private); False if there is none or it was taken with
+        # a different ring size
+        try:
+            with open(path, "rb") as f:
+                if f.readline() != self.magic:
+                    return False
+                header = json.loads(f.readline())
+                offset = f.tell()
+        except (OSError, ValueError):
+            return False
+        if header["capacity"] != self.capacity or not header["rows"]:
+            return False
+        rows = header["rows"]
+        shapes = ((np.uint32, self.capacity), (np.float32, self.capacity), (np.uint8, (self.capacity + 7) // 8))
+        columns = []
+        for dtype, width in shapes:
+            columns.append(np.memmap(path, dtype=dtype, mode="c", offset=offset, shape=(rows, width)))
+            offset += rows * width * np.dtype(dtype).itemsize
+        with self.lock:
+            self.offsets, self.rtt, self.status = columns
+            self.head = np.array(header["head"], dtype=np.int64)
+            self.count = np.array(header["count"], dtype=np.int64)
+            self.base = header["base"]
+            self.rows = min(rows, self.max_rows)
+            self.slots = {target: slot for target, slot in header["slots"].items() if max(slot) < self.rows}
+            used = {row for slot in self.slots.values() for row in slot}
+            self.free = [row for row in range(self.rows) if row not in used]
+        return True
+
+
+class DatabaseJob:
+    # Periodic maintenance thread with its own short-lived connection
+    # (kept open between runs when `persistent`). Subclasses implement
+    # maintain(conn); wake() runs it early.
+    name = "Database job"
+    persistent = False
+
+    def __init__(self, db_params, message_queue, interval):
+        self.db_params = db_params
+        self.message_queue = message_queue
+        self.interval = interval
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.stopping = False
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping = True
+        self.wakeup.set()
+
+    def wake(self):
+        self.wakeup.set()
+
+    def run(self):
+        conn = None
+        while not self.stopping:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            if self.stopping:
+                break
+            try:
+                if conn is None or conn.closed:
+                    conn = psycopg2.connect(**self.db_params)
+                    conn.autocommit = True
+                self.maintain(conn)
+            except Exception as e:
+                self.message_queue.put(("log", ("error", f"{self.name} error: {str(e)}")))
+                if conn:
+                    conn.close()
+                conn = None
+            finally:
+                if conn and not self.persistent:
+                    conn.close()
+                    conn = None
+        if conn:
+            conn.close()
+        self.finish()
+
+    def maintain(self, conn):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+
+class PartitionRetentionJob(DatabaseJob):
+    # ping_results is range-partitioned by UTC day. This job pre-creates
+    # upcoming partitions and detaches/drops the ones that have aged out of
+    # the retention window, replacing the old per-insert DELETE trigger.
+    name = "Partition maintenance"
+
+    def __init__(self, db_params, message_queue, ttl_days=30, premake_days=7, interval=3600):
+        super().__init__(db_params, message_queue, interval)
+        self.ttl_days = ttl_days
+        self.premake_days = premake_days
+
+    def start(self):
+        # Run at once: after a long downtime today's partition may be missing
+        super().start()
+        self.wake()
+
+    def configure(self, ttl_days):
+        self.ttl_days = ttl_days
+        self.wake()
+
+    @staticmethod
+    def partition_name(day):
+        return f"ping_results_p{day:%Y%m%d}"
+
+    def maintain(self, conn):
+        today = datetime.now(timezone.utc).date()
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.ttl_days)
+        created = []
+        dropped = []
+        with conn.cursor() as cur:
+            existing = self.partitions(cur)
+            covered_until = max((upper for _, upper in existing), default=None)
+            for offset in range(self.premake_days + 1):
+                day = today + timedelta(days=offset)
+                lower = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+                if covered_until is not None and lower < covered_until:
+                    continue
+                name = self.partition_name(day)
+                try:
+                    moved = self.create_partition(conn, name, lower, lower + timedelta(days=1))
+                except psycopg2.Error as e:
+                    # Left for the next run; the other days and the drops go ahead
+                    self.message_queue.put(("log", ("error", f"Could not create partition {name}: {str(e)}")))
+                    continue
+                if moved:
+                    self.message_queue.put(("log", f"Moved {moved} rows of {day} from the default partition "
+                                                   f"to {name}"))
+                created.append(name)
+            for name, upper in existing:
+                if upper <= cutoff:
+                    cur.execute(f"ALTER TABLE ping_results DETACH PARTITION {name}")
+                    cur.execute(f"DROP TABLE {name}")
+                    dropped.append(name)
+            # Rows that fell outside every daily range (late replays, clock skew)
+            cur.execute("DELETE FROM ping_results_default WHERE timestamp < %s", (cutoff,))
+            # Events share the retention window
+            cur.execute("DELETE FROM ping_events WHERE timestamp < %s", (cutoff,))
+        if created or dropped:
+            self.message_queue.put(("log", f"Partitions created: {len(created)}, dropped: {len(dropped)} "
+                                           f"(retention {self.ttl_days} days)"))
+        return created, dropped
+
+    @staticmethod
+    def create_partition(conn, name, lower, upper):
+        # Rows of the day may already sit in the default partition (written
+        # while no partition covered it), which would make PARTITION OF
+        # fail; they are moved into the new table before it is attached, in
+        # one transaction. Returns the number of rows moved.
+        previous_autocommit = conn.autocommit
+        conn.autocommit = False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT 1 FROM ping_results_default WHERE timestamp >= %s AND timestamp < %s LIMIT 1
+                """, (lower, upper))
+                if cur.fetchone() is None:
+                    cur.execute(f"""
+                        CREATE TABLE IF NOT EXISTS {name}
+                        PARTITION OF ping_results
+                        FOR VALUES FROM (%s) TO (%s)
+                    """, (lower, upper))
+                    moved = 0
+                else:
+                    columns = ", ".join(ResultWriter.stored_columns)
+                    cur.execute(f"CREATE TABLE {name} (LIKE ping_results INCLUDING DEFAULTS)")
+                    cur.execute(f"""
+                        WITH moved AS (
+                            DELETE FROM ping_results_default
+                            WHERE timestamp >= %s AND timestamp < %s
+                            RETURNING {columns}
+                        )
+                        INSERT INTO {name} ({columns}) SELECT {columns} FROM moved
+                    """, (lower, upper))
+                    moved = cur.rowcount
+                    cur.execute(f"ALTER TABLE ping_results ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+                                (lower, upper))
+            conn.commit()
+            return moved
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.autocommit = previous_autocommit
+
+    @staticmethod
+    def partitions(cur):
+        # (name, upper bound) for every range partition of ping_results
+        cur.execute("""
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'ping_results'::regclass
+        """)
+        result = []
+        for name, bound in cur.fetchall():
+            match = re.search(r"TO \('([^']+)'\)", bound or "")
+            if not match:
+                continue
+            try:
+                result.append((name, datetime.fromisoformat(match.group(1))))
+            except ValueError:
+                continue
+        return result
+
+    @staticmethod
+    def create_parent(cur):
+        # Compact layout (schema version 4): the target as its ping_targets
+        # id, 4-byte RTTs and 2-byte counts, widest columns first so there
+        # is no alignment padding, and no surrogate key. target_id references
+        # ping_targets, so removing a target deletes its results (schema
+        # version 7 adds the key to older tables, see add_target_key).
+        # Rows arrive in time order, so a BRIN index is enough for time
+        # ranges. Per-target ranges use the unique (target_id, timestamp,
+        # agent) index, which also makes WAL replay idempotent (agent is
+        # coalesced: a NULL would never conflict).
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ping_results (
+                timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+                target_id INTEGER NOT NULL REFERENCES ping_targets(id) ON DELETE CASCADE,
+                response_time REAL,
+                rtt_min REAL,
+                rtt_max REAL,
+                rtt_stddev REAL,
+                jitter REAL,
+                attempts SMALLINT NOT NULL,
+                packets_sent SMALLINT,
+                packets_lost SMALLINT,
+                status BOOLEAN NOT NULL,
+                agent VARCHAR(64)
+            ) PARTITION BY RANGE (timestamp)
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_ping_results_time_brin
+            ON ping_results USING BRIN (timestamp)
+        """)
+        cur.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_ping_results_target_id_time_agent
+            ON ping_results(target_id, timestamp, coalesce(agent, ''))
+        """)
+
+    @staticmethod
+    def add_target_key(cur):
+        # Tables of schema versions 4-6 have no foreign key; results of
+        # targets removed since then are deleted so it can be added
+        cur.execute("""
+            SELECT 1 FROM pg_constraint
+            WHERE conrelid = 'ping_results'::regclass AND contype = 'f'
+        """)
+        if cur.fetchone() is not None:
+            return
+        cur.execute("""
+            DELETE FROM ping_results r
+            WHERE NOT EXISTS (SELECT 1 FROM ping_targets t WHERE t.id = r.target_id)
+        """)
+        cur.execute("""
+            ALTER TABLE ping_results ADD FOREIGN KEY (target_id)
+            REFERENCES ping_targets(id) ON DELETE CASCADE
+        """)
+
+
+class ResultBackfillJob(DatabaseJob):
+    # Online migration of results from an older ping_results layout.
+    # retire() renames the old table (and its partitions) out of the way
+    # in one short transaction, so new results go to the compact table at
+    # once; this job then copies the old rows over in batches, newest
+    # first so recent history and success rates are back soonest, and
+    # drops the old table when it is done. Progress is a watermark in
+    # ping_results_backfill, locked per batch, so the job can be stopped,
+    # resumed and run by several engines (or --migrate) at once.
+    name = "Result migration"
+    persistent = True
+
+    def __init__(self, db_params, message_queue, ttl_days=30, batch_rows=50000, pause=0.1, interval=300):
+        super().__init__(db_params, message_queue, interval)
+        self.ttl_days = ttl_days
+        self.batch_rows = batch_rows  # rows aimed for per batch (the time slice adapts)
+        self.pause = pause            # seconds between batches, to leave the database room
+        self.slice = 300.0            # seconds of old results per batch
+        self.done = False
+
+    def start(self):
+        super().start()
+        self.wake()
+
+    @staticmethod
+    def retire(conn):
+        # Move a ping_results without target_id aside as ping_results_old.
+        # Returns False when there is nothing to migrate.
+        previous_autocommit = conn.autocommit
+        conn.autocommit = False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT c.relkind FROM pg_class c
+                    WHERE c.oid = to_regclass('ping_results')
+                      AND NOT EXISTS (SELECT 1 FROM pg_attribute a
+                                      WHERE a.attrelid = c.oid AND a.attname = 'target_id')
+                """)
+                row = cur.fetchone()
+                if row is None:
+                    conn.rollback()
+                    return False
+                cur.execute("DROP TRIGGER IF EXISTS trigger_clean_old_ping_results ON ping_results")
+                cur.execute("DROP FUNCTION IF EXISTS clean_old_ping_results()")
+                cur.execute("ALTER TABLE ping_results RENAME TO ping_results_old")
+                if row[0] == 'p':
+                    cur.execute("""
+                        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                        WHERE i.inhparent = 'ping_results_old'::regclass
+                    """)
+                    for (name,) in cur.fetchall():
+                        if name.startswith("ping_results_"):
+                            cur.execute(f"ALTER TABLE {name} RENAME TO ping_results_old_{name[len('ping_results_'):]}")
+                for index in ("timestamp", "target", "target_time", "result_key"):
+                    cur.execute(f"ALTER INDEX IF EXISTS idx_ping_results_{index} "
+                                f"RENAME TO idx_ping_results_old_{index}")
+                # Columns very old tables lack
+                cur.execute("""
+                    ALTER TABLE ping_results_old
+                        ADD COLUMN IF NOT EXISTS agent VARCHAR(64),
+                        ADD COLUMN IF NOT EXISTS packets_sent SMALLINT,
+                        ADD COLUMN IF NOT EXISTS packets_lost SMALLINT,
+                        ADD COLUMN IF NOT EXISTS rtt_min REAL,
+                        ADD COLUMN IF NOT EXISTS rtt_max REAL,
+                        ADD COLUMN IF NOT EXISTS rtt_stddev REAL,
+                        ADD COLUMN IF NOT EXISTS jitter REAL
+                """)
+                cur.execute("SELECT min(timestamp), max(timestamp) FROM ping_results_old")
+                oldest, newest = cur.fetchone()
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS ping_results_backfill (
+                        oldest TIMESTAMP WITH TIME ZONE,
+                        watermark TIMESTAMP WITH TIME ZONE,
+                        rows_moved BIGINT NOT NULL DEFAULT 0
+                    )
+                """)
+                cur.execute("DELETE FROM ping_results_backfill")
+                cur.execute("""
+                    INSERT INTO ping_results_backfill (oldest, watermark)
+                    VALUES (%s, %s + interval '1 microsecond')
+                """, (oldest, newest))
+            conn.commit()
+            return True
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.autocommit = previous_autocommit
+
+    def maintain(self, conn):
+        started = time.time()
+        logged = started
+        moved = 0
+        while not self.stopping:
+            batch = self.step(conn)
+            if batch is None:
+                # Finished, or nothing to migrate: the thread is not needed
+                self.stopping = True
+                break
+            moved += batch[0]
+            if time.time() - logged >= 30:
+                logged = time.time()
+                self.message_queue.put(("log", f"{self.name}: {moved} rows moved, back to {batch[1]:%Y-%m-%d %H:%M}"))
+            if self.pause:
+                time.sleep(self.pause)
+        if self.done:
+            self.message_queue.put(("log", f"{self.name} finished: {moved} rows moved in "
+                                           f"{time.time() - started:.0f}s, old results table dropped"))
+
+    def step(self, conn):
+        # Copy one slice of old results; returns (rows, watermark), or None
+        # once there is nothing (left) to do
+        conn.autocommit = False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT to_regclass('ping_results_backfill') IS NOT NULL")
+                if not cur.fetchone()[0]:
+                    conn.rollback()
+                    return None
+                cur.execute("SELECT oldest, watermark FROM ping_results_backfill FOR UPDATE")
+                row = cur.fetchone()
+                cutoff = datetime.now(timezone.utc) - timedelta(days=self.ttl_days)
+                floor = max(row[0], cutoff) if row and row[0] else cutoff
+                if row is None or row[1] is None or row[1] <= floor:
+                    cur.execute("DROP TABLE IF EXISTS ping_results_old CASCADE")
+                    cur.execute("DROP TABLE ping_results_backfill")
+                    cur.execute("DROP SEQUENCE IF EXISTS ping_results_id_seq")
+                    conn.commit()
+                    self.done = True
+                    return None
+                watermark = row[1]
+                # One UTC day per batch, into that day's partition
+                day = (watermark - timedelta(microseconds=1)).astimezone(timezone.utc).date()
+                day_start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+                lower = max(floor, day_start, watermark - timedelta(seconds=self.slice))
+                cur.execute("SAVEPOINT partition")
+                try:
+                    cur.execute(f"""
+                        CREATE TABLE IF NOT EXISTS {PartitionRetentionJob.partition_name(day)}
+                        PARTITION OF ping_results
+                        FOR VALUES FROM (%s) TO (%s)
+                    """, (day_start, day_start + timedelta(days=1)))
+                except psycopg2.Error:
+                    # Overlaps rows in the default partition; the day goes there
+                    cur.execute("ROLLBACK TO SAVEPOINT partition")
+                # Results of targets removed since are left behind
+                cur.execute(f"""
+                    INSERT INTO ping_results ({', '.join(ResultWriter.stored_columns)})
+                    SELECT o.timestamp, t.id, o.response_time, o.rtt_min, o.rtt_max, o.rtt_stddev, o.jitter,
+                           least(o.attempts, 32767), o.packets_sent, o.packets_lost, o.status, o.agent
+                    FROM ping_results_old o
+                    JOIN ping_targets t ON t.target = o.target
+                    WHERE o.timestamp >= %s AND o.timestamp < %s
+                    ON CONFLICT DO NOTHING
+                """, (lower, watermark))
+                rows = cur.rowcount
+                cur.execute("UPDATE ping_results_backfill SET watermark = %s, rows_moved = rows_moved + %s",
+                            (lower, rows))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.autocommit = True
+        # Aim the next slice at batch_rows, changing it by at most 2x a batch
+        span = (watermark - lower).total_seconds()
+        target = span * self.batch_rows / max(rows, 1)
+        self.slice = min(max(target, self.slice / 2, 1.0), self.slice * 2, 86400.0)
+        return rows, lower
+
+
+class AgentCoordinator(DatabaseJob):
+    # Agent mode: several engines share the fleet through the database.
+    # Targets hash onto a fixed number of shards; within a vantage point
+    # each shard is leased to at most one live agent. Agents heartbeat,
+    # renew their leases, release shards above their fair share so new
+    # agents get work, and claim expired leases of dead agents. An agent
+    # only probes shards whose lease it renewed within lease_ttl, so a shard
+    # is never probed twice from the same vantage point.
+    name = "Agent coordinator"
+    persistent = True
+
+    def __init__(self, db_params, message_queue, agent_id, vantage="default", shards=64,
+                 lease_ttl=30, heartbeat=5):
+        super().__init__(db_params, message_queue, heartbeat)
+        self.agent_id = agent_id
+        self.vantage = vantage
+        self.shards = shards
+        self.lease_ttl = lease_ttl
+        self.owned = frozenset()
+        self.owned_until = 0.0
+
+    @staticmethod
+    def create_tables(cur):
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ping_agents (
+                agent_id VARCHAR(64) PRIMARY KEY,
+                vantage VARCHAR(64) NOT NULL,
+                hostname VARCHAR(255),
+                started_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                heartbeat_at TIMESTAMP WITH TIME ZONE NOT NULL
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ping_shard_leases (
+                vantage VARCHAR(64) NOT NULL,
+                shard INTEGER NOT NULL,
+                agent_id VARCHAR(64),
+                expires_at TIMESTAMP WITH TIME ZONE,
+                PRIMARY KEY (vantage, shard)
+            )
+        """)
+
+    def shard_of(self, target):
+        return zlib.crc32(target.encode("utf-8")) % self.shards
+
+    def start(self):
+        super().start()
+        self.wake()
+
+    def active_shards(self):
+        # Leases we could not renew in time are treated as lost
+        if time.monotonic() >= self.owned_until:
+            return frozenset()
+        return self.owned
+
+    def select_targets(self, targets):
+        shards = self.active_shards()
+        return [target for target in targets if self.shard_of(target) in shards]
+
+    def maintain(self, conn):
+        renewed_at = time.monotonic()
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO ping_agents (agent_id, vantage, hostname, heartbeat_at)
+                VALUES (%s, %s, %s, now())
+                ON CONFLICT (agent_id) DO UPDATE SET
+                    vantage = EXCLUDED.vantage, heartbeat_at = now()
+            """, (self.agent_id, self.vantage, socket.gethostname()))
+            cur.execute("""
+                INSERT INTO ping_shard_leases (vantage, shard)
+                SELECT %s, shard FROM generate_series(0, %s - 1) AS shard
+                ON CONFLICT DO NOTHING
+            """, (self.vantage, self.shards))
+            cur.execute("""
+                SELECT count(*) FROM ping_agents
+                WHERE vantage = %s AND heartbeat_at > now() - make_interval(secs => %s)
+            """, (self.vantage, self.lease_ttl))
+            live = max(1, cur.fetchone()[0])
+            fair_share = -(-self.shards // live)
+            
+            # Renew what we still hold
+            cur.execute("""
+                UPDATE ping_shard_leases
+                SET expires_at = now() + make_interval(secs => %s)
+                WHERE vantage = %s AND agent_id = %s AND expires_at >= now() AND shard < %s
+                RETURNING shard
+            """, (self.lease_ttl, self.vantage, self.agent_id, self.shards))
+            owned = {row[0] for row in cur.fetchall()}
+            
+            if len(owned) > fair_share:
+                # Stop probing before giving shards up
+                excess = sorted(owned)[fair_share:]
+                owned -= set(excess)
+                self.owned = frozenset(owned)
+                cur.execute("""
+                    UPDATE ping_shard_leases SET agent_id = NULL, expires_at = NULL
+                    WHERE vantage = %s AND agent_id = %s AND shard = ANY(%s)
+                """, (self.vantage, self.agent_id, excess))
+            elif len(owned) < fair_share:
+                # Take free shards and expired leases of dead agents
+                cur.execute("""
+                    UPDATE ping_shard_leases
+                    SET agent_id = %s, expires_at = now() + make_interval(secs => %s)
+                    WHERE vantage = %s AND shard IN (
+                        SELECT shard FROM ping_shard_leases
+                        WHERE vantage = %s AND shard < %s
+                          AND (agent_id IS NULL OR expires_at < now())
+                        ORDER BY shard
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING shard
+                """, (self.agent_id, self.lease_ttl, self.vantage, self.vantage, self.shards,
+                      fair_share - len(owned)))
+                owned |= {row[0] for row in cur.fetchall()}
+        
+        if owned != self.owned:
+            self.message_queue.put(("log", f"Agent {self.agent_id} ({self.vantage}) holds "
+                                           f"{len(owned)}/{self.shards} shards, {live} live agents"))
+        self.owned = frozenset(owned)
+        # Keep a heartbeat of slack so we stop before anyone else may start
+        self.owned_until = renewed_at + self.lease_ttl - self.interval
+
+    def finish(self):
+        # Hand our shards over right away on a clean shutdown
+        self.owned = frozenset()
+        conn = None
+        try:
+            conn = psycopg2.connect(**self.db_params)
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE ping_shard_leases SET agent_id = NULL, expires_at = NULL
+                    WHERE vantage = %s AND agent_id = %s
+                """, (self.vantage, self.agent_id))
+                cur.execute("DELETE FROM ping_agents WHERE agent_id = %s", (self.agent_id,))
+            conn.commit()
+        except Exception as e:
+            self.message_queue.put(("log", ("error", f"{self.name} error: {str(e)}")))
+        finally:
+            if conn:
+                conn.close()
+
+
+# Upper bounds (ms) of the RTT sketch bins; bin i holds edges[i-1] <= rtt < edges[i]
+# and the last bin everything from the final edge up. Coarser rollups merge
+# sketches by element-wise sums.
+RTT_SKETCH_EDGES = (0.25, 0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 50, 75, 100,
+                    150, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000)
+ATTEMPT_BINS = 6  # attempts 0..5, 0 = never answered
+
+
+def sketch_percentile(sketch, q, rtt_min=None, rtt_max=None):
+    total = sum(sketch)
+    if not total:
+        return None
+    rank = q * total
+    cumulative = 0
+    for index, count in enumerate(sketch):
+        if count and cumulative + count >= rank:
+            lower = RTT_SKETCH_EDGES[index - 1] if index else 0.0
+            upper = RTT_SKETCH_EDGES[index] if index < len(RTT_SKETCH_EDGES) else max(rtt_max or lower, lower)
+            value = lower + (upper - lower) * (rank - cumulative) / count
+            if rtt_min is not None:
+                value = max(value, rtt_min)
+            if rtt_max is not None:
+                value = min(value, rtt_max)
+            return value
+        cumulative += count
+    return rtt_max
+
+
+class Rollup:
+    def __init__(self, name, unit, width, source, chunk):
+        self.name = name
+        self.unit = unit          # date_trunc field
+        self.width = width        # bucket width in seconds
+        self.source = source      # finer rollup name, None for raw results
+        self.chunk = chunk        # buckets rolled up per transaction
+        self.table = f"ping_rollup_{name}"
+
+
+ROLLUPS = (
+    Rollup("1m", "minute", 60, None, 15),
+    Rollup("1h", "hour", 3600, "1m", 24),
+    Rollup("1d", "day", 86400, "1h", 31),
+)
+
+
+class RollupJob(DatabaseJob):
+    # Watermark-driven downsampling: raw results roll up into 1-minute
+    # buckets, minutes into hours and hours into days. Each pass only covers
+    # complete buckets past the stored watermark and upserts them, so it is
+    # idempotent and cheap to run every minute. Aggregates keep their own
+    # retention, independent of the raw TTL.
+    name = "Rollup"
+
+    def __init__(self, db_params, message_queue, retention_days=None, lateness=120, interval=60):
+        super().__init__(db_params, message_queue, interval)
+        self.retention_days = retention_days or {"1m": 7, "1h": 90, "1d": 730}
+        self.lateness = lateness  # seconds allowed for the result writer to land rows
+
+    @staticmethod
+    def create_tables(cur):
+        for rollup in ROLLUPS:
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {rollup.table} (
+                    target VARCHAR(255) NOT NULL,
+                    bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+                    count INTEGER NOT NULL,
+                    success_count INTEGER NOT NULL,
+                    rtt_min REAL,
+                    rtt_max REAL,
+                    rtt_sum DOUBLE PRECISION NOT NULL,
+                    rtt_sketch INTEGER[] NOT NULL,
+                    attempts_hist INTEGER[] NOT NULL,
+                    PRIMARY KEY (target, bucket)
+                )
+            """)
+            cur.execute(f"""
+                CREATE INDEX IF NOT EXISTS idx_{rollup.table}_bucket
+                ON {rollup.table}(bucket)
+            """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ping_rollup_watermarks (
+                resolution VARCHAR(8) PRIMARY KEY,
+                watermark TIMESTAMP WITH TIME ZONE NOT NULL
+            )
+        """)
+        # Time ranges that got results after they were rolled up
+        # (schema version 6)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ping_rollup_dirty (
+                low TIMESTAMP WITH TIME ZONE NOT NULL,
+                high TIMESTAMP WITH TIME ZONE NOT NULL
+            )
+        """)
+
+    @staticmethod
+    def mark_dirty(cur, low, high):
+        # Called by writers in the transaction that stores results from
+        # [low, high]; only ranges the 1m rollup has already passed are
+        # recorded
+        cur.execute("""
+            INSERT INTO ping_rollup_dirty (low, high)
+            SELECT %s, %s
+            WHERE %s < (SELECT watermark FROM ping_rollup_watermarks WHERE resolution = '1m')
+        """, (low, high, low))
+
+    @staticmethod
+    def floor(moment, width):
+        epoch = int(moment.timestamp()) // width * width
+        return datetime.fromtimestamp(epoch, timezone.utc)
+
+    def rollup_sql(self, rollup):
+        upsert = f"""
+            ON CONFLICT (target, bucket) DO UPDATE SET
+                count = EXCLUDED.count,
+                success_count = EXCLUDED.success_count,
+                rtt_min = EXCLUDED.rtt_min,
+                rtt_max = EXCLUDED.rtt_max,
+                rtt_sum = EXCLUDED.rtt_sum,
+                rtt_sketch = EXCLUDED.rtt_sketch,
+                attempts_hist = EXCLUDED.attempts_hist
+        """
+        columns = "target, bucket, count, success_count, rtt_min, rtt_max, rtt_sum, rtt_sketch, attempts_hist"
+        if rollup.source is None:
+            edges = "{" + ",".join(str(edge) for edge in RTT_SKETCH_EDGES) + "}"
+            sketch = ", ".join(f"count(*) FILTER (WHERE status AND bin = {i})"
+                               for i in range(len(RTT_SKETCH_EDGES) + 1))
+            attempts = ", ".join(f"count(*) FILTER (WHERE least(attempts, {ATTEMPT_BINS - 1}) = {i})"
+                                 for i in range(ATTEMPT_BINS))
+            return f"""
+                INSERT INTO {rollup.table} ({columns})
+                SELECT target,
+                       date_trunc('{rollup.unit}', timestamp, 'UTC'),
+                       count(*),
+                       count(*) FILTER (WHERE status),
+                       min(response_time) FILTER (WHERE status),
+                       max(response_time) FILTER (WHERE status),
+                       coalesce(sum(response_time) FILTER (WHERE status), 0),
+                       ARRAY[{sketch}]::integer[],
+                       ARRAY[{attempts}]::integer[]
+                FROM (
+                    SELECT t.target, r.timestamp, r.status, r.response_time, r.attempts,
+                           width_bucket(r.response_time, '{edges}'::float8[]) AS bin
+                    FROM ping_results r
+                    JOIN ping_targets t ON t.id = r.target_id
+                    WHERE r.timestamp >= %s AND r.timestamp < %s
+                ) raw
+                GROUP BY 1, 2
+                {upsert}
+            """
+        source = f"ping_rollup_{rollup.source}"
+        sketch = ", ".join(f"sum(rtt_sketch[{i + 1}])" for i in range(len(RTT_SKETCH_EDGES) + 1))
+        attempts = ", ".join(f"sum(attempts_hist[{i + 1}])" for i in range(ATTEMPT_BINS))
+        return f"""
+            INSERT INTO {rollup.table} ({columns})
+            SELECT target,
+                   date_trunc('{rollup.unit}', bucket, 'UTC'),
+                   sum(count),
+                   sum(success_count),
+                   min(rtt_min),
+                   max(rtt_max),
+                   sum(rtt_sum),
+                   ARRAY[{sketch}]::integer[],
+                   ARRAY[{attempts}]::integer[]
+            FROM {source}
+            WHERE bucket >= %s AND bucket < %s
+            GROUP BY 1, 2
+            {upsert}
+        """
+
+    def redo_dirty(self, cur, watermarks):
+        # Roll up again the minutes that got late results (WAL replay
+        # after an outage longer than `lateness`), then the hours and days
+        # containing them. Returns the number of ranges redone.
+        cur.execute("DELETE FROM ping_rollup_dirty RETURNING low, high")
+        ranges = sorted(cur.fetchall())
+        for rollup in ROLLUPS:
+            watermark = watermarks.get(rollup.name)
+            if watermark is None:
+                continue
+            merged = []
+            for low, high in ranges:
+                low = self.floor(low, rollup.width)
+                high = min(self.floor(high, rollup.width) + timedelta(seconds=rollup.width), watermark)
+                if low >= high:
+                    continue
+                if merged and low <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], high)
+                else:
+                    merged.append([low, high])
+            sql = self.rollup_sql(rollup)
+            for start, end in merged:
+                while start < end:
+                    stop = min(end, start + timedelta(seconds=rollup.width * rollup.chunk))
+                    cur.execute(sql, (start, stop))
+                    start = stop
+        return len(ranges)
+
+    def maintain(self, conn):
+        conn.autocommit = False
+        now = datetime.now(timezone.utc)
+        with conn.cursor() as cur:
+            cur.execute("SELECT resolution, watermark FROM ping_rollup_watermarks")
+            watermarks = dict(cur.fetchall())
+            redone = self.redo_dirty(cur, watermarks)
+            conn.commit()
+            if redone:
+                self.message_queue.put(("log", f"Rolled up {redone} ranges of late results again"))
+            for rollup in ROLLUPS:
+                if rollup.source is None:
+                    ready = self.floor(now - timedelta(seconds=self.lateness), rollup.width)
+                elif rollup.source in watermarks:
+                    ready = self.floor(watermarks[rollup.source], rollup.width)
+                else:
+                    continue
+                start = watermarks.get(rollup.name)
+                if start is None:
+                    if rollup.source is None:
+                        cur.execute("SELECT min(timestamp) FROM ping_results")
+                    else:
+                        cur.execute(f"SELECT min(bucket) FROM ping_rollup_{rollup.source}")
+                    oldest = cur.fetchone()[0]
+                    start = self.floor(oldest, rollup.width) if oldest else ready
+                sql = self.rollup_sql(rollup)
+                while start < ready and not self.stopping:
+                    end = min(ready, start + timedelta(seconds=rollup.width * rollup.chunk))
+                    cur.execute(sql, (start, end))
+                    cur.execute("""
+                        INSERT INTO ping_rollup_watermarks (resolution, watermark)
+                        VALUES (%s, %s)
+                        ON CONFLICT (resolution) DO UPDATE SET watermark = EXCLUDED.watermark
+                    """, (rollup.name, end))
+                    conn.commit()
+                    start = end
+                watermarks[rollup.name] = start
+                cur.execute(f"DELETE FROM {rollup.table} WHERE bucket < %s",
+                            (now - timedelta(days=self.retention_days[rollup.name]),))
+                conn.commit()
+        return watermarks
+
+    def choose_resolution(self, start, end, points=300):
+        # Coarsest rollup whose buckets are still no wider than the step
+        # needed for `points` samples and whose retention reaches `start`
+        # (to within one bucket, so "the last 7 days" still fits 7 days)
+        step = (end - start).total_seconds() / max(points, 1)
+        now = datetime.now(timezone.utc)
+        covering = [rollup for rollup in ROLLUPS
+                    if start + timedelta(seconds=rollup.width) >=
+                    now - timedelta(days=self.retention_days[rollup.name])]
+        fitting = [rollup for rollup in covering if rollup.width <= step]
+        if fitting:
+            return fitting[-1]
+        if covering:
+            return covering[0]
+        return ROLLUPS[-1]
+
+    def query(self, conn, target, start, end, points=300):
+        rollup = self.choose_resolution(start, end, points)
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT bucket, count, success_count, rtt_min, rtt_max, rtt_sum,
+                       rtt_sketch, attempts_hist
+                FROM {rollup.table}
+                WHERE target = %s AND bucket >= %s AND bucket < %s
+                ORDER BY bucket
+            """, (target, self.floor(start, rollup.width), end))
+            rows = cur.fetchall()
+        return rollup.name, [{
+            "bucket": bucket,
+            "count": count,
+            "success_count": success,
+            "loss": (1 - success / count) * 100 if count else None,
+            "rtt_min": rtt_min,
+            "rtt_max": rtt_max,
+            "rtt_avg": rtt_sum / success if success else None,
+            "rtt_p50": sketch_percentile(sketch, 0.5, rtt_min, rtt_max),
+            "rtt_p95": sketch_percentile(sketch, 0.95, rtt_min, rtt_max),
+            "attempts_hist": attempts
+        } for bucket, count, success, rtt_min, rtt_max, rtt_sum, sketch, attempts in rows]
+
+
+HISTORY_RANGES = (
+    ("1 hour", 3600),
+    ("6 hours", 6 * 3600),
+    ("24 hours", 86400),
+    ("7 days", 7 * 86400),
+    ("30 days", 30 * 86400),
+    ("90 days", 90 * 86400),
+)
+
+
+def lttb(x, y, points):
+    # Largest-Triangle-Three-Buckets: indices of `points` samples of the
+    # series (x ascending) that keep its visual shape, spikes included.
+    # The first and last samples are always kept.
+    count = len(x)
+    if points >= count or points < 3:
+        return np.arange(count)
+    edges = np.linspace(1, count - 1, points - 1).astype(np.int64)
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, count - 1
+    previous = 0
+    for index in range(points - 2):
+        lo, hi = edges[index], edges[index + 1]
+        following = slice(hi, edges[index + 2] if index + 2 < len(edges) else count)
+        next_x, next_y = x[following].mean(), y[following].mean()
+        area = np.abs((x[previous] - next_x) * (y[lo:hi] - y[previous]) -
+                      (x[previous] - x[lo:hi]) * (next_y - y[previous]))
+        previous = lo + int(np.argmax(area))
+        selected[index + 1] = previous
+    return selected
+
+
+def bucket_means(x, y, start, width):
+    # (bucket middles, mean of y) over buckets of `width` from `start`,
+    # for the buckets that have samples
+    if not len(x):
+        return np.zeros(0), np.zeros(0)
+    index = ((x - start) // width).astype(np.int64)
+    index -= index[0]
+    sums = np.bincount(index, weights=y)
+    counts = np.bincount(index)
+    keep = counts > 0
+    middles = start + (np.arange(len(counts)) + (x[0] - start) // width + 0.5) * width
+    return middles[keep], sums[keep] / counts[keep]
+
+
+TARGET_SETTINGS = ("probe_interval", "retry_attempts", "retry_delay", "hedge_after")
+TARGET_SETTING_TYPES = (float, int, float, float)
+HOSTNAME_PATTERN = re.compile(r"^(?=.{1,253}$)[a-z0-9_]([a-z0-9_-]{0,61}[a-z0-9])?(\.[a-z0-9_]([a-z0-9_-]{0,61}[a-z0-9])?)*$")
+MAX_RANGE_HOSTS = 65536
+
+
+def normalize_target(value):
+    # Canonical form of an IPv4 address or hostname; ValueError otherwise
+    value = value.strip()
+    try:
+        return str(ipaddress.IPv4Address(value))
+    except ValueError:
+        pass
+    name = value.lower().rstrip(".")
+    if not HOSTNAME_PATTERN.match(name) or name.replace(".", "").isdigit():
+        raise ValueError(f"not an IPv4 address or hostname: {value!r}")
+    return name
+
+
+def expand_target(value):
+    # A target, or every host address of an IPv4 CIDR range
+    if "/" not in value:
+        return [normalize_target(value)]
+    network = ipaddress.IPv4Network(value.strip(), strict=False)
+    if network.num_addresses > MAX_RANGE_HOSTS:
+        raise ValueError(f"range larger than {MAX_RANGE_HOSTS} addresses: {value}")
+    return [str(host) for host in network.hosts()] or [str(network.network_address)]
+
+
+def target_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    return {".csv": "csv", ".json": "json"}.get(extension, "text")
+
+
+def parse_targets(text, fmt="text"):
+    # Reads a target list: CSV with a target column (and optionally the
+    # ping_targets setting columns), JSON (a list of names or objects, or
+    # {"targets": [...]}) or plain text (names, addresses and CIDR ranges
+    # separated by whitespace or commas, # starts a comment). Returns
+    # (entries, columns, errors): entries maps each target, in file order
+    # and without duplicates, to its settings tuple; columns names the
+    # settings the file provides; errors lists what was rejected.
+    records = []  # (where, value, {setting: raw value})
+    columns = set()
+    errors = []
+    if fmt == "csv":
+        rows = [row for row in csv.reader(io.StringIO(text)) if any(cell.strip() for cell in row)]
+        header = [cell.strip().lower() for cell in rows[0]] if rows else []
+        if "target" in header:
+            index = header.index("target")
+            present = [(name, header.index(name)) for name in TARGET_SETTINGS if name in header]
+            columns.update(name for name, _ in present)
+            for number, row in enumerate(rows[1:], 2):
+                records.append((f"line {number}", row[index] if index < len(row) else "",
+                                {name: row[column] for name, column in present if column < len(row)}))
+        else:
+            records = [(f"line {number}", row[0], {}) for number, row in enumerate(rows, 1)]
+    elif fmt == "json":
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get("targets", [])
+        if not isinstance(data, list):
+            raise ValueError('expected a list of targets or {"targets": [...]}')
+        for number, item in enumerate(data, 1):
+            if isinstance(item, dict) and isinstance(item.get("target"), str):
+                settings = {name: item[name] for name in TARGET_SETTINGS if name in item}
+                columns.update(settings)
+                records.append((f"item {number}", item["target"], settings))
+            elif isinstance(item, str):
+                records.append((f"item {number}", item, {}))
+            else:
+                errors.append(f"item {number}: not a target name or an object with a target name")
+    else:
+        for number, line in enumerate(text.splitlines(), 1):
+            for value in re.split(r"[\s,;]+", line.split("#", 1)[0]):
+                if value:
+                    records.append((f"line {number}", value, {}))
+    
+    entries = {}
+    for where, value, settings in records:
+        try:
+            targets = expand_target(value)
+            values = []
+            for name, kind in zip(TARGET_SETTINGS, TARGET_SETTING_TYPES):
+                raw = settings.get(name)
+                if isinstance(raw, (list, dict, bool)):
+                    raise ValueError(f"{name} is not a number: {raw!r}")
+                values.append(None if raw is None or str(raw).strip() == "" else kind(raw))
+        except ValueError as e:
+            errors.append(f"{where}: {str(e)}")
+            continue
+        for target in targets:
+            entries.setdefault(target, tuple(values))
+    columns = tuple(name for name in TARGET_SETTINGS if name in columns)
+    return entries, columns, errors
+
+
+def format_targets(rows, fmt="text"):
+    # Inverse of parse_targets for rows of (target, *settings)
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(("target",) + TARGET_SETTINGS)
+        writer.writerows(["" if value is None else value for value in row] for row in rows)
+        return buffer.getvalue()
+    if fmt == "json":
+        items = [dict({"target": row[0]}, **{name: value for name, value in zip(TARGET_SETTINGS, row[1:])
+                                             if value is not None}) for row in rows]
+        return json.dumps({"targets": items}, indent=1) + "\n"
+    return "".join(f"{row[0]}\n" for row in rows)
+
+
+class InventorySync(DatabaseJob):
+    # Follows an inventory file (any format parse_targets reads): whenever
+    # its content changes, the target list is synced to it in one
+    # transaction, and only the difference reaches the running engine.
+    # With `remove`, targets missing from the file are removed.
+    name = "Inventory sync"
+
+    def __init__(self, engine, path, interval=300, remove=True):
+        super().__init__(engine.db_params, engine.bus, interval)
+        self.engine = engine
+        self.path = path
+        self.remove = remove
+        self.signature = None  # (mtime, size) of the last file seen
+        self.digest = None     # hash of the last content synced
+
+    def start(self):
+        super().start()
+        self.wake()
+
+    def maintain(self, conn):
+        stat = os.stat(self.path)
+        signature = (stat.st_mtime, stat.st_size)
+        if signature == self.signature:
+            return
+        with open(self.path, encoding="utf-8") as f:
+            text = f.read()
+        digest = zlib.crc32(text.encode("utf-8"))
+        if digest != self.digest:
+            conn.autocommit = False
+            try:
+                changes = self.engine.import_text(text, target_format(self.path), self.path,
+                                                  replace=self.remove, conn=conn)
+            finally:
+                conn.autocommit = True
+            if changes is None:
+                return  # Try again next time
+            self.digest = digest
+        self.signature = signature
+
+
+class StatusModel:
+    # Compact backing store for the status table: one tuple per target
+    # (status, rtt, last check, success rate, attempts, loss %, jitter, DNS
+    # error) plus a filtered,
+    # sorted view of target names. The view is rebuilt when sort, filter or
+    # search change, and at most once per resort_interval for value updates.
+    columns = ("target", "status", "last_response", "last_check", "success_rate", "attempts",
+               "loss", "jitter")
+    filters = ("All", "Online", "Offline", "Unknown")
+
+    def __init__(self, resort_interval=1.0):
+        self.rows = {}
+        self.view = []
+        self.sort_column = "target"
+        self.sort_reverse = False
+        self.status_filter = "All"
+        self.search = ""
+        self.resort_interval = resort_interval
+        self.structure_changed = True
+        self.values_changed = False
+        self.last_rebuild = 0.0
+
+    def reset(self, targets):
+        self.rows = {target: (None,) * 8 for target in targets}
+        self.structure_changed = True
+
+    def add(self, target):
+        self.rows.setdefault(target, (None,) * 8)
+        self.structure_changed = True
+
+    def remove(self, target):
+        self.rows.pop(target, None)
+        self.structure_changed = True
+
+    def update(self, target, status, response_time, checked_at, success_rate, attempts,
+               loss=None, jitter=None, dns_error=None):
+        if target in self.rows:
+            self.rows[target] = (status, response_time, checked_at, success_rate, attempts,
+                                 loss, jitter, dns_error)
+            self.values_changed = True
+
+    def set_sort(self, column):
+        if self.sort_column == column:
+            self.sort_reverse = not self.sort_reverse
+        else:
+            self.sort_column = column
+            self.sort_reverse = column in ("last_check", "last_response", "loss", "jitter")
+        self.structure_changed = True
+
+    def set_filter(self, status_filter, search):
+        self.status_filter = status_filter
+        self.search = search.strip().lower()
+        self.structure_changed = True
+
+    def matches(self, target, row):
+        if self.search and self.search not in target.lower():
+            return False
+        if self.status_filter == "Online":
+            return row[0] is True
+        if self.status_filter == "Offline":
+            return row[0] is False
+        if self.status_filter == "Unknown":
+            return row[0] is None
+        return True
+
+    def visible(self):
+        now = time.monotonic()
+        if self.structure_changed or (self.values_changed and now - self.last_rebuild >= self.resort_interval):
+            self.rebuild()
+            self.last_rebuild = now
+        return self.view
+
+    def rebuild(self):
+        rows = self.rows
+        targets = [target for target, row in rows.items() if self.matches(target, row)]
+        if self.sort_column == "target":
+            targets.sort(reverse=self.sort_reverse)
+        else:
+            # Rows without a value (never checked) always sort last
+            index = self.columns.index(self.sort_column) - 1
+            if self.sort_column == "status":
+                key = lambda target: (rows[target][0] is not True, target)
+                present = [target for target in targets if rows[target][0] is not None]
+            else:
+                key = lambda target: rows[target][index]
+                present = [target for target in targets if rows[target][index] is not None]
+            present_set = set(present)
+            missing = [target for target in targets if target not in present_set]
+            present.sort(key=key, reverse=self.sort_reverse)
+            missing.sort()
+            targets = present + missing
+        self.view = targets
+        self.structure_changed = False
+        self.values_changed = False
+
+    def display(self, target, attempts_of):
+        status, response_time, checked_at, success_rate, attempts, loss, jitter, dns_error = self.rows[target]
+        if status is None:
+            return (target, "Unknown", "N/A", "Never", "N/A", "0", "N/A", "N/A"), "unknown"
+        return (
+            target,
+            "Online" if status else "Offline",
+            f"{response_time:.2f}" if status else ("DNS error" if dns_error else "Timeout"),
+            datetime.fromtimestamp(checked_at).strftime("%Y-%m-%d %H:%M:%S"),
+            f"{success_rate:.1f}%",
+            f"{attempts}/{attempts_of}",
+            f"{loss:.0f}%" if loss is not None else "N/A",
+            f"{jitter:.2f}" if jitter is not None else "N/A"
+        ), "online" if status else "offline"
+
+
+class VirtualStatusTable:
+    # Treeview holding only as many rows as fit on screen. Scrolling moves a
+    # window over StatusModel's view and rewrites those rows in place, so
+    # widget cost stays constant however many targets are monitored.
+    def __init__(self, parent, model, attempts_of):
+        self.model = model
+        self.attempts_of = attempts_of
+        self.offset = 0
+        self.items = []
+        self.selected = set()
+        self.row_height = 25
+
+        frame = ttk.Frame(parent)
+        frame.pack(fill=tk.BOTH, expand=True)
+        self.scrollbar = ttk.Scrollbar(frame, command=self.on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree = ttk.Treeview(
+            frame,
+            columns=StatusModel.columns,
+            show="headings",
+            selectmode="extended",
+            height=1
+        )
+        
+        # Configure columns (click a heading to sort by it)
+        headings = (
+            ("target", "Target", tk.W),
+            ("status", "Status", tk.CENTER),
+            ("last_response", "Response (ms)", tk.CENTER),
+            ("last_check", "Last Check", tk.CENTER),
+            ("success_rate", "Success Rate", tk.CENTER),
+            ("attempts", "Attempts", tk.CENTER),
+            ("loss", "Loss", tk.CENTER),
+            ("jitter", "Jitter (ms)", tk.CENTER)
+        )
+        for column, text, anchor in headings:
+            self.tree.heading(column, text=text, anchor=anchor,
+                              command=lambda c=column: self.sort_by(c))
+        
+        self.tree.column("target", width=200, stretch=tk.YES)
+        self.tree.column("status", width=100, stretch=tk.NO, anchor=tk.CENTER)
+        self.tree.column("last_response", width=100, stretch=tk.NO, anchor=tk.CENTER)
+        self.tree.column("last_check", width=150, stretch=tk.NO, anchor=tk.CENTER)
+        self.tree.column("success_rate", width=100, stretch=tk.NO, anchor=tk.CENTER)
+        self.tree.column("attempts", width=80, stretch=tk.NO, anchor=tk.CENTER)
+        self.tree.column("loss", width=70, stretch=tk.NO, anchor=tk.CENTER)
+        self.tree.column("jitter", width=90, stretch=tk.NO, anchor=tk.CENTER)
+        self.tree.pack(fill=tk.BOTH, expand=True)
+        
+        # Row colors, configured once
+        self.tree.tag_configure('online', foreground='#7e57c2')
+        self.tree.tag_configure('offline', foreground='#ff5252')
+        
+        self.tree.bind("<Configure>", self.on_resize)
+        self.tree.bind("<MouseWheel>", self.on_mousewheel)
+        self.tree.bind("<Button-4>", lambda event: self.scroll_by(-3))
+        self.tree.bind("<Button-5>", lambda event: self.scroll_by(3))
+        self.tree.bind("<<TreeviewSelect>>", self.on_select)
+
+    def on_resize(self, event):
+        # Grow or shrink the row pool to the visible height
+        rows = max(1, (event.height - self.row_height) // self.row_height)
+        while len(self.items) < rows:
+            self.items.append(self.tree.insert("", tk.END, values=("",) * len(StatusModel.columns)))
+        if len(self.items) > rows:
+            self.tree.delete(*self.items[rows:])
+            del self.items[rows:]
+        self.refresh()
+
+    def on_mousewheel(self, event):
+        self.scroll_by(-1 if event.delta > 0 else 1)
+
+    def on_scrollbar(self, *args):
+        view = self.model.visible()
+        if args[0] == "moveto":
+            self.offset = int(float(args[1]) * len(view))
+        elif args[0] == "scroll":
+            step = len(self.items) if args[2] == "pages" else 1
+            self.offset += int(args[1]) * step
+        self.refresh()
+
+    def scroll_by(self, rows):
+        self.offset += rows
+        self.refresh()
+
+    def sort_by(self, column):
+        self.model.set_sort(column)
+        self.refresh()
+
+    def on_select(self, event):
+        # Reads the current window, so late events from refresh() are harmless
+        view = self.model.view
+        chosen = set(self.tree.selection())
+        for position, item in enumerate(self.items):
+            index = self.offset + position
+            if index >= len(view):
+                break
+            if item in chosen:
+                self.selected.add(view[index])
+            else:
+                self.selected.discard(view[index])
+
+    def selected_targets(self):
+        return [target for target in self.selected if target in self.model.rows]
+
+    def refresh(self):
+        view = self.model.visible()
+        page = len(self.items)
+        self.offset = max(0, min(self.offset, len(view) - page))
+        selection = []
+        for position, item in enumerate(self.items):
+            index = self.offset + position
+            if index < len(view):
+                target = view[index]
+                values, tag = self.model.display(target, self.attempts_of())
+                self.tree.item(item, values=values, tags=(tag,))
+                if target in self.selected:
+                    selection.append(item)
+            else:
+                self.tree.item(item, values=("",) * len(StatusModel.columns), tags=())
+        if set(selection) != set(self.tree.selection()):
+            self.tree.selection_set(selection)
+        if view:
+            self.scrollbar.set(self.offset / len(view), min(1.0, (self.offset + page) / len(view)))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+
+class HistoryWindow:
+    # RTT and loss charts of one target over a selectable range. The data
+    # comes from MonitorEngine.history_series on a thread, already
+    # downsampled, and is drawn chunk by chunk as it arrives through the
+    # dashboard's message queue.
+    points = 600
+
+    def __init__(self, root, engine, message_queue, target):
+        self.engine = engine
+        self.message_queue = message_queue
+        self.target = target
+        self.request = 0
+        self.window = tk.Toplevel(root)
+        self.window.title(f"History: {target}")
+        self.window.geometry("960x620")
+        
+        top = ttk.Frame(self.window, padding="10")
+        top.pack(fill=tk.X)
+        ttk.Label(top, text="Range:").pack(side=tk.LEFT)
+        self.range_var = tk.StringVar(value=HISTORY_RANGES[0][0])
+        range_box = ttk.Combobox(
+            top,
+            textvariable=self.range_var,
+            values=[name for name, _ in HISTORY_RANGES],
+            state="readonly",
+            width=10
+        )
+        range_box.pack(side=tk.LEFT, padx=(5, 10))
+        range_box.bind("<<ComboboxSelected>>", lambda event: self.load())
+        ttk.Button(top, text="Refresh", command=self.load).pack(side=tk.LEFT)
+        self.info_label = ttk.Label(top, text="")
+        self.info_label.pack(side=tk.LEFT, padx=(10, 0))
+        
+        self.figure = Figure(figsize=(9, 5.5), dpi=100, facecolor="#1a1a1a")
+        self.rtt_axes, self.loss_axes = self.figure.subplots(2, 1, sharex=True, gridspec_kw={"height_ratios": (2, 1)})
+        for axes, label in ((self.rtt_axes, "RTT (ms)"), (self.loss_axes, "Loss (%)")):
+            axes.set_facecolor("#2a2a2a")
+            axes.set_ylabel(label, color="#ffffff")
+            axes.tick_params(colors="#ffffff")
+            axes.grid(True, color="#404040")
+        self.rtt_line, = self.rtt_axes.plot([], [], color="#9b59b6", linewidth=1)
+        self.loss_line, = self.loss_axes.plot([], [], color="#e74c3c", linewidth=1, drawstyle="steps-mid")
+        self.loss_axes.set_ylim(0, 100)
+        self.figure.autofmt_xdate()
+        self.canvas = FigureCanvasTkAgg(self.figure, master=self.window)
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        self.load()
+
+    def load(self):
+        self.request += 1
+        self.rtt = (np.zeros(0), np.zeros(0))
+        self.loss = (np.zeros(0), np.zeros(0))
+        self.sources = []
+        span = dict(HISTORY_RANGES)[self.range_var.get()]
+        end = time.time()
+        self.started = time.perf_counter()
+        self.info_label.config(text="Loading...")
+        self.rtt_axes.set_xlim(datetime.fromtimestamp(end - span), datetime.fromtimestamp(end))
+        self.draw()
+        threading.Thread(target=self.fetch, args=(self.request, end - span, end), daemon=True).start()
+
+    def fetch(self, request, start, end):
+        try:
+            for chunk in self.engine.history_series(self.target, start, end, self.points):
+                self.message_queue.put(("history", (self, request, chunk)))
+        except Exception as e:
+            self.message_queue.put(("history", (self, request, {"error": str(e)})))
+        else:
+            self.message_queue.put(("history", (self, request, None)))
+
+    def add(self, request, chunk):
+        # Called by check_queue on the UI thread; None ends a request
+        if request != self.request or not self.window.winfo_exists():
+            return
+        if chunk is None:
+            points = len(self.rtt[0]) + len(self.loss[0])
+            self.info_label.config(text=f"{points} points from {', '.join(sorted(set(self.sources)))} "
+                                        f"in {(time.perf_counter() - self.started) * 1000:.0f}ms")
+            return
+        if "error" in chunk:
+            self.info_label.config(text=f"Cannot load history: {chunk['error']}")
+            return
+        self.sources.append(chunk["source"])
+        self.rtt = self.merge(self.rtt, chunk["rtt"])
+        self.loss = self.merge(self.loss, chunk["loss"])
+        self.draw()
+
+    @staticmethod
+    def merge(series, chunk):
+        # Chunks arrive newest first and do not overlap
+        return np.concatenate([chunk[0], series[0]]), np.concatenate([chunk[1], series[1]])
+
+    def draw(self):
+        for line, (times, values) in ((self.rtt_line, self.rtt), (self.loss_line, self.loss)):
+            line.set_data([datetime.fromtimestamp(moment) for moment in times], values)
+        self.rtt_axes.relim()
+        self.rtt_axes.autoscale_view(scalex=False)
+        self.canvas.draw_idle()
+
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ping.ini")
+
+DEFAULT_CONFIG = {
+    "database": {
+        "host": "172.20.200.253",
+        "database": "postgres",
+        "user": "postgres",
+        "password": "yamaha1*"
+    },
+    "monitor": {
+        "interval": "3",
+        "attempts": "2",
+        "timeout": "0.5",
+        "ttl_days": "30",
+        "transport": "auto",
+        "min_interval": "1",
+        "max_interval": "300",
+        "max_pps": "10000",
+        "retry_delay": "0.5",
+        "hedge_after": "0",
+        "burst": "1",
+        "burst_spacing": "0.02",
+        "history_hours": "4",
+        "history_budget_mb": "512",
+        "history_path": os.path.join(os.path.dirname(os.path.abspath(__file__)), "ping_history.snapshot"),
+        "workers": "1",
+        "dns_ttl": "300",
+        "dns_negative_ttl": "30",
+        "target_refresh": "60",
+        "wal_dir": os.path.join(os.path.dirname(os.path.abspath(__file__)), "ping_results.wal"),
+        "replay_rate": "20000",
+        "instrument": "true",
+        "trace_sample": "0.001",
+        "profile_path": os.path.join(os.path.dirname(os.path.abspath(__file__)), "ping_profile.pstats"),
+        "state_path": os.path.join(os.path.dirname(os.path.abspath(__file__)), "ping_state.json")
+    },
+    "stream": {
+        "bind": "0.0.0.0",
+        "port": "0"
+    },
+    "metrics": {
+        "bind": "0.0.0.0",
+        "port": "0"
+    },
+    "inventory": {
+        "path": "",
+        "interval": "300",
+        "remove": "true"
+    },
+    "events": {
+        "down_after": "2",
+        "up_after": "2",
+        "latency_threshold": "0",
+        "latency_clear": "0.8",
+        "latency_after": "3",
+        "group_window": "5",
+        "group_prefix": "24",
+        "group_min": "3",
+        "persist": "true",
+        "webhook": "",
+        "webhook_timeout": "5"
+    },
+    "log": {
+        "level": "info",
+        "lines": "5000",
+        "path": "",
+        "file_level": "info",
+        "max_mb": "10",
+        "backups": "5"
+    },
+    "agent": {
+        "enabled": "false",
+        "id": socket.gethostname(),
+        "vantage": "default",
+        "shards": "64",
+        "lease_ttl": "30",
+        "heartbeat": "5"
+    }
+}
+
+
+def load_config(path=DEFAULT_CONFIG_PATH):
+    # INI file with the sections of DEFAULT_CONFIG ([database], [monitor],
+    # [agent], ...); anything missing falls back to DEFAULT_CONFIG
+    config = configparser.ConfigParser(interpolation=None)
+    config.read_dict(DEFAULT_CONFIG)
+    if path and os.path.exists(path):
+        config.read(path)
+    return config
+
+
+class LatencyHistogram:
+    # Latencies in log-spaced buckets, four per doubling from 10us to about
+    # 20 minutes: recording is a log2 and an increment, and percentiles are
+    # good to one bucket (19%). Every histogram is written by one thread
+    # only, so there is no lock; a reader may see a record half applied.
+    base = 1e-5
+    per_doubling = 4
+    size = 108
+
+    def __init__(self):
+        self.counts = [0] * self.size
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        index = 0
+        if seconds > self.base:
+            index = min(self.size - 1, int(math.log2(seconds / self.base) * self.per_doubling) + 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        # Upper edge of the bucket holding the q-th percentile, in seconds
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(self.base * 2 ** (index / self.per_doubling), self.max)
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0}
+        return {"count": self.count,
+                "mean_ms": round(self.total / self.count * 1000, 3),
+                "p50_ms": round(self.percentile(50) * 1000, 3),
+                "p90_ms": round(self.percentile(90) * 1000, 3),
+                "p99_ms": round(self.percentile(99) * 1000, 3),
+                "max_ms": round(self.max * 1000, 3)}
+
+
+class EngineInstruments:
+    # Hot-path instrumentation: a latency histogram per stage of a check,
+    # end-to-end traces of a sample of the checks, and a profiler that can
+    # be switched on while the engine runs. Stages:
+    #   schedule  deadline to launch of an attempt
+    #   dns       name resolution (cache hits included)
+    #   echo      echo request sent to reply or timeout
+    #   dispatch  attempt finished to picked up by the probe loop
+    #   check     first launch to final result, retries included
+    #   handle    bookkeeping and publishing of a result
+    #   flush     COPY round-trip of a batch
+    #   persist   result queued to committed (oldest row of each batch)
+    #   display   result published to drawn by the dashboard
+    stages = ("schedule", "dns", "echo", "dispatch", "check", "handle", "flush", "persist", "display")
+    max_open_traces = 1000
+
+    def __init__(self, enabled=True, trace_sample=0.001, traces=100, profile_path=None):
+        self.enabled = enabled
+        self.trace_sample = trace_sample
+        self.histograms = {stage: LatencyHistogram() for stage in self.stages}
+        self.traces = deque(maxlen=traces)
+        self.persisting = {}  # result_key -> trace waiting for its batch to commit
+        self.displaying = {}  # target -> trace waiting for the dashboard
+        self.profile_path = profile_path
+        self.profiling = False
+        self.profilers = {}  # thread name -> running cProfile.Profile
+        self.finished = []   # profilers stopped since profiling was switched off
+        self.lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        if self.enabled:
+            self.histograms[stage].record(seconds)
+
+    def attempt(self, result, now):
+        # One finished attempt as it reaches the probe loop
+        if not self.enabled:
+            return
+        self.histograms["dns"].record(result["dns_time"])
+        if result["echo_time"] is not None:
+            self.histograms["echo"].record(result["echo_time"])
+        self.histograms["dispatch"].record(max(0.0, now - result["finished"]))
+
+    def trace(self, result, checked, handle_time):
+        # Start the trace of a sampled check; persist and display are
+        # filled in by the writer and the dashboard
+        trace = {
+            "target": result["target"],
+            "status": result["status"],
+            "attempts": result["attempts"],
+            "checked": checked,
+            "schedule_ms": round(result.get("lag", 0.0) * 1000, 3),
+            "dns_ms": round(result["dns_time"] * 1000, 3),
+            "echo_ms": round(result["echo_time"] * 1000, 3) if result["echo_time"] is not None else None,
+            "dispatch_ms": round(max(0.0, checked - result["finished"]) * 1000, 3),
+            "check_ms": result["duration"],
+            "handle_ms": round(handle_time * 1000, 3),
+            "persist_ms": None,
+            "display_ms": None
+        }
+        self.traces.append(trace)
+        if len(self.displaying) < self.max_open_traces:
+            self.displaying[result["target"]] = trace
+        return trace
+
+    def sampled(self):
+        return self.enabled and self.trace_sample > 0 and random.random() < self.trace_sample
+
+    def queued(self, key, trace):
+        if len(self.persisting) < self.max_open_traces:
+            self.persisting[key] = trace
+
+    def committed(self, rows, seconds):
+        # A batch of result rows reached the database after `seconds`
+        if not self.enabled or not rows:
+            return
+        now = time.time()
+        self.histograms["flush"].record(seconds)
+        self.histograms["persist"].record(max(0.0, now - rows[0][4].timestamp()))
+        if self.persisting:
+            for row in rows:
+                trace = self.persisting.pop(row[-1], None)
+                if trace is not None:
+                    trace["persist_ms"] = round((now - trace["checked"]) * 1000, 3)
+
+    def displayed(self, updates, now):
+        # Status updates (target, status, rtt, published at, ...) just drawn
+        if not self.enabled:
+            return
+        histogram = self.histograms["display"]
+        for content in updates:
+            histogram.record(max(0.0, now - content[3]))
+            if self.displaying:
+                trace = self.displaying.pop(content[0], None)
+                if trace is not None:
+                    trace["display_ms"] = round((now - trace["checked"]) * 1000, 3)
+
+    def summary(self):
+        return {stage: histogram.summary() for stage, histogram in self.histograms.items()}
+
+    def toggle_profiling(self):
+        with self.lock:
+            self.profiling = not self.profiling
+            return self.profiling
+
+    def profile_point(self, name):
+        # Called from the main loop of a thread (cProfile only sees the
+        # thread that enabled it): starts or stops its profiler to follow
+        # the toggle
+        profiler = self.profilers.get(name)
+        if self.profiling == (profiler is not None):
+            return
+        if profiler is None:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                return  # Python 3.12+: one profiler already covers all threads
+            self.profilers[name] = profiler
+        else:
+            profiler.disable()
+            del self.profilers[name]
+            with self.lock:
+                self.finished.append(profiler)
+
+    def save_profile(self, timeout=3.0):
+        # Wait for the profiled threads to stop, merge their profiles and
+        # write them to profile_path. Returns the hottest functions as
+        # (location, calls, own seconds, cumulative seconds).
+        deadline = time.monotonic() + timeout
+        while self.profilers and time.monotonic() < deadline:
+            time.sleep(0.05)
+        with self.lock:
+            profilers, self.finished = self.finished, []
+        if not profilers:
+            return []
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        if self.profile_path:
+            stats.dump_stats(self.profile_path)
+        hottest = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:10]
+        return [(f"{os.path.basename(filename)}:{line}({function})", calls, own, cumulative)
+                for (filename, line, function), (_, calls, own, cumulative, _) in hottest]
+
+
+class MessageBus:
+    # Fan-out of engine messages to every subscriber queue. Components only
+    # call put(), like the single queue they used to share with the GUI.
+    # A full subscriber queue drops messages rather than stalling the engine.
+    def __init__(self):
+        self.subscribers = []
+        self.types = {}  # subscriber queue -> message types it takes (all if absent)
+        self.lock = threading.Lock()
+
+    def subscribe(self, maxsize=200000, types=None):
+        queue = Queue(maxsize=maxsize)
+        with self.lock:
+            self.subscribers.append(queue)
+            if types is not None:
+                self.types[queue] = frozenset(types)
+        return queue
+
+    def unsubscribe(self, queue):
+        with self.lock:
+            if queue in self.subscribers:
+                self.subscribers.remove(queue)
+            self.types.pop(queue, None)
+
+    def put(self, message):
+        with self.lock:
+            subscribers = list(self.subscribers)
+            types = self.types
+        for queue in subscribers:
+            if queue in types and message[0] not in types[queue]:
+                continue
+            try:
+                queue.put_nowait(message)
+            except Full:
+                pass
+
+
+LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+WARNING_EVENTS = ("down", "outage", "latency_high")
+
+
+def log_entry(message_type, content):
+    # (level, text) of a "log" or "event" bus message. Log content is the
+    # text itself at info level, or a (level, text) pair (a list once it
+    # has been through the result stream).
+    if message_type == "event":
+        return "warning" if content["kind"] in WARNING_EVENTS else "info", content["message"]
+    if isinstance(content, str):
+        return "info", content
+    return content[0], content[1]
+
+
+class ActivityLog:
+    # The last `capacity` log lines as (time, level, line), backing the
+    # dashboard's log widget so it never holds more than that
+    def __init__(self, capacity=5000):
+        self.entries = deque(maxlen=capacity)
+
+    def append(self, when, level, text):
+        line = f"[{datetime.fromtimestamp(when).strftime('%Y-%m-%d %H:%M:%S')}] {text}"
+        self.entries.append((when, level, line))
+        return line
+
+    def lines(self, level="debug"):
+        threshold = LOG_LEVELS[level]
+        return [line for _, entry_level, line in self.entries if LOG_LEVELS[entry_level] >= threshold]
+
+
+class LogFileSink:
+    # Writes log lines and events at `level` or above to `path` as JSON
+    # lines, from its own thread and in batches, so file I/O never runs on
+    # the probe loop or the UI thread. The file is rotated to path.1 ..
+    # path.<backups> before a batch would take it past max_bytes.
+    def __init__(self, bus, path, level="info", max_bytes=10 * 1024 * 1024, backups=5):
+        self.bus = bus
+        self.path = path
+        self.threshold = LOG_LEVELS[level]
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue = None
+        self.thread = None
+        self.stopping = False
+        self.file = None
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stopping = False
+        self.queue = self.bus.subscribe(types=("log", "event"))
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        self.stopping = True
+        if self.thread:
+            self.thread.join(timeout=timeout)
+        self.bus.unsubscribe(self.queue)
+
+    def run(self):
+        try:
+            while True:
+                try:
+                    messages = [self.queue.get(timeout=0.5)]
+                except Empty:
+                    if self.stopping:
+                        break
+                    continue
+                while len(messages) < 10000:
+                    try:
+                        messages.append(self.queue.get_nowait())
+                    except Empty:
+                        break
+                self.write(messages)
+        finally:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+    def write(self, messages):
+        now = datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+        lines = []
+        for message_type, content in messages:
+            level, text = log_entry(message_type, content)
+            if LOG_LEVELS[level] < self.threshold:
+                continue
+            record = {"time": now, "level": level, "message": text}
+            if message_type == "event":
+                record["time"] = datetime.fromtimestamp(content["time"], timezone.utc).isoformat(
+                    timespec="milliseconds")
+                record["event"] = content
+            lines.append(json.dumps(record) + "\n")
+        if not lines:
+            return
+        data = "".join(lines).encode("utf-8")
+        try:
+            if self.file is None:
+                self.file = open(self.path, "ab")
+            if self.file.tell() and self.file.tell() + len(data) > self.max_bytes:
+                self.rotate()
+                self.file = open(self.path, "ab")
+            self.file.write(data)
+            self.file.flush()
+        except OSError as e:
+            # Nowhere to log this but the bus; the lines are lost
+            self.bus.put(("log", ("error", f"Cannot write log file {self.path}: {str(e)}")))
+            if self.file:
+                self.file.close()
+                self.file = None
+
+    def rotate(self):
+        self.file.close()
+        self.file = None
+        for index in range(self.backups, 0, -1):
+            source = f"{self.path}.{index - 1}" if index > 1 else self.path
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index}")
+        if self.backups < 1:
+            os.remove(self.path)
+
+
+class ResultStreamServer:
+    # Serves the engine's message stream as JSON lines over TCP so a GUI on
+    # another host can follow a headless engine
+    def __init__(self, bus, host, port):
+        self.bus = bus
+        self.server = socket.create_server((host, port), reuse_port=False)
+        self.thread = None
+        self.stopping = False
+
+    def start(self):
+        self.thread = threading.Thread(target=self.accept_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping = True
+        self.server.close()
+
+    def accept_loop(self):
+        while not self.stopping:
+            try:
+                client, address = self.server.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.serve, args=(client, address), daemon=True).start()
+
+    def serve(self, client, address):
+        queue = self.bus.subscribe()
+        self.bus.put(("log", f"Stream client connected: {address[0]}:{address[1]}"))
+        try:
+            with client:
+                while not self.stopping:
+                    message_type, content = queue.get()
+                    lines = [json.dumps({"type": message_type, "content": content})]
+                    # Send whatever else is already queued in the same write
+                    while len(lines) < 1000:
+                        try:
+                            message_type, content = queue.get_nowait()
+                        except Empty:
+                            break
+                        lines.append(json.dumps({"type": message_type, "content": content}))
+                    client.sendall(("\n".join(lines) + "\n").encode("utf-8"))
+        except OSError:
+            pass
+        finally:
+            self.bus.unsubscribe(queue)
+
+
+class ResultStreamClient:
+    # Reads a ResultStreamServer and replays its messages into a local
+    # queue, reconnecting after failures
+    def __init__(self, address, queue, retry_interval=5):
+        host, _, port = address.rpartition(":")
+        self.address = (host or "localhost", int(port))
+        self.queue = queue
+        self.retry_interval = retry_interval
+        self.thread = None
+        self.stopping = False
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping = True
+
+    def run(self):
+        while not self.stopping:
+            try:
+                with socket.create_connection(self.address, timeout=10) as conn:
+                    conn.settimeout(None)
+                    self.queue.put(("log", f"Connected to engine at {self.address[0]}:{self.address[1]}"))
+                    for line in conn.makefile("r", encoding="utf-8"):
+                        message = json.loads(line)
+                        self.queue.put((message["type"], message["content"]))
+                        if self.stopping:
+                            return
+                self.queue.put(("log", "Engine stream closed"))
+            except (OSError, ValueError) as e:
+                self.queue.put(("log", ("error", f"Engine stream error: {str(e)}")))
+            time.sleep(self.retry_interval)
+
+
+def metric_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class MetricsExporter:
+    # Prometheus/OpenMetrics endpoint. Follows the engine's message bus
+    # like any other subscriber, keeps per-target state in memory and
+    # re-renders the exposition text once per probe interval on its own
+    # thread; a scrape only returns the last rendering, so it costs the
+    # probe path and the database nothing.
+    rtt_buckets = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+    def __init__(self, engine, host, port, interval=None):
+        self.engine = engine
+        self.interval = max(1.0, interval or engine.ping_interval)
+        self.messages = engine.bus.subscribe()
+        self.targets = {}  # target -> [up, rtt, attempts, success rate, packet loss]
+        self.histograms = {}  # target -> bucket counts, then count and sum
+        self.probes = 0
+        self.body = b""
+        self.openmetrics_body = b""
+        self.last_render = time.monotonic()
+        self.last_probes = 0
+        self.stopping = False
+        self.thread = None
+        exporter = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                if path == "/health":
+                    self.send_json(exporter.engine.health())
+                    return
+                if path != "/metrics":
+                    self.send_error(404)
+                    return
+                if "application/openmetrics-text" in self.headers.get("Accept", ""):
+                    body = exporter.openmetrics_body
+                    content_type = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+                else:
+                    body = exporter.body
+                    content_type = "text/plain; version=0.0.4; charset=utf-8"
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                # POST /profile switches the profiler on or off
+                if self.path.split("?")[0] != "/profile":
+                    self.send_error(404)
+                    return
+                self.send_json({"profiling": exporter.engine.toggle_profiling()})
+
+            def send_json(self, document):
+                body = json.dumps(document).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.stopping = True
+        self.server.shutdown()
+        self.server.server_close()
+        self.engine.bus.unsubscribe(self.messages)
+
+    def run(self):
+        self.render()
+        while not self.stopping:
+            timeout = self.last_render + self.interval - time.monotonic()
+            if timeout <= 0:
+                self.render()
+                continue
+            try:
+                message_type, content = self.messages.get(timeout=timeout)
+            except Empty:
+                continue
+            if message_type == "update_status":
+                self.observe(*content)
+            elif message_type == "targets":
+                wanted = set(content)
+                for target in [target for target in self.targets if target not in wanted]:
+                    del self.targets[target]
+                    self.histograms.pop(target, None)
+
+    def observe(self, target, status, response_time, checked_at, success_rate, attempts,
+                loss=None, jitter=None, dns_error=None):
+        self.probes += 1
+        self.targets[target] = [1 if status else 0, response_time if status else None,
+                                attempts, success_rate, loss]
+        if status and response_time is not None:
+            histogram = self.histograms.get(target)
+            if histogram is None:
+                histogram = self.histograms[target] = [0] * (len(self.rtt_buckets) + 2)
+            for index, bound in enumerate(self.rtt_buckets):
+                if response_time <= bound:
+                    histogram[index] += 1
+            histogram[-2] += 1
+            histogram[-1] += response_time
+
+    def engine_metrics(self, elapsed):
+        # (name, type, help, value) of the engine itself
+        engine = self.engine
+        writer = engine.result_writer
+        scheduler = engine.scheduler
+        lag, scheduler.max_lag = scheduler.max_lag, 0.0
+        metrics = [
+            ("ping_engine_targets", "gauge", "Targets scheduled for probing", len(scheduler.state)),
+            ("ping_engine_checks", "counter", "Checks completed", self.probes),
+            ("ping_engine_checks_per_second", "gauge", "Checks completed per second since the last rendering",
+             (self.probes - self.last_probes) / elapsed if elapsed > 0 else 0.0),
+            ("ping_engine_attempts", "counter", "Echo attempts launched", scheduler.launched),
+            ("ping_engine_retries", "counter", "Follow-up attempts after a failed one", scheduler.retries),
+            ("ping_engine_schedule_lag_seconds", "gauge",
+             "Worst delay between a target's deadline and its launch since the last rendering", lag),
+            ("ping_writer_queue_depth", "gauge", "Results waiting for the database writer", writer.pending()),
+            ("ping_writer_flush_latency_seconds", "gauge", "Duration of the last database flush",
+             writer.last_flush_latency),
+            ("ping_writer_rows", "counter", "Rows written to the database", writer.rows_written),
+            ("ping_writer_replayed_rows", "counter", "Rows replayed from the local WAL", writer.rows_replayed),
+            ("ping_writer_database_up", "gauge", "Whether the last database write succeeded",
+             0 if writer.db_down_since is not None else 1),
+            ("ping_events", "counter", "State-change events emitted", engine.events.emitted),
+            ("ping_events_undelivered", "gauge", "Events waiting for delivery to a sink",
+             engine.event_dispatcher.pending()),
+        ]
+        if engine.first_probe is not None:
+            metrics.append(("ping_engine_first_probe_seconds", "gauge",
+                            "Time from process start to the first echo request", engine.first_probe))
+        hedges = getattr(engine.icmp, "hedges", None)
+        if hedges is not None:
+            metrics.append(("ping_engine_hedges", "counter", "Hedge echoes sent", hedges))
+        return metrics
+
+    def render(self):
+        start = time.monotonic()
+        elapsed = start - self.last_render
+        lines = []
+        targets = list(self.targets.items())
+        families = (
+            ("ping_target_up", "gauge", "Whether the last check got a reply", 0),
+            ("ping_target_rtt_milliseconds", "gauge", "Round-trip time of the last check", 1),
+            ("ping_target_attempts", "gauge", "Attempts the last check needed (0 = no reply)", 2),
+            ("ping_target_loss_ratio", "gauge", "Share of failed checks over the last 24 hours", 3),
+            ("ping_target_packet_loss_ratio", "gauge", "Share of lost echoes in the last burst", 4),
+        )
+        for name, kind, help_text, index in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for target, values in targets:
+                value = values[index]
+                if value is None:
+                    continue
+                if index == 3:
+                    value = 1 - value / 100
+                elif index == 4:
+                    value = value / 100
+                lines.append(f'{name}{{target="{metric_label(target)}"}} {value}')
+        name = "ping_target_rtt_histogram_milliseconds"
+        lines.append(f"# HELP {name} Round-trip times of answered checks")
+        lines.append(f"# TYPE {name} histogram")
+        for target, histogram in list(self.histograms.items()):
+            label = metric_label(target)
+            for bound, count in zip(self.rtt_buckets, histogram):
+                lines.append(f'{name}_bucket{{target="{label}",le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{target="{label}",le="+Inf"}} {histogram[-2]}')
+            lines.append(f'{name}_count{{target="{label}"}} {histogram[-2]}')
+            lines.append(f'{name}_sum{{target="{label}"}} {histogram[-1]}')
+        if self.engine.instruments.enabled:
+            name = "ping_stage_seconds"
+            lines.append(f"# HELP {name} Latency of each stage of a check")
+            lines.append(f"# TYPE {name} summary")
+            for stage, histogram in self.engine.instruments.histograms.items():
+                for q in (0.5, 0.9, 0.99):
+                    value = histogram.percentile(q * 100)
+                    if value is not None:
+                        lines.append(f'{name}{{stage="{stage}",quantile="{q}"}} {value}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.total}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+        targets_text = "\n".join(lines) + "\n"
+        
+        # Counters are typed by family name in OpenMetrics, by sample name otherwise
+        prometheus, openmetrics = [], []
+        for name, kind, help_text, value in self.engine_metrics(elapsed):
+            sample = f"{name}_total" if kind == "counter" else name
+            prometheus += [f"# HELP {sample} {help_text}", f"# TYPE {sample} {kind}", f"{sample} {value}"]
+            openmetrics += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{sample} {value}"]
+        render_seconds = time.monotonic() - start
+        for block in (prometheus, openmetrics):
+            block += ["# HELP ping_exporter_render_seconds Time spent rendering this page",
+                      "# TYPE ping_exporter_render_seconds gauge",
+                      f"ping_exporter_render_seconds {render_seconds}"]
+        self.body = (targets_text + "\n".join(prometheus) + "\n").encode("utf-8")
+        self.openmetrics_body = (targets_text + "\n".join(openmetrics) + "\n# EOF\n").encode("utf-8")
+        self.last_render = start
+        self.last_probes = self.probes
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 120:
+        return f"{seconds}s"
+    if seconds < 7200:
+        return f"{seconds // 60}m"
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
+
+class EventDetector:
+    # Turns the result stream into state-change events. A target is
+    # declared down after down_after failed checks in a row and up again
+    # after up_after successes (its first success marks it up silently);
+    # with latency_threshold (ms), latency_after checks above it raise a
+    # latency_high event and as many below latency_clear times it clear
+    # it. Down transitions are held for group_window seconds per subnet
+    # (group_prefix bits of the probed address): group_min or more targets
+    # of one subnet going down together become a single outage event,
+    # resolved once all of them are back. A target that recovers within
+    # the window never produces an event.
+    def __init__(self, down_after=2, up_after=2, latency_threshold=None, latency_clear=0.8,
+                 latency_after=3, group_window=5.0, group_prefix=24, group_min=3):
+        self.down_after = max(1, down_after)
+        self.up_after = max(1, up_after)
+        self.latency_threshold = latency_threshold or None
+        self.latency_clear = latency_clear
+        self.latency_after = max(1, latency_after)
+        self.group_window = group_window
+        self.group_prefix = group_prefix
+        self.group_min = max(2, group_min)
+        self.states = {}   # target -> [up (None = unknown), streak, slow, slow streak, since, subnet]
+        self.pending = {}  # subnet -> [first down time, {target: down time}]
+        self.outages = {}  # subnet -> {"started": time, "targets": [...], "down": {target, ...}}
+        self.ready = []    # events waiting for poll()
+        self.emitted = 0
+        self.down = 0      # targets currently down; other threads read this, not states
+
+    def subnet_of(self, address):
+        if not address:
+            return None
+        return str(ipaddress.IPv4Network(f"{address}/{self.group_prefix}", strict=False))
+
+    def emit(self, kind, when, message, **fields):
+        event = dict({"time": when, "kind": kind, "target": None, "subnet": None, "message": message}, **fields)
+        self.ready.append(event)
+
+    def observe(self, target, address, status, response_time, now):
+        state = self.states.get(target)
+        if state is None:
+            state = self.states[target] = [None, 0, False, 0, now, None]
+        subnet = self.subnet_of(address) or state[5]
+        state[5] = subnet
+        
+        # Reachability with hysteresis
+        if status == state[0]:
+            state[1] = 0
+        else:
+            state[1] += 1
+            if state[0] is None and status:
+                state[0], state[1], state[4] = True, 0, now
+            elif state[1] >= (self.up_after if status else self.down_after):
+                if state[0] is False:
+                    self.down -= 1
+                state[0], state[1] = status, 0
+                if status:
+                    self.recovered(target, state, now)
+                else:
+                    self.down += 1
+                    state[2], state[3] = False, 0
+                    self.failed(target, state, now)
+                state[4] = now
+        
+        # Latency threshold crossings, with the clear level below the raise level
+        if self.latency_threshold and status and state[0]:
+            if not state[2]:
+                crossed = response_time > self.latency_threshold
+            else:
+                crossed = response_time < self.latency_threshold * self.latency_clear
+            state[3] = state[3] + 1 if crossed else 0
+            if state[3] >= self.latency_after:
+                state[2], state[3] = not state[2], 0
+                if state[2]:
+                    self.emit("latency_high", now,
+                              f"SLOW {target}: {response_time:.1f}ms (threshold {self.latency_threshold:g}ms)",
+                              target=target, subnet=subnet, rtt=response_time)
+                else:
+                    self.emit("latency_normal", now, f"LATENCY NORMAL {target}: {response_time:.1f}ms",
+                              target=target, subnet=subnet, rtt=response_time)
+
+    def failed(self, target, state, now):
+        subnet = state[5]
+        outage = self.outages.get(subnet)
+        if outage is not None:
+            # Part of an ongoing outage of its subnet
+            outage["down"].add(target)
+            if target not in outage["targets"]:
+                outage["targets"].append(target)
+        elif subnet is not None and self.group_window > 0:
+            self.pending.setdefault(subnet, [now, {}])[1][target] = now
+        else:
+            self.emit("down", now, f"DOWN {target}", target=target, subnet=subnet)
+
+    def recovered(self, target, state, now):
+        subnet = state[5]
+        pending = self.pending.get(subnet)
+        if pending is not None and pending[1].pop(target, None) is not None:
+            # Back before anyone was told it was down
+            if not pending[1]:
+                del self.pending[subnet]
+            return
+        outage = self.outages.get(subnet)
+        if outage is not None and target in outage["down"]:
+            outage["down"].discard(target)
+            if not outage["down"]:
+                del self.outages[subnet]
+                self.emit("outage_resolved", now,
+                          f"OUTAGE RESOLVED {subnet} after {format_duration(now - outage['started'])}",
+                          subnet=subnet, targets=outage["targets"], duration=now - outage["started"])
+            return
+        self.emit("up", now, f"UP {target} after {format_duration(now - state[4])} down",
+                  target=target, subnet=subnet, duration=now - state[4])
+
+    def poll(self, now):
+        # Events that are due: immediate ones, and down transitions whose
+        # grouping window has passed
+        for subnet, (first, targets) in list(self.pending.items()):
+            if now - first < self.group_window:
+                continue
+            del self.pending[subnet]
+            if len(targets) >= self.group_min:
+                names = sorted(targets)
+                self.outages[subnet] = {"started": first, "targets": names, "down": set(names)}
+                shown = ", ".join(names[:5]) + (" ..." if len(names) > 5 else "")
+                self.emit("outage", first, f"OUTAGE {subnet}: {len(names)} targets down ({shown})",
+                          subnet=subnet, targets=names)
+            else:
+                for target, when in targets.items():
+                    self.emit("down", when, f"DOWN {target}", target=target, subnet=subnet)
+        events, self.ready = self.ready, []
+        self.emitted += len(events)
+        return events
+
+    def retain(self, targets):
+        # Forget removed targets; an outage ends quietly once it has no
+        # members left. Not every target has state, so this always looks.
+        wanted = set(targets)
+        for target in set(self.states) - wanted:
+            if self.states.pop(target)[0] is False:
+                self.down -= 1
+        for subnet, pending in list(self.pending.items()):
+            for target in [target for target in pending[1] if target not in wanted]:
+                del pending[1][target]
+            if not pending[1]:
+                del self.pending[subnet]
+        for subnet, outage in list(self.outages.items()):
+            outage["down"] &= wanted
+            if not outage["down"]:
+                del self.outages[subnet]
+
+
+class DatabaseEventSink:
+    name = "database"
+
+    def __init__(self, db_params, agent_id=None):
+        self.db_params = db_params
+        self.agent_id = agent_id
+
+    @staticmethod
+    def create_table(cur):
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ping_events (
+                id BIGSERIAL PRIMARY KEY,
+                timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+                kind VARCHAR(32) NOT NULL,
+                target VARCHAR(255),
+                subnet VARCHAR(64),
+                agent VARCHAR(64),
+                detail JSONB NOT NULL
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_ping_events_timestamp ON ping_events(timestamp)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_ping_events_target ON ping_events(target, timestamp)")
+
+    def deliver(self, events):
+        conn = psycopg2.connect(**self.db_params)
+        try:
+            with conn.cursor() as cur:
+                cur.executemany("""
+                    INSERT INTO ping_events (timestamp, kind, target, subnet, agent, detail)
+                    VALUES (to_timestamp(%s), %s, %s, %s, %s, %s)
+                """, [(event["time"], event["kind"], event["target"], event["subnet"], self.agent_id,
+                       json.dumps(event)) for event in events])
+            conn.commit()
+        finally:
+            conn.close()
+
+
+class WebhookEventSink:
+    # POSTs {"events": [...]} as JSON; any 2xx answer counts as delivered
+    name = "webhook"
+
+    def __init__(self, url, timeout=5.0):
+        self.url = url
+        self.timeout = timeout
+
+    def deliver(self, events):
+        request = urllib.request.Request(
+            self.url, data=json.dumps({"events": events}).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class EventDispatcher:
+    # Delivers events to the sinks on its own thread. Every sink keeps
+    # its own backlog (at most max_pending events, oldest dropped first)
+    # and retries it every retry_interval seconds while it fails, so one
+    # unreachable sink never holds up another or the probe loop.
+    def __init__(self, message_queue, sinks, max_pending=10000, retry_interval=5.0):
+        self.message_queue = message_queue
+        self.sinks = sinks
+        self.max_pending = max_pending
+        self.retry_interval = retry_interval
+        self.queue = Queue()
+        self.backlogs = {sink: [] for sink in sinks}
+        self.failing_since = {}  # sink -> time of the first failure in a row
+        self.retry_at = {}
+        self.thread = None
+        self.stopping = False
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        self.stopping = True
+        self.queue.put(None)
+        if self.thread:
+            self.thread.join(timeout=timeout)
+
+    def submit(self, events):
+        if self.sinks and events:
+            self.queue.put(events)
+
+    def pending(self):
+        return sum(len(backlog) for backlog in self.backlogs.values())
+
+    def run(self):
+        while True:
+            try:
+                events = self.queue.get(timeout=1.0)
+            except Empty:
+                events = []
+            while events is not None:
+                for backlog in self.backlogs.values():
+                    backlog.extend(events)
+                try:
+                    events = self.queue.get_nowait()
+                except Empty:
+                    break
+            self.deliver()
+            if self.stopping or events is None:
+                break
+
+    def deliver(self):
+        now = time.time()
+        for sink, backlog in self.backlogs.items():
+            if not backlog or (now < self.retry_at.get(sink, 0) and not self.stopping):
+                continue
+            if len(backlog) > self.max_pending:
+                del backlog[:len(backlog) - self.max_pending]
+            try:
+                sink.deliver(list(backlog))
+            except Exception as e:
+                if sink not in self.failing_since:
+                    self.failing_since[sink] = now
+                    self.message_queue.put(("log", ("warning", f"Event delivery to {sink.name} failed, retrying: {str(e)}")))
+                self.retry_at[sink] = now + self.retry_interval
+                continue
+            backlog.clear()
+            if self.failing_since.pop(sink, None) is not None:
+                self.message_queue.put(("log", f"Event delivery to {sink.name} resumed"))
+
+
+def run_event_receiver(host, port):
+    # Minimal webhook receiver for testing alerting: prints every event
+    # POSTed to it
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                events = json.loads(self.rfile.read(length)).get("events", [])
+            except ValueError:
+                self.send_error(400)
+                return
+            for event in events:
+                timestamp = datetime.fromtimestamp(event["time"]).strftime("%Y-%m-%d %H:%M:%S")
+                print(f"[{timestamp}] {event['message']}", flush=True)
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    print(f"Receiving events on http://{host}:{port}/", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# Version of the schema create_schema() builds; bump it with every change
+# there so existing databases are upgraded on the next start
+SCHEMA_VERSION = 7
+SCHEMA_LOCK_KEY = 0x70696E67  # pg_advisory_lock key for schema upgrades
+
+
+class MonitorEngine:
+    # Probing and storage core, independent of any UI. Everything it has to
+    # say (results, target list changes, log lines) goes out on `bus`; the
+    # Tk dashboard and the headless service are both just subscribers.
+    def __init__(self, db_params, ping_interval=3, ping_attempts=2, ping_timeout=0.5,
+                 ttl_days=30, probe_transport="auto", wal_dir="ping_results.wal", target_refresh=60,
+                 workers=1, agent_settings=None, dns_ttl=300, dns_negative_ttl=30,
+                 min_interval=1, max_interval=300, max_pps=10000, retry_delay=0.5, hedge_after=None,
+                 burst=1, burst_spacing=0.02, history_hours=4, history_budget_mb=512,
+                 history_path="ping_history.snapshot", replay_rate=20000, instrument=True,
+                 trace_sample=0.001, profile_path="ping_profile.pstats", inventory=None,
+                 state_path="ping_state.json", events=None, activity_log=None):
+        self.db_params = db_params
+        self.targets = []
+        self.started_at = datetime.now(timezone.utc)
+        self.first_probe = None  # Seconds from process start to the first echo request
+        self.ping_thread = None
+        self.stop_ping = False
+        self.bus = MessageBus()
+        
+        # Activity log: the level shown on the dashboard and console, the
+        # lines the dashboard keeps, and an optional JSON lines file
+        activity_log = dict(activity_log or {})
+        self.log_level = activity_log.get("level", "info")
+        self.log_lines = activity_log.get("lines", 5000)
+        self.log_file = None
+        if activity_log.get("path"):
+            self.log_file = LogFileSink(self.bus, activity_log["path"], activity_log.get("file_level", "info"),
+                                        int(activity_log.get("max_mb", 10) * 1024 * 1024),
+                                        activity_log.get("backups", 5))
+        for level in (self.log_level, activity_log.get("file_level", "info")):
+            if level not in LOG_LEVELS:
+                raise ValueError(f"Unknown log level '{level}' (use {', '.join(LOG_LEVELS)})")
+        self.log_results = False  # Per-check log lines, only produced for a debug level
+        self.set_log_level(self.log_level)
+        
+        self.ttl_days = ttl_days
+        self.ping_interval = ping_interval  # Default per-target probe interval in seconds
+        self.ping_attempts = ping_attempts  # Number of ping attempts before declaring failure
+        self.ping_timeout = ping_timeout    # Timeout in seconds for each ping
+        self.retry_delay = retry_delay      # Seconds between attempts of one check
+        self.hedge_after = hedge_after      # Seconds before a second echo is sent (None = off)
+        self.burst = burst                  # Echoes per probe; above 1 adds loss/jitter/RTT spread
+        self.burst_spacing = burst_spacing  # Seconds between the echoes of a burst
+        self.probe_transport = probe_transport  # raw, dgram, loopback or auto (raw, then dgram)
+        self.target_refresh = target_refresh  # Seconds between target list reloads when headless
+        self.workers = workers  # Probe processes; targets are sharded across them when > 1
+        self.dns_ttl = dns_ttl  # Seconds hostname answers are cached
+        self.dns_negative_ttl = dns_negative_ttl  # Seconds failed lookups are cached
+        
+        # Single event loop ICMP engine (or a ShardedProber over several
+        # processes), started with monitoring
+        self.icmp = None
+        
+        # Per-stage latency histograms, sampled traces and the profiler
+        self.instruments = EngineInstruments(instrument, trace_sample, profile_path=profile_path)
+        
+        # Per-target probe deadlines; results come back on probe_results
+        self.scheduler = ProbeScheduler(ping_interval, min_interval, max_interval, max_pps, burst=burst,
+                                        instruments=self.instruments)
+        self.target_intervals = {}  # ping_targets.probe_interval overrides
+        self.target_policies = {}   # ping_targets retry_attempts/retry_delay/hedge_after overrides
+        self.probe_results = Queue()
+        
+        # Agent mode: probe only the shards leased to this agent
+        self.agent = None
+        if agent_settings:
+            self.agent = AgentCoordinator(self.db_params, self.bus, **agent_settings)
+        
+        # Write-behind result pipeline (batched COPY over a pooled connection)
+        self.result_writer = ResultWriter(self.db_params, self.bus, wal_dir=wal_dir, replay_rate=replay_rate,
+                                          agent_id=self.agent.agent_id if self.agent else None,
+                                          instruments=self.instruments)
+        
+        # State-change events (down/up, outages, latency) and their delivery
+        # to the events table and the alert webhook
+        events = dict(events or {})
+        sinks = []
+        if events.pop("persist", True):
+            sinks.append(DatabaseEventSink(self.db_params, self.agent.agent_id if self.agent else None))
+        webhook = events.pop("webhook", None)
+        webhook_timeout = events.pop("webhook_timeout", 5.0)
+        if webhook:
+            sinks.append(WebhookEventSink(webhook, webhook_timeout))
+        self.events = EventDetector(**events)
+        self.event_dispatcher = EventDispatcher(self.bus, sinks)
+        
+        # Rolling 24h success rates, kept in memory and updated per result
+        self.success_rates = SuccessRateAggregator()
+        
+        # Raw samples of the last few hours, snapshotted to history_path
+        self.history = SampleHistory(math.ceil(history_hours * 3600 / ping_interval),
+                                     history_budget_mb * 1024 * 1024, window=history_hours * 3600,
+                                     stretch=math.ceil(ping_interval / min(min_interval, ping_interval)))
+        self.history_path = history_path
+        self.history_snapshot_interval = 300
+        
+        # Targets and last-known status, cached locally for a fast start
+        self.state_path = state_path
+        self.last_status = {}  # target -> last update_status content
+        self.bootstrap_thread = None
+        self.bootstrap_stop = threading.Event()
+        self.bootstrap_retry = 2.0        # seconds before the first retry
+        self.bootstrap_retry_max = 60.0   # backoff cap
+        
+        # Daily partition maintenance and retention
+        self.retention = PartitionRetentionJob(self.db_params, self.bus, self.ttl_days)
+        
+        # 1-minute/1-hour/1-day aggregates for long-range history
+        self.rollups = RollupJob(self.db_params, self.bus)
+        
+        # Copies results of an older schema into the compact table
+        self.backfill = ResultBackfillJob(self.db_params, self.bus, self.ttl_days)
+        
+        # Target list synced from an inventory file, if configured
+        self.inventory = None
+        if inventory and inventory.get("path"):
+            self.inventory = InventorySync(self, **inventory)
+
+    @classmethod
+    def from_config(cls, config):
+        monitor = config["monitor"]
+        agent = config["agent"]
+        agent_settings = None
+        if agent.getboolean("enabled"):
+            agent_settings = {
+                "agent_id": agent.get("id"),
+                "vantage": agent.get("vantage"),
+                "shards": agent.getint("shards"),
+                "lease_ttl": agent.getfloat("lease_ttl"),
+                "heartbeat": agent.getfloat("heartbeat")
+            }
+        return cls(
+            dict(config["database"]),
+            ping_interval=monitor.getfloat("interval"),
+            ping_attempts=monitor.getint("attempts"),
+            ping_timeout=monitor.getfloat("timeout"),
+            ttl_days=monitor.getint("ttl_days"),
+            probe_transport=monitor.get("transport"),
+            wal_dir=monitor.get("wal_dir"),
+            replay_rate=monitor.getfloat("replay_rate"),
+            target_refresh=monitor.getfloat("target_refresh"),
+            workers=monitor.getint("workers"),
+            agent_settings=agent_settings,
+            dns_ttl=monitor.getfloat("dns_ttl"),
+            dns_negative_ttl=monitor.getfloat("dns_negative_ttl"),
+            min_interval=monitor.getfloat("min_interval"),
+            max_interval=monitor.getfloat("max_interval"),
+            max_pps=monitor.getfloat("max_pps"),
+            retry_delay=monitor.getfloat("retry_delay"),
+            hedge_after=monitor.getfloat("hedge_after"),
+            burst=monitor.getint("burst"),
+            burst_spacing=monitor.getfloat("burst_spacing"),
+            history_hours=monitor.getfloat("history_hours"),
+            history_budget_mb=monitor.getfloat("history_budget_mb"),
+            history_path=monitor.get("history_path"),
+            instrument=monitor.getboolean("instrument"),
+            trace_sample=monitor.getfloat("trace_sample"),
+            profile_path=monitor.get("profile_path"),
+            inventory={
+                "path": config["inventory"].get("path"),
+                "interval": config["inventory"].getfloat("interval"),
+                "remove": config["inventory"].getboolean("remove")
+            },
+            state_path=monitor.get("state_path"),
+            events={
+                "down_after": config["events"].getint("down_after"),
+                "up_after": config["events"].getint("up_after"),
+                "latency_threshold": config["events"].getfloat("latency_threshold"),
+                "latency_clear": config["events"].getfloat("latency_clear"),
+                "latency_after": config["events"].getint("latency_after"),
+                "group_window": config["events"].getfloat("group_window"),
+                "group_prefix": config["events"].getint("group_prefix"),
+                "group_min": config["events"].getint("group_min"),
+                "persist": config["events"].getboolean("persist"),
+                "webhook": config["events"].get("webhook"),
+                "webhook_timeout": config["events"].getfloat("webhook_timeout")
+            },
+            activity_log={
+                "level": config["log"].get("level"),
+                "lines": config["log"].getint("lines"),
+                "path": config["log"].get("path"),
+                "file_level": config["log"].get("file_level"),
+                "max_mb": config["log"].getfloat("max_mb"),
+                "backups": config["log"].getint("backups")
+            }
+        )
+
+    def log(self, message, level="info"):
+        self.bus.put(("log", message if level == "info" else (level, message)))
+
+    def set_log_level(self, level):
+        # Lowest level shown on the dashboard or console; per-check lines
+        # are only formatted while it, or the log file's, is debug
+        self.log_level = level
+        file_debug = self.log_file is not None and self.log_file.threshold <= LOG_LEVELS["debug"]
+        self.log_results = level == "debug" or file_debug
+
+    def get_db_connection(self):
+        return psycopg2.connect(**self.db_params)
+
+    def start_up(self):
+        # First, local stage of startup: targets, last-known status and
+        # recent samples from the previous run's snapshots. No database
+        # access, so probing and the dashboard can start right away.
+        if self.log_file:
+            self.log_file.start()
+        self.load_state()
+        self.load_history()
+
+    def bootstrap(self):
+        # Database stage of startup: schema, background jobs, target list
+        # reconciliation and success rate history. Steps that fail are
+        # retried with exponential backoff until they all succeed (or the
+        # engine closes); the jobs start once the schema is in place and
+        # retry on their own schedule from then on. A ("bootstrap", error)
+        # message follows the first attempt and every change of error.
+        delay = self.bootstrap_retry
+        reported = False
+        jobs_started = targets_loaded = rates_loaded = False
+        while True:
+            error = None
+            try:
+                if not self.result_writer.schema_ready.is_set():
+                    self.initialize_database()
+                if not jobs_started:
+                    self.retention.start()
+                    self.rollups.start()
+                    self.backfill.start()
+                    if self.agent:
+                        self.agent.start()
+                    if self.inventory:
+                        self.inventory.start()
+                    jobs_started = True
+                targets_loaded = targets_loaded or self.load_targets_from_db()
+                if not targets_loaded:
+                    raise RuntimeError("cannot load the target list")
+                rates_loaded = rates_loaded or self.warm_start_success_rates()
+            except Exception as e:
+                error = str(e)
+            if reported is False or error != reported:
+                self.bus.put(("bootstrap", error))
+                reported = error
+            if error is None and rates_loaded:
+                return None
+            if error is not None:
+                self.log(f"Database startup incomplete ({error}), retrying in {delay:g}s", "warning")
+            if self.bootstrap_stop.wait(delay):
+                return error
+            delay = min(delay * 2, self.bootstrap_retry_max)
+
+    def bootstrap_async(self):
+        self.bootstrap_thread = threading.Thread(target=self.bootstrap, daemon=True)
+        self.bootstrap_thread.start()
+
+    def load_state(self):
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            self.log(f"Cannot read {self.state_path}: {str(e)}", "error")
+            return False
+        if state.get("version") != 1:
+            return False
+        targets, intervals, policies = [], {}, {}
+        for target, interval, *policy in state["targets"]:
+            targets.append(target)
+            if interval:
+                intervals[target] = interval
+            if any(value is not None for value in policy):
+                policies[target] = tuple(policy)
+        self.target_intervals = intervals
+        self.target_policies = policies
+        self.targets = targets
+        known = set(targets)
+        self.last_status = {target: tuple(content) for target, content in state["status"].items()
+                            if target in known}
+        self.bus.put(("targets", list(targets)))
+        age = max(0, time.time() - state["saved"])
+        self.log(f"Loaded {len(targets)} targets from {self.state_path} (saved {age / 60:.0f} minutes ago)")
+        return True
+
+    def save_state(self):
+        policies = self.target_policies
+        state = {
+            "version": 1,
+            "saved": time.time(),
+            "targets": [[target, self.target_intervals.get(target)] + list(policies.get(target, (None,) * 3))
+                        for target in self.targets],
+            "status": {target: list(content) for target, content in list(self.last_status.items())}
+        }
+        try:
+            temporary = self.state_path + ".tmp"
+            with open(temporary, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(temporary, self.state_path)
+        except OSError as e:
+            self.log(f"Error saving target state: {str(e)}", "error")
+
+    def save_snapshots(self):
+        self.save_history()
+        self.save_state()
+
+    def load_history(self):
+        if self.history.load(self.history_path):
+            self.log(f"Loaded recent samples of {len(self.history.slots)} targets from {self.history_path}")
+
+    def save_history(self):
+        try:
+            self.history.snapshot(self.history_path)
+        except OSError as e:
+            self.log(f"Error saving sample history: {str(e)}", "error")
+
+    def initialize_database(self):
+        # Creates or upgrades the schema. ping_schema records the version
+        # last applied, so on a current database this is a version check
+        # only; an advisory lock keeps engines sharing the database from
+        # upgrading it at the same time.
+        conn = None
+        try:
+            conn = self.get_db_connection()
+            conn.autocommit = True
+            
+            with conn.cursor() as cur:
+                if self.schema_version(cur) >= SCHEMA_VERSION:
+                    self.log(f"Database schema is current (version {SCHEMA_VERSION})")
+                    self.result_writer.schema_ready.set()
+                    return
+                cur.execute("SELECT pg_advisory_lock(%s)", (SCHEMA_LOCK_KEY,))
+                try:
+                    if self.schema_version(cur) < SCHEMA_VERSION:
+                        self.create_schema(conn, cur)
+                        cur.execute("""
+                            CREATE TABLE IF NOT EXISTS ping_schema (
+                                version INTEGER NOT NULL,
+                                applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+                            )
+                        """)
+                        cur.execute("INSERT INTO ping_schema (version) VALUES (%s)", (SCHEMA_VERSION,))
+                finally:
+                    cur.execute("SELECT pg_advisory_unlock(%s)", (SCHEMA_LOCK_KEY,))
+                
+                self.log(f"Database initialized successfully (schema version {SCHEMA_VERSION})")
+                self.result_writer.schema_ready.set()
+                
+        except Exception as e:
+            self.log(f"Database initialization error: {str(e)}", "error")
+            raise
+        finally:
+            if conn:
+                conn.close()
+
+    @staticmethod
+    def schema_version(cur):
+        cur.execute("SELECT to_regclass('ping_schema') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            return 0
+        cur.execute("SELECT coalesce(max(version), 0) FROM ping_schema")
+        return cur.fetchone()[0]
+
+    def create_schema(self, conn, cur):
+        # Create targets table if not exists
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ping_targets (
+                id SERIAL PRIMARY KEY,
+                target VARCHAR(255) NOT NULL UNIQUE,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Optional per-target probe interval (seconds) and retry policy
+        cur.execute("""
+            ALTER TABLE ping_targets
+                ADD COLUMN IF NOT EXISTS probe_interval REAL,
+                ADD COLUMN IF NOT EXISTS retry_attempts INTEGER,
+                ADD COLUMN IF NOT EXISTS retry_delay REAL,
+                ADD COLUMN IF NOT EXISTS hedge_after REAL
+        """)
+        
+        # State-change events (schema version 2)
+        DatabaseEventSink.create_table(cur)
+        
+        # Results are range-partitioned by day, in the compact layout of
+        # schema version 4. A table from an older version (partitioned or
+        # not) is moved aside and copied over by the backfill job.
+        if ResultBackfillJob.retire(conn):
+            self.log("Moved the old results table aside; it is migrated in the background")
+        PartitionRetentionJob.create_parent(cur)
+        PartitionRetentionJob.add_target_key(cur)
+        # Replaced by the unique index (schema version 5)
+        cur.execute("DROP INDEX IF EXISTS idx_ping_results_target_id_time")
+        
+        # Catch-all for rows outside every daily range
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ping_results_default
+            PARTITION OF ping_results DEFAULT
+        """)
+        
+        # Create today's and upcoming partitions, drop expired ones
+        self.retention.maintain(conn)
+        
+        # Create rollup tables
+        RollupJob.create_tables(cur)
+        
+        # Agent registry and shard leases
+        AgentCoordinator.create_tables(cur)
+
+    def set_ttl(self, ttl_days):
+        self.ttl_days = ttl_days
+        self.retention.configure(ttl_days)
+        self.backfill.ttl_days = ttl_days
+
+    def load_targets_from_db(self):
+        conn = None
+        try:
+            conn = self.get_db_connection()
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT target, probe_interval, retry_attempts, retry_delay, hedge_after
+                    FROM ping_targets ORDER BY target
+                """)
+                rows = cur.fetchall()
+            targets = [row[0] for row in rows]
+            intervals = {row[0]: row[1] for row in rows if row[1]}
+            policies = {row[0]: tuple(row[2:]) for row in rows if any(value is not None for value in row[2:])}
+            if intervals != self.target_intervals:
+                self.target_intervals = intervals
+            if policies != self.target_policies:
+                self.target_policies = policies
+            if targets != self.targets:
+                for target in set(self.targets) - set(targets):
+                    self.success_rates.remove(target)
+                    self.history.remove(target)
+                    self.last_status.pop(target, None)
+                self.targets = targets
+                self.bus.put(("targets", list(targets)))
+                self.log(f"Loaded {len(self.targets)} targets from database")
+            return True
+        except Exception as e:
+            self.log(f"Error loading targets: {str(e)}", "error")
+            return False
+        finally:
+            if conn:
+                conn.close()
+
+    def warm_start_success_rates(self):
+        conn = None
+        try:
+            conn = self.get_db_connection()
+            rows = self.success_rates.warm_start(conn, until=self.started_at)
+            self.log(f"Loaded success rate history ({rows} buckets)")
+            return True
+        except Exception as e:
+            self.log(f"Error loading success rate history: {str(e)}", "error")
+            return False
+        finally:
+            if conn:
+                conn.close()
+
+    def add_target(self, target):
+        try:
+            target = normalize_target(target)
+        except ValueError as e:
+            self.log(f"Invalid target: {str(e)}", "warning")
+            return False
+        if target in self.targets:
+            self.log(f"Target already exists: {target}")
+            return False
+            
+        conn = None
+        try:
+            conn = self.get_db_connection()
+            with conn.cursor() as cur:
+                cur.execute(
+                    "INSERT INTO ping_targets (target) VALUES (%s)",
+                    (target,)
+                )
+                conn.commit()
+            
+            self.apply_target_changes(added=[target])
+            self.log(f"Added target: {target}")
+            return True
+                
+        except psycopg2.IntegrityError:
+            self.log(f"Target already exists in database: {target}")
+        except Exception as e:
+            self.log(f"Error adding target: {str(e)}", "error")
+        finally:
+            if conn:
+                conn.close()
+        return False
+
+    def remove_targets(self, selection):
+        conn = None
+        try:
+            conn = self.get_db_connection()
+            with conn.cursor() as cur:
+                # Remove from targets table; results go with it (ON DELETE CASCADE)
+                cur.execute(
+                    "DELETE FROM ping_targets WHERE target = ANY(%s)",
+                    (selection,)
+                )
+                
+                # Remove rollups
+                self.delete_target_data(cur, selection)
+                
+                conn.commit()
+            
+            self.apply_target_changes(removed=selection)
+            
+            if len(selection) == 1:
+                self.log(f"Removed target: {selection[0]}")
+            else:
+                self.log(f"Removed {len(selection)} targets")
+            return True
+                
+        except Exception as e:
+            self.log(f"Error removing target: {str(e)}", "error")
+        finally:
+            if conn:
+                conn.close()
+        return False
+
+    @staticmethod
+    def delete_target_data(cur, targets):
+        # Rollups of removed targets; their results are deleted with the
+        # ping_targets rows, and the writer leaves out results still queued
+        # for them (the foreign key rejects those)
+        for rollup in ROLLUPS:
+            cur.execute(
+                f"DELETE FROM {rollup.table} WHERE target = ANY(%s)",
+                (list(targets),)
+            )
+
+    def apply_target_changes(self, added=(), removed=(), settings=()):
+        # Apply a target list difference to the running engine: one
+        # message for subscribers, and the probe loop resyncs on its own.
+        # settings: (target, *TARGET_SETTINGS) rows of added or changed targets.
+        removed = set(removed)
+        targets = self.targets
+        if removed:
+            targets = [target for target in targets if target not in removed]
+            for target in removed:
+                self.success_rates.remove(target)
+                self.history.remove(target)
+                self.last_status.pop(target, None)
+            self.result_writer.forget(removed)
+        if added:
+            known = set(targets)
+            targets = targets + [target for target in added if target not in known]
+        if settings or removed:
+            # New dicts, not updated in place: the probe loop compares them
+            # to the ones it last synced
+            intervals = {target: interval for target, interval in self.target_intervals.items()
+                         if target not in removed}
+            policies = {target: policy for target, policy in self.target_policies.items()
+                        if target not in removed}
+            for target, interval, *policy in settings:
+                intervals.pop(target, None)
+                policies.pop(target, None)
+                if interval:
+                    intervals[target] = interval
+                if any(value is not None for value in policy):
+                    policies[target] = tuple(policy)
+            self.target_intervals = intervals
+            self.target_policies = policies
+        if targets is not self.targets:
+            self.targets = targets
+            self.bus.put(("targets", list(targets)))
+
+    def import_text(self, text, fmt, source, replace=False, conn=None):
+        # Parse a target list (see parse_targets) and import it
+        try:
+            entries, columns, errors = parse_targets(text, fmt)
+        except ValueError as e:
+            self.log(f"Cannot read targets from {source}: {str(e)}", "error")
+            return None
+        if errors:
+            self.log(f"Skipped {len(errors)} invalid entries in {source}: {'; '.join(errors[:5])}"
+                     f"{' ...' if len(errors) > 5 else ''}", "warning")
+        if replace and not entries:
+            self.log(f"No valid targets in {source}; not syncing to an empty list")
+            return None
+        return self.import_targets(entries, columns, replace, source, conn)
+
+    def import_targets(self, entries, columns=(), replace=False, source="import", conn=None):
+        # Upsert targets in one transaction: COPY into a temporary table,
+        # insert the new ones, update the settings columns the source
+        # provides where they differ and, with replace, delete targets the
+        # source no longer lists (with their results). Only the difference
+        # is applied to the engine. Returns (added, updated, removed), or
+        # None on error.
+        own = conn is None
+        try:
+            if own:
+                conn = self.get_db_connection()
+            buffer = io.StringIO("".join(
+                "\t".join(copy_escape(value) for value in (target,) + settings) + "\n"
+                for target, settings in entries.items()))
+            returning = ", ".join(("t.target",) + tuple(f"t.{name}" for name in TARGET_SETTINGS))
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TEMP TABLE ping_targets_import (
+                        target VARCHAR(255) PRIMARY KEY,
+                        probe_interval REAL,
+                        retry_attempts INTEGER,
+                        retry_delay REAL,
+                        hedge_after REAL
+                    ) ON COMMIT DROP
+                """)
+                cur.copy_expert("COPY ping_targets_import FROM STDIN", buffer)
+                cur.execute(f"""
+                    INSERT INTO ping_targets AS t (target{''.join(', ' + name for name in columns)})
+                    SELECT target{''.join(', ' + name for name in columns)} FROM ping_targets_import
+                    ON CONFLICT (target) DO NOTHING
+                    RETURNING {returning}
+                """)
+                added = cur.fetchall()
+                updated = []
+                if columns:
+                    cur.execute(f"""
+                        UPDATE ping_targets t
+                        SET {', '.join(f'{name} = i.{name}' for name in columns)}
+                        FROM ping_targets_import i
+                        WHERE t.target = i.target
+                          AND ({', '.join(f't.{name}' for name in columns)})
+                              IS DISTINCT FROM ({', '.join(f'i.{name}' for name in columns)})
+                        RETURNING {returning}
+                    """)
+                    updated = cur.fetchall()
+                removed = []
+                if replace:
+                    cur.execute("""
+                        DELETE FROM ping_targets t
+                        WHERE NOT EXISTS (SELECT 1 FROM ping_targets_import i WHERE i.target = t.target)
+                        RETURNING t.target
+                    """)
+                    removed = [row[0] for row in cur.fetchall()]
+                    if removed:
+                        self.delete_target_data(cur, removed)
+            conn.commit()
+        except Exception as e:
+            if conn is not None and not conn.closed:
+                conn.rollback()
+            self.log(f"Error importing targets from {source}: {str(e)}", "error")
+            return None
+        finally:
+            if own and conn is not None:
+                conn.close()
+        
+        self.apply_target_changes([row[0] for row in added], removed, added + updated)
+        unchanged = len(entries) - len(added) - len(updated)
+        self.log(f"Imported targets from {source}: {len(added)} added, {len(updated)} updated, "
+                 f"{len(removed)} removed, {unchanged} unchanged")
+        return len(added), len(updated), len(removed)
+
+    def import_file(self, path, replace=False):
+        try:
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            self.log(f"Cannot read {path}: {str(e)}", "error")
+            return None
+        return self.import_text(text, target_format(path), path, replace)
+
+    def export_targets(self, path):
+        # Write all targets with their settings, in the format of the file
+        # extension (csv, json, anything else plain text)
+        conn = None
+        try:
+            conn = self.get_db_connection()
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT target, {', '.join(TARGET_SETTINGS)} FROM ping_targets ORDER BY target")
+                rows = cur.fetchall()
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                f.write(format_targets(rows, target_format(path)))
+            self.log(f"Exported {len(rows)} targets to {path}")
+            return len(rows)
+        except Exception as e:
+            self.log(f"Error exporting targets: {str(e)}", "error")
+        finally:
+            if conn:
+                conn.close()
+        return None
+
+    def is_monitoring(self):
+        return self.ping_thread is not None and self.ping_thread.is_alive()
+
+    def start_monitoring(self):
+        # Raises OSError when no ICMP socket can be opened
+        if self.is_monitoring():
+            return
+        
+        if self.icmp is None:
+            try:
+                if self.workers > 1:
+                    self.icmp = ShardedProber(self.workers, self.probe_transport, dns_ttl=self.dns_ttl,
+                                              dns_negative_ttl=self.dns_negative_ttl,
+                                              burst=self.burst, burst_spacing=self.burst_spacing,
+                                              message_queue=self.bus)
+                else:
+                    self.icmp = IcmpEngine(self.probe_transport, dns_ttl=self.dns_ttl,
+                                           dns_negative_ttl=self.dns_negative_ttl,
+                                           burst=self.burst, burst_spacing=self.burst_spacing,
+                                           message_queue=self.bus)
+                self.icmp.start()
+            except OSError as e:
+                if isinstance(self.icmp, ShardedProber):
+                    self.icmp.close()
+                self.icmp = None
+                self.log(f"Cannot open ICMP socket: {str(e)}", "error")
+                raise
+            self.log(f"ICMP engine started ({self.icmp.describe()})")
+            
+        self.result_writer.start()
+        self.event_dispatcher.start()
+        self.stop_ping = False
+        self.ping_thread = threading.Thread(target=self.ping_all_targets, daemon=True)
+        self.ping_thread.start()
+        self.log("Monitoring started (concurrent mode with retries)")
+
+    def stop_monitoring(self):
+        self.stop_ping = True
+        if self.is_monitoring():
+            self.ping_thread.join(timeout=1)
+        self.log("Monitoring stopped")
+
+    def close(self):
+        self.stop_ping = True
+        self.bootstrap_stop.set()
+        if self.is_monitoring():
+            self.ping_thread.join(timeout=1)
+        if self.icmp:
+            self.icmp.close()
+        if self.agent:
+            self.agent.stop()
+            if self.agent.thread:
+                self.agent.thread.join(timeout=5)
+        self.result_writer.stop()
+        self.event_dispatcher.stop()
+        self.retention.stop()
+        self.rollups.stop()
+        self.backfill.stop()
+        if self.inventory:
+            self.inventory.stop()
+        if self.history.slots:
+            self.save_history()
+        if self.targets:
+            self.save_state()
+        if self.log_file:
+            self.log_file.stop()
+
+    def ping_all_targets(self):
+        synced = (None, None, None, None)
+        next_sync = 0.0
+        next_snapshot = time.monotonic() + self.history_snapshot_interval
+        instruments = self.instruments
+        while not self.stop_ping:
+            instruments.profile_point("probe loop")
+            now = time.monotonic()
+            
+            # Follow target list changes (and in agent mode, lease changes)
+            if now >= next_sync:
+                shards = self.agent.active_shards() if self.agent else None
+                if synced != (self.targets, self.target_intervals, self.target_policies, shards):
+                    synced = (self.targets, self.target_intervals, self.target_policies, shards)
+                    targets = self.agent.select_targets(self.targets) if self.agent else list(self.targets)
+                    self.scheduler.sync(targets, self.target_intervals, self.target_policies)
+                    self.icmp.sync(targets)
+                    self.history.retain(targets)
+                    self.events.retain(targets)
+                next_sync = now + 1.0
+            
+            if now >= next_snapshot:
+                threading.Thread(target=self.save_snapshots, daemon=True).start()
+                next_snapshot = now + self.history_snapshot_interval
+            
+            # Launch whatever is due, first attempts and retries alike;
+            # results arrive as each echo ends
+            policy = RetryPolicy(self.ping_attempts, self.retry_delay, self.hedge_after)
+            for hedge_after, due in self.scheduler.due(policy).items():
+                self.icmp.submit(due, self.ping_timeout, hedge_after, self.probe_results.put)
+            if self.first_probe is None and self.scheduler.launched:
+                self.first_probe = time.monotonic() - PROCESS_STARTED
+                self.log(f"First probe sent {self.first_probe:.3f}s after start")
+            
+            # State changes detected so far go to subscribers and the sinks
+            events = self.events.poll(time.time())
+            if events:
+                for event in events:
+                    self.bus.put(("event", event))
+                self.event_dispatcher.submit(events)
+            
+            wait = self.scheduler.next_wakeup()
+            wait = 0.5 if wait is None else min(max(wait, 0.01), 0.5)
+            try:
+                result = self.probe_results.get(timeout=wait)
+            except Empty:
+                continue
+            results = [result]
+            while len(results) < 10000:
+                try:
+                    results.append(self.probe_results.get_nowait())
+                except Empty:
+                    break
+            received = time.time()
+            for result in results:
+                instruments.attempt(result, received)
+                result = self.scheduler.complete(result, policy)
+                if result is not None:
+                    self.handle_result(result)
+
+    def handle_result(self, result):
+        started = time.perf_counter()
+        target = result["target"]
+        status = result["status"]
+        response_time = result["response_time"]
+        attempts = result["attempts"]
+        duration = result["duration"]
+        dns_error = result.get("dns_error")
+        burst = result.get("burst")
+        loss = 100.0 * burst["packets_lost"] / burst["packets_sent"] if burst else None
+        jitter = burst["jitter"] if burst else None
+        
+        # A name that does not resolve says nothing about reachability:
+        # report it, but keep it out of the results and success rate
+        if dns_error:
+            content = (
+                target,
+                False,
+                None,
+                time.time(),
+                self.get_success_rate(target),
+                0,
+                None,
+                None,
+                dns_error
+            )
+            self.last_status[target] = content
+            self.bus.put(("update_status", content))
+            if self.log_results:
+                self.bus.put(("log", ("debug", f"Ping {target}: DNS failure ({dns_error})")))
+            return
+        
+        # Save to database
+        key = self.save_ping_result(target, status, response_time, attempts, burst)
+        checked = time.time()
+        self.success_rates.record(target, status, response_time, checked)
+        self.history.record(target, checked, status, response_time)
+        self.events.observe(target, result.get("address"), status, response_time, checked)
+        
+        # Get success rate
+        success_rate = self.get_success_rate(target)
+        
+        # Publish the result (formatted by subscribers on display)
+        response_str = f"{response_time:.2f}" if status else "Timeout"
+        
+        instruments = self.instruments
+        if instruments.sampled():
+            # Traced before publishing so the dashboard can find it
+            instruments.queued(key, instruments.trace(result, checked, time.perf_counter() - started))
+        content = (
+            target,
+            status,
+            response_time,
+            checked,
+            success_rate,
+            attempts,
+            loss,
+            jitter,
+            None
+        )
+        self.last_status[target] = content
+        self.bus.put(("update_status", content))
+        
+        # Log the result at debug level; state changes are logged as events
+        if self.log_results:
+            burst_str = ""
+            if burst:
+                burst_str = f", Loss: {loss:.0f}%"
+                if status:
+                    burst_str += (f", Min/Max/StdDev: {burst['rtt_min']:.2f}/{burst['rtt_max']:.2f}/"
+                                  f"{burst['rtt_stddev']:.2f}ms")
+                if jitter is not None:
+                    burst_str += f", Jitter: {jitter:.2f}ms"
+            log_msg = (f"Ping {target}: {'Success' if status else 'Timeout'} "
+                     f"(Response: {response_str}ms, Attempts: {attempts}{burst_str}, Duration: {duration}ms)")
+            self.bus.put(("log", ("debug", log_msg)))
+        if instruments.enabled:
+            instruments.record("check", duration / 1000)
+            instruments.record("handle", time.perf_counter() - started)
+
+    def save_ping_result(self, target, status, response_time, attempts, burst=None):
+        # Queued for the writer thread; never blocks on the database.
+        # Returns the row's result_key.
+        return self.result_writer.submit(
+            target,
+            status,
+            float(response_time) if response_time is not None else None,
+            attempts,
+            burst=burst
+        )
+
+    def get_success_rate(self, target):
+        # Served from the in-memory rolling window, no database round-trip
+        return self.success_rates.success_rate(target)
+
+    def history_series(self, target, start, end, points=600, slices=6):
+        # Chart data for one target over [start, end) (epoch seconds) in
+        # `slices` chunks, newest first, so a chart can draw while the rest
+        # loads. Each chunk has (times, ms) "rtt" and (times, %) "loss"
+        # series of at most points/slices points (LTTB). Below a minute per
+        # point the raw samples are used, from the in-memory rings where
+        # they reach back far enough; above it the coarsest rollup that
+        # fits, plus raw samples for the minutes it does not cover yet.
+        step = (end - start) / points
+        per_slice = max(3, points // slices)
+        rollup = None
+        if step >= ROLLUPS[0].width:
+            rollup = self.rollups.choose_resolution(datetime.fromtimestamp(start, timezone.utc),
+                                                    datetime.fromtimestamp(end, timezone.utc), points)
+            start = RollupJob.floor(datetime.fromtimestamp(start, timezone.utc), rollup.width).timestamp()
+        width = (end - start) / slices
+        times, _, _ = self.history.samples(target)
+        in_memory = times[0] if len(times) else math.inf
+        conn = None
+        try:
+            watermark = None
+            if rollup is not None or start < in_memory:
+                conn = self.get_db_connection()
+            if rollup is not None:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT extract(epoch FROM watermark) FROM ping_rollup_watermarks "
+                                "WHERE resolution = %s", (rollup.name,))
+                    row = cur.fetchone()
+                watermark = float(row[0]) if row else start
+            for index in range(slices - 1, -1, -1):
+                lo, hi = start + index * width, start + (index + 1) * width
+                if rollup is None:
+                    source = "memory" if lo >= in_memory else "raw"
+                    sample_times, rtt, status = self.raw_samples(conn, target, lo, hi, in_memory)
+                    answered = ~np.isnan(rtt)
+                    rtt_times, rtt = sample_times[answered], rtt[answered]
+                    loss_times, loss = bucket_means(sample_times, 100.0 * ~status, lo, max(step, 1.0))
+                else:
+                    source = rollup.name
+                    rtt_times, rtt, loss_times, loss = self.rollup_samples(conn, rollup, target, lo,
+                                                                            min(hi, watermark))
+                    if hi > watermark:
+                        # Minutes the rollup job has not reached yet
+                        source += "+raw"
+                        tail = self.raw_samples(conn, target, max(lo, watermark), hi, in_memory)
+                        sample_times, tail_rtt, status = tail
+                        answered = ~np.isnan(tail_rtt)
+                        tail_times, tail_rtt = bucket_means(sample_times[answered], tail_rtt[answered],
+                                                            watermark, rollup.width)
+                        tail_loss_times, tail_loss = bucket_means(sample_times, 100.0 * ~status, watermark,
+                                                                  rollup.width)
+                        rtt_times, rtt = np.concatenate([rtt_times, tail_times]), np.concatenate([rtt, tail_rtt])
+                        loss_times = np.concatenate([loss_times, tail_loss_times])
+                        loss = np.concatenate([loss, tail_loss])
+                keep_rtt = lttb(rtt_times, rtt, per_slice)
+                keep_loss = lttb(loss_times, loss, per_slice)
+                yield {
+                    "source": source,
+                    "start": lo,
+                    "end": hi,
+                    "rtt": (rtt_times[keep_rtt], rtt[keep_rtt]),
+                    "loss": (loss_times[keep_loss], loss[keep_loss])
+                }
+        finally:
+            if conn:
+                conn.close()
+
+    def raw_samples(self, conn, target, start, end, in_memory=math.inf):
+        # (times, rtt with NaN for lost, status) of [start, end), from the
+        # in-memory rings when they reach back to start (in_memory is
+        # their oldest sample)
+        if start >= in_memory:
+            return self.history.samples(target, start, end)
+        with conn.cursor() as cur:
+            # Served by the (target_id, timestamp, agent) index
+            cur.execute("""
+                SELECT extract(epoch FROM timestamp), status, response_time
+                FROM ping_results
+                WHERE target_id = (SELECT id FROM ping_targets WHERE target = %s)
+                  AND timestamp >= to_timestamp(%s) AND timestamp < to_timestamp(%s)
+                ORDER BY timestamp
+            """, (target, start, end))
+            rows = np.array(cur.fetchall(), dtype=float).reshape(-1, 3)
+        status = rows[:, 1] > 0
+        return rows[:, 0], np.where(status, rows[:, 2], np.nan), status
+
+    @staticmethod
+    def rollup_samples(conn, rollup, target, start, end):
+        # (times, mean RTT) and (times, loss %) of the rollup buckets in
+        # [start, end), placed at the bucket middles
+        if end <= start:
+            return np.zeros(0), np.zeros(0), np.zeros(0), np.zeros(0)
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT extract(epoch FROM bucket), 100.0 * (count - success_count) / count,
+                       rtt_sum / nullif(success_count, 0)
+                FROM {rollup.table}
+                WHERE target = %s AND bucket >= to_timestamp(%s) AND bucket < to_timestamp(%s)
+                ORDER BY bucket
+            """, (target, start, end))
+            rows = np.array(cur.fetchall(), dtype=float).reshape(-1, 3)
+        times = rows[:, 0] + rollup.width / 2
+        answered = ~np.isnan(rows[:, 2])
+        return times[answered], rows[answered, 2], times, rows[:, 1]
+
+    def toggle_profiling(self):
+        # Profile the probe loop, the result writer and the ICMP event
+        # loop until called again, then save the profile in the background
+        instruments = self.instruments
+        profiling = instruments.toggle_profiling()
+        if isinstance(self.icmp, IcmpEngine) and self.icmp.loop is not None:
+            self.icmp.loop.call_soon_threadsafe(instruments.profile_point, "icmp loop")
+        if profiling:
+            self.log("Profiling started")
+        else:
+            threading.Thread(target=self.save_profile, daemon=True).start()
+        return profiling
+
+    def save_profile(self):
+        hottest = self.instruments.save_profile()
+        if not hottest:
+            self.log("Profiling stopped, nothing was recorded")
+            return
+        self.log(f"Profile saved to {self.instruments.profile_path}; most time spent in:")
+        for location, calls, own, cumulative in hottest[:5]:
+            self.log(f"  {location}: {calls} calls, {own:.3f}s own, {cumulative:.3f}s cumulative")
+
+    def health(self):
+        # Engine health snapshot for the dashboard panel and /health
+        writer = self.result_writer
+        scheduler = self.scheduler
+        with self.bus.lock:
+            subscribers = list(self.bus.subscribers)
+        health = {
+            "time": time.time(),
+            "monitoring": self.is_monitoring(),
+            "targets": len(self.targets),
+            "scheduled": len(scheduler.state),
+            "attempts": scheduler.launched,
+            "retries": scheduler.retries,
+            "probe_backlog": self.probe_results.qsize(),
+            "bus_backlog": max((queue.qsize() for queue in subscribers), default=0),
+            "writer": {
+                "queue": writer.pending(),
+                "rows_written": writer.rows_written,
+                "rows_replayed": writer.rows_replayed,
+                "wal_pending": writer.wal.pending(),
+                "database_up": writer.db_down_since is None,
+                "last_flush_ms": round(writer.last_flush_latency * 1000, 3)
+            },
+            "first_probe_seconds": self.first_probe,
+            "events": {
+                "emitted": self.events.emitted,
+                "targets_down": self.events.down,
+                "outages": len(self.events.outages),
+                "undelivered": self.event_dispatcher.pending()
+            },
+            "instrumented": self.instruments.enabled,
+            "profiling": self.instruments.profiling,
+            "stages": self.instruments.summary(),
+            "traces": [dict(trace) for trace in list(self.instruments.traces)]
+        }
+        if isinstance(self.icmp, IcmpEngine) and self.icmp.dns is not None:
+            health["dns"] = {"queries": self.icmp.dns.queries, "failures": self.icmp.dns.failures,
+                             "cached": len(self.icmp.dns.entries)}
+        if isinstance(self.icmp, ShardedProber):
+            health["worker_restarts"] = self.icmp.restarts
+        return health
+
+
+class DarkModeTheme:
+    @staticmethod
+    def apply(root):
+        root.tk_setPalette(
+            background='#1a1a1a', foreground='#ffffff',
+            activeBackground='#404040', activeForeground='#ffffff',
+            selectColor='#3a3a3a', selectBackground='#3a3a3a',
+            insertBackground='#ffffff'
+        )
+        
+        style = ttk.Style()
+        style.theme_use('clam')
+        
+        # Configure colors
+        style.configure('.', background='#1a1a1a', foreground='#ffffff')
+        style.configure('TFrame', background='#1a1a1a')
+        style.configure('TLabel', background='#1a1a1a', foreground='#ffffff')
+        style.configure('TButton', background='#3a3a3a', foreground='#ffffff', borderwidth=1)
+        style.configure('TEntry', fieldbackground='#2a2a2a', foreground='#ffffff')
+        style.configure('TCombobox', fieldbackground='#2a2a2a', foreground='#ffffff')
+        style.map('TButton', 
+                background=[('active', '#404040'), ('pressed', '#505050')],
+                foreground=[('active', '#ffffff'), ('pressed', '#ffffff')])
+        style.map('TCombobox', 
+                fieldbackground=[('readonly', '#2a2a2a')],
+                foreground=[('readonly', '#ffffff')])
+        
+        # Scrollbar style
+        style.configure('Vertical.TScrollbar', background='#2a2a2a', troughcolor='#1a1a1a')
+        style.configure('Horizontal.TScrollbar', background='#2a2a2a', troughcolor='#1a1a1a')
+        
+        # Treeview style
+        style.configure("Treeview", 
+                      background="#2a2a2a", 
+                      foreground="#ffffff",
+                      fieldbackground="#2a2a2a",
+                      rowheight=25)
+        style.map('Treeview', background=[('selected', '#3a3a3a')])
+        style.configure("Treeview.Heading", 
+                      background="#3a3a3a", 
+                      foreground="#ffffff",
+                      relief="flat")
+        style.map("Treeview.Heading", 
+                background=[('active', '#4a4a4a')])
+
+class PingMonitorApp:
+    def __init__(self, root, engine, stream_address=None):
+        self.root = root
+        self.root.title("VICS Ping Monitor")
+        self.root.geometry("1200x800")
+        
+        # Probing and storage live in the engine; the dashboard subscribes to
+        # its messages, or to a remote engine's stream when given an address
+        self.engine = engine
+        self.stream_client = None
+        if stream_address:
+            self.message_queue = Queue()
+            self.stream_client = ResultStreamClient(stream_address, self.message_queue)
+        else:
+            self.message_queue = engine.bus.subscribe()
+        self.ttl_days = engine.ttl_days
+        self.ping_attempts = engine.ping_attempts
+        self.ping_timeout = engine.ping_timeout
+        
+        # Backing model for the virtualized status table
+        self.status_model = StatusModel()
+        self.activity = ActivityLog(engine.log_lines)
+        self.max_messages_per_tick = 20000
+        self.health_window = None
+        
+        # Setup UI
+        self.setup_ui()
+        
+        # Check for messages from other threads
+        self.check_queue()
+        
+        # Initialize database, background jobs and targets
+        if self.stream_client:
+            # The remote engine probes; we only manage targets
+            threading.Thread(target=self.engine.load_targets_from_db, daemon=True).start()
+            self.stream_client.start()
+            self.start_btn.config(state=tk.DISABLED)
+            self.status_bar.config(text=f"Following remote engine at {stream_address}")
+        else:
+            # Targets and last-known status from the local snapshot first,
+            # so the table and Start Monitoring work at once; the database
+            # stage runs in the background and reconciles
+            self.engine.start_up()
+            self.sync_targets(self.engine.targets)
+            for content in list(self.engine.last_status.values()):
+                self.update_status_display(*content)
+            self.refresh_status_table()
+            self.status_bar.config(text="Connecting to database...")
+            self.engine.bootstrap_async()
+    
+    def setup_ui(self):
+        # Apply dark mode
+        DarkModeTheme.apply(self.root)
+        
+        # Main container
+        main_frame = ttk.Frame(self.root, padding="10")
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        # Left panel (controls)
+        left_panel = ttk.Frame(main_frame, width=350)
+        left_panel.pack(side=tk.LEFT, fill=tk.Y, padx=(0, 10))
+        
+        # Right panel (results)
+        right_panel = ttk.Frame(main_frame)
+        right_panel.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
+        
+        # Targets section
+        targets_frame = ttk.LabelFrame(left_panel, text="Target Management", padding="10")
+        targets_frame.pack(fill=tk.X, pady=(0, 10))
+        
+        # Target entry
+        ttk.Label(targets_frame, text="Target (IP/Hostname):").pack(anchor=tk.W)
+        self.target_entry = ttk.Entry(targets_frame)
+        self.target_entry.pack(fill=tk.X, pady=(0, 5))
+        
+        # Add/Remove buttons
+        button_frame = ttk.Frame(targets_frame)
+        button_frame.pack(fill=tk.X)
+        
+        add_btn = ttk.Button(button_frame, text="Add Target", command=self.add_target)
+        add_btn.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 5))
+        
+        remove_btn = ttk.Button(button_frame, text="Remove Selected", command=self.remove_target)
+        remove_btn.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        
+        ttk.Label(targets_frame, text="Select targets to remove in the status table.").pack(anchor=tk.W, pady=(5, 0))
+        
+        # Bulk import/export (CSV, JSON, or text with hostnames, addresses and CIDR ranges)
+        file_frame = ttk.Frame(targets_frame)
+        file_frame.pack(fill=tk.X, pady=(5, 0))
+        
+        import_btn = ttk.Button(file_frame, text="Import...", command=self.import_targets)
+        import_btn.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 5))
+        
+        export_btn = ttk.Button(file_frame, text="Export...", command=self.export_targets)
+        export_btn.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        
+        # Control buttons
+        control_frame = ttk.LabelFrame(left_panel, text="Monitoring Control", padding="10")
+        control_frame.pack(fill=tk.X, pady=(10, 0))
+        
+        self.start_btn = ttk.Button(control_frame, text="Start Monitoring", command=self.start_monitoring)
+        self.start_btn.pack(fill=tk.X, pady=(0, 5))
+        
+        self.stop_btn = ttk.Button(control_frame, text="Stop Monitoring", command=self.stop_monitoring, state=tk.DISABLED)
+        self.stop_btn.pack(fill=tk.X)
+        
+        ttk.Button(control_frame, text="History", command=self.show_history).pack(fill=tk.X, pady=(5, 0))
+        ttk.Button(control_frame, text="Engine Health", command=self.show_health).pack(fill=tk.X, pady=(5, 0))
+        
+        # Settings frame
+        settings_frame = ttk.LabelFrame(left_panel, text="Ping Settings", padding="10")
+        settings_frame.pack(fill=tk.X, pady=(10, 0))
+        
+        # TTL settings
+        ttk.Label(settings_frame, text="Data Retention (days):").pack(anchor=tk.W)
+        self.ttl_var = tk.IntVar(value=self.ttl_days)
+        ttk.Spinbox(
+            settings_frame, 
+            from_=1, 
+            to=365, 
+            textvariable=self.ttl_var,
+            command=self.update_ttl
+        ).pack(fill=tk.X)
+        
+        # Ping attempts
+        ttk.Label(settings_frame, text="Ping Attempts:").pack(anchor=tk.W)
+        self.attempts_var = tk.IntVar(value=self.ping_attempts)
+        ttk.Spinbox(
+            settings_frame, 
+            from_=1, 
+            to=5, 
+            textvariable=self.attempts_var,
+            command=self.update_attempts
+        ).pack(fill=tk.X)
+        
+        # Ping timeout
+        ttk.Label(settings_frame, text="Ping Timeout (sec):").pack(anchor=tk.W)
+        self.timeout_var = tk.IntVar(value=self.ping_timeout)
+        ttk.Spinbox(
+            settings_frame, 
+            from_=1, 
+            to=10, 
+            textvariable=self.timeout_var,
+            command=self.update_timeout
+        ).pack(fill=tk.X)
+        
+        # Log section, backed by a ring of the last log_lines lines
+        log_frame = ttk.LabelFrame(left_panel, text="Activity Log", padding="10")
+        log_frame.pack(fill=tk.BOTH, expand=True, pady=(10, 0))
+        
+        level_frame = ttk.Frame(log_frame)
+        level_frame.pack(fill=tk.X, pady=(0, 5))
+        ttk.Label(level_frame, text="Level:").pack(side=tk.LEFT)
+        self.log_level_var = tk.StringVar(value=self.engine.log_level)
+        level_box = ttk.Combobox(
+            level_frame,
+            textvariable=self.log_level_var,
+            values=list(LOG_LEVELS),
+            state="readonly",
+            width=10
+        )
+        level_box.pack(side=tk.LEFT, padx=(5, 0))
+        level_box.bind("<<ComboboxSelected>>", lambda event: self.set_log_level())
+        
+        self.log_text = scrolledtext.ScrolledText(
+            log_frame,
+            wrap=tk.WORD,
+            height=10,
+            bg="#2a2a2a",
+            fg="#ffffff",
+            insertbackground="#ffffff"
+        )
+        self.log_text.pack(fill=tk.BOTH, expand=True)
+        
+        # Status section
+        status_frame = ttk.LabelFrame(right_panel, text="Current Status", padding="10")
+        status_frame.pack(fill=tk.BOTH, expand=True)
+        
+        # Search and status filter, applied to the model without rebuilding the widget
+        filter_frame = ttk.Frame(status_frame)
+        filter_frame.pack(fill=tk.X, pady=(0, 5))
+        
+        ttk.Label(filter_frame, text="Search:").pack(side=tk.LEFT)
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add("write", lambda *args: self.apply_status_filter())
+        ttk.Entry(filter_frame, textvariable=self.search_var).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(5, 10))
+        
+        ttk.Label(filter_frame, text="Show:").pack(side=tk.LEFT)
+        self.filter_var = tk.StringVar(value="All")
+        filter_box = ttk.Combobox(
+            filter_frame,
+            textvariable=self.filter_var,
+            values=StatusModel.filters,
+            state="readonly",
+            width=10
+        )
+        filter_box.pack(side=tk.LEFT, padx=(5, 10))
+        filter_box.bind("<<ComboboxSelected>>", lambda event: self.apply_status_filter())
+        
+        self.view_count_label = ttk.Label(filter_frame, text="")
+        self.view_count_label.pack(side=tk.LEFT)
+        
+        # Virtualized status table
+        self.status_table = VirtualStatusTable(status_frame, self.status_model, lambda: self.ping_attempts)
+        self.status_table.tree.bind("<Double-1>", lambda event: self.show_history())
+        
+        # Status bar
+        self.status_bar = ttk.Label(right_panel, text="Ready", relief=tk.SUNKEN)
+        self.status_bar.pack(fill=tk.X, pady=(5, 0))
+    
+    def update_ttl(self):
+        self.ttl_days = self.ttl_var.get()
+        self.engine.set_ttl(self.ttl_days)
+    
+    def update_attempts(self):
+        self.ping_attempts = self.attempts_var.get()
+        self.engine.ping_attempts = self.ping_attempts
+    
+    def update_timeout(self):
+        self.ping_timeout = self.timeout_var.get()
+        self.engine.ping_timeout = self.ping_timeout
+    
+    def add_target(self):
+        target = self.target_entry.get().strip()
+        if not target:
+            return
+        
+        # Database work off the Tk thread; the engine logs the outcome and
+        # announces the new target list on the bus
+        def add():
+            if self.engine.add_target(target):
+                self.message_queue.put(("target_added", target))
+        
+        threading.Thread(target=add, daemon=True).start()
+    
+    def import_targets(self):
+        path = filedialog.askopenfilename(
+            title="Import Targets",
+            filetypes=[("Target lists", "*.csv *.json *.txt"), ("All files", "*")])
+        if path:
+            # Database work off the Tk thread; the result arrives on the bus
+            threading.Thread(target=self.engine.import_file, args=(path,), daemon=True).start()
+    
+    def export_targets(self):
+        path = filedialog.asksaveasfilename(
+            title="Export Targets",
+            defaultextension=".csv",
+            filetypes=[("CSV", "*.csv"), ("JSON", "*.json"), ("Text", "*.txt")])
+        if path:
+            threading.Thread(target=self.engine.export_targets, args=(path,), daemon=True).start()
+    
+    def remove_target(self):
+        selection = self.status_table.selected_targets()
+        if not selection:
+            return
+        
+        # Off the Tk thread like add_target; sync_targets drops the removed
+        # targets (and their selection) when the new list arrives
+        threading.Thread(target=self.engine.remove_targets, args=(selection,), daemon=True).start()
+    
+    def update_status_display(self, target, status, response_time, checked_at, success_rate, attempts,
+                              loss=None, jitter=None, dns_error=None):
+        self.status_model.update(target, status, response_time, checked_at, success_rate, attempts,
+                                 loss, jitter, dns_error)
+    
+    def apply_status_filter(self):
+        self.status_model.set_filter(self.filter_var.get(), self.search_var.get())
+        self.status_table.offset = 0
+        self.refresh_status_table()
+    
+    def refresh_status_table(self):
+        self.status_table.refresh()
+        self.view_count_label.config(
+            text=f"Showing {len(self.status_model.view)} of {len(self.status_model.rows)}")
+    
+    def start_monitoring(self):
+        if not self.engine.targets:
+            messagebox.showwarning("Warning", "Please add at least one target to monitor.")
+            return
+            
+        if self.engine.is_monitoring():
+            return
+        
+        try:
+            self.engine.start_monitoring()
+        except OSError as e:
+            messagebox.showerror("Ping Error", f"Cannot open ICMP socket:\n{str(e)}")
+            return
+        
+        self.start_btn.config(state=tk.DISABLED)
+        self.stop_btn.config(state=tk.NORMAL)
+        self.status_bar.config(text="Monitoring active - concurrent pinging with retries")
+    
+    def stop_monitoring(self):
+        self.engine.stop_monitoring()
+            
+        self.start_btn.config(state=tk.NORMAL)
+        self.stop_btn.config(state=tk.DISABLED)
+        self.status_bar.config(text="Monitoring stopped")
+    
+    def sync_targets(self, targets):
+        current = set(self.status_model.rows)
+        wanted = set(targets)
+        for target in current - wanted:
+            self.status_model.remove(target)
+            self.status_table.selected.discard(target)
+        for target in targets:
+            if target not in current:
+                self.status_model.add(target)
+    
+    def log(self, message, level="info"):
+        self.log_many([(level, message)])
+    
+    def log_many(self, entries):
+        # One insert per tick for whatever passes the level filter; the
+        # widget is trimmed to the ring's capacity
+        now = time.time()
+        threshold = LOG_LEVELS[self.log_level_var.get()]
+        lines = [self.activity.append(now, level, text) for level, text in entries]
+        shown = [line for (level, _), line in zip(entries, lines) if LOG_LEVELS[level] >= threshold]
+        if not shown:
+            return
+        self.log_text.insert(tk.END, "".join(f"{line}\n" for line in shown))
+        excess = int(self.log_text.index("end-1c").split(".")[0]) - 1 - self.activity.entries.maxlen
+        if excess > 0:
+            self.log_text.delete("1.0", f"{excess + 1}.0")
+        self.log_text.see(tk.END)
+    
+    def set_log_level(self):
+        # Redraw the widget from the ring at the new level
+        level = self.log_level_var.get()
+        if not self.stream_client:
+            self.engine.set_log_level(level)
+        self.log_text.delete("1.0", tk.END)
+        lines = self.activity.lines(level)
+        if lines:
+            self.log_text.insert(tk.END, "".join(f"{line}\n" for line in lines))
+        self.log_text.see(tk.END)
+    
+    def check_queue(self):
+        # Drain what other threads queued since the last tick, keeping only
+        # the latest status per target so each row is redrawn once per tick
+        status_updates = {}
+        log_lines = []
+        targets_changed = False
+        for _ in range(self.max_messages_per_tick):
+            try:
+                message_type, content = self.message_queue.get_nowait()
+            except Empty:
+                break
+            
+            if message_type in ("log", "event"):
+                log_lines.append(log_entry(message_type, content))
+            elif message_type == "update_status":
+                status_updates[content[0]] = content
+            elif message_type == "history":
+                window, request, chunk = content
+                window.add(request, chunk)
+            elif message_type == "targets":
+                self.sync_targets(content)
+                targets_changed = True
+            elif message_type == "target_added":
+                # Clear the entry unless something else was typed meanwhile
+                if self.target_entry.get().strip() == content:
+                    self.target_entry.delete(0, tk.END)
+            elif message_type == "bootstrap" and not self.stream_client:
+                if content:
+                    self.status_bar.config(
+                        text=f"Database unavailable ({content}); results are buffered locally")
+                elif self.engine.is_monitoring():
+                    self.status_bar.config(text="Monitoring active - concurrent pinging with retries")
+                else:
+                    self.status_bar.config(text="Ready")
+        
+        if log_lines:
+            self.log_many(log_lines)
+        for content in status_updates.values():
+            self.update_status_display(*content)
+        if status_updates or targets_changed or self.status_model.values_changed:
+            self.refresh_status_table()
+        if status_updates:
+            self.engine.instruments.displayed(status_updates.values(), time.time())
+        
+        self.root.after(100, self.check_queue)
+
+    def show_history(self):
+        selection = sorted(self.status_table.selected_targets())
+        if not selection:
+            messagebox.showinfo("History", "Select a target in the status table first.")
+            return
+        if Figure is None:
+            messagebox.showerror("History", "Charts need matplotlib (pip install matplotlib).")
+            return
+        HistoryWindow(self.root, self.engine, self.message_queue, selection[0])
+    
+    def show_health(self):
+        # Live engine health panel, refreshed every second while open
+        if self.health_window is not None and self.health_window.winfo_exists():
+            self.health_window.lift()
+            return
+        self.health_window = tk.Toplevel(self.root)
+        self.health_window.title("Engine Health")
+        self.health_window.geometry("760x520")
+        frame = ttk.Frame(self.health_window, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+        self.profile_btn = ttk.Button(frame, text="Start Profiling", command=self.toggle_profiling)
+        self.profile_btn.pack(anchor=tk.W, pady=(0, 5))
+        self.health_text = scrolledtext.ScrolledText(
+            frame,
+            wrap=tk.NONE,
+            bg="#2a2a2a",
+            fg="#ffffff",
+            font=("TkFixedFont", 10)
+        )
+        self.health_text.pack(fill=tk.BOTH, expand=True)
+        self.refresh_health()
+
+    def toggle_profiling(self):
+        profiling = self.engine.toggle_profiling()
+        self.profile_btn.config(text="Stop Profiling" if profiling else "Start Profiling")
+
+    def refresh_health(self):
+        if self.health_window is None or not self.health_window.winfo_exists():
+            self.health_window = None
+            return
+        health = self.engine.health()
+        writer = health["writer"]
+        lines = [
+            f"Monitoring: {'yes' if health['monitoring'] else 'no'}    "
+            f"Targets: {health['targets']} ({health['scheduled']} scheduled)",
+            f"Attempts: {health['attempts']}    Retries: {health['retries']}    "
+            f"Probe backlog: {health['probe_backlog']}    Dashboard backlog: {health['bus_backlog']}",
+            f"Writer: {writer['queue']} queued, {writer['rows_written']} written, "
+            f"{writer['rows_replayed']} replayed, last flush {writer['last_flush_ms']:.1f}ms, "
+            f"database {'up' if writer['database_up'] else 'DOWN'}"
+            f"{', WAL pending' if writer['wal_pending'] else ''}",
+        ]
+        if "dns" in health:
+            dns = health["dns"]
+            lines.append(f"DNS: {dns['queries']} queries, {dns['failures']} failures, {dns['cached']} cached")
+        lines.append("")
+        if health["instrumented"]:
+            lines.append(f"{'Stage':<10}{'Count':>10}{'Mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'Max':>10}  (ms)")
+            for stage, summary in health["stages"].items():
+                if not summary["count"]:
+                    lines.append(f"{stage:<10}{0:>10}")
+                    continue
+                lines.append(f"{stage:<10}{summary['count']:>10}" + "".join(
+                    f"{summary[key]:>10.2f}" for key in ("mean_ms", "p50_ms", "p90_ms", "p99_ms", "max_ms")))
+            lines.append("")
+            lines.append("Sampled checks (ms): schedule / dns / echo / dispatch / handle -> persisted, displayed")
+            for trace in reversed(health["traces"][-20:]):
+                stages = " / ".join("-" if trace[key] is None else f"{trace[key]:.1f}" for key in
+                                    ("schedule_ms", "dns_ms", "echo_ms", "dispatch_ms", "handle_ms"))
+                after = ", ".join("-" if trace[key] is None else f"{trace[key]:.0f}" for key in
+                                  ("persist_ms", "display_ms"))
+                lines.append(f"{trace['target'][:30]:<32}{stages} -> {after}")
+        else:
+            lines.append("Instrumentation is off (instrument = false in [monitor])")
+        self.health_text.delete("1.0", tk.END)
+        self.health_text.insert(tk.END, "\n".join(lines))
+        self.profile_btn.config(text="Stop Profiling" if health["profiling"] else "Start Profiling")
+        self.root.after(1000, self.refresh_health)
+    
+    def on_closing(self):
+        if self.stream_client:
+            self.stream_client.stop()
+        self.engine.close()
+        self.root.destroy()
+
+
+class SimulatedNetwork:
+    # Target network for the benchmark. Host i is 10.0.0.0 + i, a `dead`
+    # fraction of the hosts never answers, RTTs are lognormal around
+    # rtt_ms and `loss` of all echoes are dropped. A `dns` fraction of the
+    # targets are hostnames whose lookups take dns_delay seconds.
+    def __init__(self, rtt_ms=20.0, spread=0.5, loss=0.01, dead=0.05, dns=0.1, dns_delay=0.05):
+        self.rtt_ms = rtt_ms
+        self.spread = spread
+        self.loss = loss
+        self.dead = dead
+        self.dns = dns
+        self.dns_delay = dns_delay
+
+    @staticmethod
+    def address(index):
+        return str(ipaddress.IPv4Address(0x0A000000 + index))
+
+    @staticmethod
+    def fraction(value, salt):
+        return zlib.crc32(f"{salt}:{value}".encode("utf-8")) / 2 ** 32
+
+    def targets(self, count):
+        return [f"host-{index}.bench.invalid" if self.fraction(index, "dns") < self.dns else
+                self.address(index) for index in range(1, count + 1)]
+
+    def rtt(self, addr):
+        if self.fraction(addr, "dead") < self.dead:
+            return None
+        return random.lognormvariate(math.log(self.rtt_ms / 1000), self.spread)
+
+    async def resolve(self, name):
+        await asyncio.sleep(self.dns_delay)
+        return self.address(int(name.split(".")[0][5:]))
+
+    def transport(self):
+        return LoopbackTransport(self.rtt, self.loss)
+
+
+class FakeDatabase:
+    # In-process stand-in for the result writer's connection pool, and
+    # for the connection and cursor it hands out: each round-trip sleeps
+    # `latency` seconds, COPY only counts the rows and target id lookups
+    # make up ids
+    def __init__(self, latency=0.002):
+        self.latency = latency
+        self.rows = 0
+        self.round_trips = 0
+        self.ids = {}
+        self.result = []
+
+    def getconn(self):
+        return self
+
+    def putconn(self, conn, close=False):
+        pass
+
+    def closeall(self):
+        pass
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def copy_expert(self, sql, buffer):
+        time.sleep(self.latency)
+        self.round_trips += 1
+        self.rows += buffer.getvalue().count("\n")
+
+    def execute(self, sql, params=None):
+        time.sleep(self.latency)
+        self.round_trips += 1
+        self.result = [(len(self.ids), len(self.ids))]
+        if "WHERE target = ANY" in sql:
+            self.result = [(target, self.ids.setdefault(target, len(self.ids) + 1)) for target in params[0]]
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+    def commit(self):
+        pass
+
+
+def rss_bytes():
+    # Resident set size of this process (Linux), None elsewhere
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def percentiles(values, scale=1.0):
+    if not len(values):
+        return None
+    values = np.asarray(values) * scale
+    p50, p90, p99 = np.percentile(values, (50, 90, 99))
+    return {"p50": round(float(p50), 3), "p90": round(float(p90), 3), "p99": round(float(p99), 3),
+            "max": round(float(values.max()), 3)}
+
+
+def benchmark_targets(config, network, count, duration, db_latency=0.002, use_database=False):
+    # Runs the real probe loop, scheduler and result writer against
+    # `count` simulated targets for `duration` seconds (after one interval
+    # of warm-up) and measures it from the outside, the way the dashboard
+    # sees it
+    workdir = tempfile.mkdtemp(prefix="ping-bench-")
+    config["monitor"]["wal_dir"] = os.path.join(workdir, "wal")
+    config["monitor"]["history_path"] = os.path.join(workdir, "history.snapshot")
+    config["monitor"]["state_path"] = os.path.join(workdir, "state.json")
+    config["monitor"]["workers"] = "1"
+    config["agent"]["enabled"] = "false"
+    # Events are detected as usual but only stored with the real database
+    config["events"]["persist"] = "true" if use_database else "false"
+    config["events"]["webhook"] = ""
+    rss_before = rss_bytes()
+    engine = MonitorEngine.from_config(config)
+    engine.icmp = IcmpEngine(network.transport(), dns_ttl=engine.dns_ttl,
+                             dns_negative_ttl=engine.dns_negative_ttl, burst=engine.burst,
+                             burst_spacing=engine.burst_spacing, resolver=network.resolve)
+    engine.icmp.start()
+    targets = network.targets(count)
+    added = []
+    if use_database:
+        engine.initialize_database()
+        engine.result_writer.agent_id = "benchmark"
+        # Results are stored against ping_targets; the simulated targets
+        # not already there are added for the run and removed after it
+        with engine.get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO ping_targets (target)
+                SELECT unnest(%s::varchar[])
+                ON CONFLICT (target) DO NOTHING
+                RETURNING target
+            """, (targets,))
+            added = [row[0] for row in cur.fetchall()]
+            cur.execute("SELECT sum(pg_total_relation_size(relid))::bigint FROM pg_partition_tree('ping_results')")
+            db_bytes = cur.fetchone()[0]
+    else:
+        engine.result_writer.pool = FakeDatabase(db_latency)
+        engine.result_writer.schema_ready.set()
+    writer = engine.result_writer
+    scheduler = engine.scheduler
+    
+    # Consume the bus like the dashboard's check_queue: a batch of at
+    # most 20000 messages (its max_messages_per_tick) every 100ms
+    messages = engine.bus.subscribe()
+    stopping = threading.Event()
+    measuring = threading.Event()
+    intervals = array("d")
+    gui_latency = array("d")
+    lags = array("d")
+    flushes = array("d")
+    counts = {"checks": 0}
+    
+    def observe():
+        last_ok = {}
+        flushed = writer.rows_written
+        while not stopping.wait(0.1):
+            lag, scheduler.max_lag = scheduler.max_lag, 0.0
+            if writer.rows_written != flushed:
+                flushed = writer.rows_written
+                if measuring.is_set():
+                    flushes.append(writer.last_flush_latency)
+            if measuring.is_set():
+                lags.append(lag)
+            now = time.time()
+            updates = []
+            for _ in range(20000):
+                try:
+                    message_type, content = messages.get_nowait()
+                except Empty:
+                    break
+                if message_type != "update_status":
+                    continue
+                updates.append(content)
+                target, status, checked = content[0], content[1], content[3]
+                previous = last_ok.pop(target, None)
+                if status:
+                    last_ok[target] = checked
+                if not measuring.is_set():
+                    continue
+                counts["checks"] += 1
+                gui_latency.append(now - checked)
+                if status and previous is not None:
+                    intervals.append(checked - previous)
+            engine.instruments.displayed(updates, now)
+    
+    observer = threading.Thread(target=observe, daemon=True)
+    observer.start()
+    engine.targets = targets
+    engine.start_monitoring()
+    time.sleep(engine.ping_interval + 1.0)
+    
+    launched, retries = scheduler.launched, scheduler.retries
+    written = writer.rows_written
+    measuring.set()
+    start = time.monotonic()
+    cpu = time.process_time()
+    time.sleep(duration)
+    cpu = time.process_time() - cpu
+    elapsed = time.monotonic() - start
+    measuring.clear()
+    launched, retries = scheduler.launched - launched, scheduler.retries - retries
+    written = writer.rows_written - written
+    rss_after = rss_bytes()
+    history_bytes = engine.history.memory_usage()
+    dns_queries = engine.icmp.dns.queries
+    backlog = writer.pending()
+    stages = engine.instruments.summary() if engine.instruments.enabled else None
+    
+    stopping.set()
+    observer.join(timeout=5)
+    engine.close()
+    db_bytes_per_row = None
+    if use_database:
+        with engine.get_db_connection() as conn, conn.cursor() as cur:
+            # Table and index growth over everything the run stored
+            cur.execute("SELECT sum(pg_total_relation_size(relid))::bigint FROM pg_partition_tree('ping_results')")
+            stored = writer.rows_written - writer.rows_dropped
+            if stored:
+                db_bytes_per_row = round((cur.fetchone()[0] - db_bytes) / stored, 1)
+            cur.execute("DELETE FROM ping_targets WHERE target = ANY(%s)", (added,))
+            engine.delete_target_data(cur, added)
+            cur.execute("DELETE FROM ping_results WHERE agent = 'benchmark'")
+    shutil.rmtree(workdir, ignore_errors=True)
+    
+    # A healthy target checked on schedule comes back within its jittered
+    # interval plus one echo timeout
+    limit = engine.ping_interval * (1 + scheduler.jitter) + engine.ping_timeout
+    overruns = int(np.count_nonzero(np.asarray(intervals) > limit)) if len(intervals) else 0
+    return {
+        "targets": count,
+        "duration": round(elapsed, 3),
+        "checks_per_sec": round(counts["checks"] / elapsed, 1),
+        "probes_per_sec": round(launched / elapsed, 1),
+        "cpu_percent": round(100 * cpu / elapsed, 1),
+        "retries_per_sec": round(retries / elapsed, 1),
+        "check_interval_ms": percentiles(intervals, 1000),
+        "overrun_ratio": round(overruns / len(intervals), 4) if len(intervals) else None,
+        "schedule_lag_ms": percentiles(lags, 1000),
+        "db_rows_per_sec": round(written / elapsed, 1),
+        "db_flush_ms": percentiles(flushes, 1000),
+        "db_backlog": backlog,
+        "db_bytes_per_row": db_bytes_per_row,
+        "gui_latency_ms": percentiles(gui_latency, 1000),
+        "rss_bytes_per_target": (round((rss_after - rss_before) / count) if rss_before and rss_after
+                                 else None),
+        "history_bytes": history_bytes,
+        "dns_queries": dns_queries,
+        "stages": stages
+    }
+
+
+def source_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=5, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmark(config, sizes, duration, network, db_latency=0.002, use_database=False, output=None):
+    # One engine per target count, smallest first. The JSON report goes
+    # to `output` (or stdout), a summary line per size to stderr.
+    settings = {
+        "interval": config["monitor"].getfloat("interval"),
+        "attempts": config["monitor"].getint("attempts"),
+        "timeout": config["monitor"].getfloat("timeout"),
+        "max_pps": config["monitor"].getfloat("max_pps"),
+        "burst": config["monitor"].getint("burst"),
+        "database": "postgresql" if use_database else "fake",
+        "db_latency": None if use_database else db_latency,
+        "network": {"rtt_ms": network.rtt_ms, "spread": network.spread, "loss": network.loss,
+                    "dead": network.dead, "dns": network.dns, "dns_delay": network.dns_delay}
+    }
+    report = {
+        "format": 1,
+        "revision": source_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "started": datetime.now(timezone.utc).isoformat(),
+        "settings": settings,
+        "results": []
+    }
+    for count in sorted(sizes):
+        result = benchmark_targets(config, network, count, duration, db_latency, use_database)
+        report["results"].append(result)
+        interval = result["check_interval_ms"]
+        lag = result["schedule_lag_ms"] or {"p99": 0}
+        gui = result["gui_latency_ms"] or {"p99": 0}
+        print(f"{count:>7} targets: {result['checks_per_sec']:.0f} checks/s, "
+              f"{result['probes_per_sec']:.0f} probes/s, interval p50/p99 "
+              + (f"{interval['p50']:.0f}/{interval['p99']:.0f}ms, "
+                 f"overrun {100 * result['overrun_ratio']:.1f}%, " if interval else "n/a, ")
+              + f"lag p99 {lag['p99']:.0f}ms, CPU {result['cpu_percent']:.0f}%, "
+              f"{result['db_rows_per_sec']:.0f} rows/s, "
+              f"GUI p99 {gui['p99']:.0f}ms, {result['rss_bytes_per_target'] or 0} B/target",
+              file=sys.stderr, flush=True)
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+
+def run_migration(engine):
+    # Schema upgrade with the result backfill in the foreground, without
+    # pauses between batches: for upgrading before the monitor starts, or
+    # finishing a background migration faster. Safe to run next to
+    # running engines.
+    messages = engine.bus.subscribe(types=("log",))
+    
+    def print_logs():
+        while not messages.empty():
+            print(log_entry(*messages.get_nowait())[1], file=sys.stderr)
+    
+    conn = None
+    failed = False
+    try:
+        engine.initialize_database()
+        print_logs()
+        conn = engine.get_db_connection()
+        started = printed = time.time()
+        moved = 0
+        while True:
+            batch = engine.backfill.step(conn)
+            if batch is None:
+                break
+            moved += batch[0]
+            if time.time() - printed >= 5:
+                printed = time.time()
+                print(f"{moved} rows moved ({moved / (printed - started):.0f}/s), "
+                      f"back to {batch[1]:%Y-%m-%d %H:%M}", file=sys.stderr, flush=True)
+        if engine.backfill.done:
+            print(f"Migration finished: {moved} rows moved in {time.time() - started:.0f}s",
+                  file=sys.stderr)
+        else:
+            print("Nothing to migrate", file=sys.stderr)
+    except Exception as e:
+        engine.log(f"Migration error: {str(e)}", "error")
+        failed = True
+    finally:
+        if conn:
+            conn.close()
+    print_logs()
+    return 1 if failed else 0
+
+
+def run_headless(engine, stream=None, metrics=None):
+    # Probe loop as a service: log lines go to stdout, SIGINT/SIGTERM stop
+    messages = engine.bus.subscribe(types=("log", "event"))
+    stopping = threading.Event()
+    signal.signal(signal.SIGINT, lambda *args: stopping.set())
+    signal.signal(signal.SIGTERM, lambda *args: stopping.set())
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda *args: engine.toggle_profiling())
+    
+    def print_logs():
+        while True:
+            try:
+                message_type, content = messages.get(timeout=0.5)
+            except Empty:
+                if stopping.is_set():
+                    break
+                continue
+            level, text = log_entry(message_type, content)
+            if LOG_LEVELS[level] < LOG_LEVELS[engine.log_level]:
+                continue
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            prefix = "" if level == "info" else f"{level.upper()}: "
+            print(f"[{timestamp}] {prefix}{text}", flush=True)
+    
+    printer = threading.Thread(target=print_logs, daemon=True)
+    printer.start()
+    
+    # Probing starts from the local snapshot; the database stage runs in
+    # the background. A database error is logged, and results go to the
+    # local WAL until it is back.
+    engine.start_up()
+    try:
+        engine.start_monitoring()
+    except OSError:
+        stopping.set()
+        printer.join(timeout=1)
+        engine.close()
+        return 1
+    engine.bootstrap_async()
+    if stream:
+        stream.start()
+    if metrics:
+        metrics.start()
+    
+    # Pick up targets added or removed by other clients
+    while not stopping.wait(engine.target_refresh):
+        engine.load_targets_from_db()
+    
+    if stream:
+        stream.stop()
+    if metrics:
+        metrics.stop()
+    engine.close()
+    printer.join(timeout=1)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VICS Ping Monitor")
+    parser.add_argument("--config", default=DEFAULT_CONFIG_PATH,
+                        help="INI file with " + ", ".join(f"[{name}]" for name in DEFAULT_CONFIG) + " sections")
+    parser.add_argument("--headless", action="store_true",
+                        help="run the probe engine as a service without the GUI")
+    parser.add_argument("--stream-port", type=int,
+                        help="serve the result stream on this TCP port (overrides [stream] port)")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve Prometheus metrics on this TCP port (overrides [metrics] port)")
+    parser.add_argument("--connect", metavar="HOST:PORT",
+                        help="GUI only: follow a headless engine's result stream instead of probing locally")
+    parser.add_argument("--event-receiver", type=int, metavar="PORT",
+                        help="run a local webhook receiver that prints the events POSTed to it, and nothing else")
+    parser.add_argument("--import", dest="import_path", metavar="PATH",
+                        help="import targets from a CSV, JSON or text file (addresses, hostnames, CIDR ranges) and exit")
+    parser.add_argument("--replace", action="store_true",
+                        help="with --import: also remove targets the file does not list")
+    parser.add_argument("--export", dest="export_path", metavar="PATH",
+                        help="export all targets to a CSV, JSON or text file and exit")
+    parser.add_argument("--migrate", action="store_true",
+                        help="upgrade the database schema, copy results of an older layout over, and exit")
+    bench = parser.add_argument_group("benchmark", "measure the probe loop against a simulated network")
+    bench.add_argument("--benchmark", action="store_true",
+                       help="run the benchmark and write a JSON report instead of monitoring")
+    bench.add_argument("--bench-targets", default="100,1000,10000,100000",
+                       help="comma-separated target counts (default: %(default)s)")
+    bench.add_argument("--bench-duration", type=float, default=30,
+                       help="seconds measured per target count (default: %(default)s)")
+    bench.add_argument("--bench-output", metavar="PATH", help="write the JSON report here instead of stdout")
+    bench.add_argument("--bench-db", action="store_true",
+                       help="write results to the configured database instead of an in-process fake")
+    bench.add_argument("--bench-db-latency", type=float, default=0.002,
+                       help="seconds per round-trip of the fake database (default: %(default)s)")
+    bench.add_argument("--bench-rtt", type=float, default=20.0,
+                       help="median simulated RTT in ms (default: %(default)s)")
+    bench.add_argument("--bench-loss", type=float, default=0.01,
+                       help="fraction of echoes dropped (default: %(default)s)")
+    bench.add_argument("--bench-dead", type=float, default=0.05,
+                       help="fraction of hosts that never answer (default: %(default)s)")
+    bench.add_argument("--bench-dns", type=float, default=0.1,
+                       help="fraction of targets given as hostnames (default: %(default)s)")
+    bench.add_argument("--bench-dns-delay", type=float, default=0.05,
+                       help="seconds per simulated DNS lookup (default: %(default)s)")
+    args = parser.parse_args()
+    
+    if args.event_receiver:
+        run_event_receiver("127.0.0.1", args.event_receiver)
+        return
+    
+    config = load_config(args.config)
+    if args.migrate:
+        raise SystemExit(run_migration(MonitorEngine.from_config(config)))
+    if args.import_path or args.export_path:
+        engine = MonitorEngine.from_config(config)
+        messages = engine.bus.subscribe()
+        failed = False
+        try:
+            engine.initialize_database()
+            engine.load_targets_from_db()
+            if args.import_path:
+                failed = engine.import_file(args.import_path, args.replace) is None
+            if args.export_path and not failed:
+                failed = engine.export_targets(args.export_path) is None
+        except Exception as e:
+            engine.log(f"Database error: {str(e)}", "error")
+            failed = True
+        while not messages.empty():
+            message_type, content = messages.get_nowait()
+            if message_type == "log":
+                print(log_entry(message_type, content)[1], file=sys.stderr)
+        raise SystemExit(1 if failed else 0)
+    if args.benchmark:
+        network = SimulatedNetwork(args.bench_rtt, loss=args.bench_loss, dead=args.bench_dead,
+                                   dns=args.bench_dns, dns_delay=args.bench_dns_delay)
+        sizes = [int(size) for size in args.bench_targets.split(",") if size.strip()]
+        run_benchmark(config, sizes, args.bench_duration, network, args.bench_db_latency,
+                      args.bench_db, args.bench_output)
+        return
+    
+    engine = MonitorEngine.from_config(config)
+    
+    port = args.stream_port if args.stream_port is not None else config["stream"].getint("port")
+    stream = ResultStreamServer(engine.bus, config["stream"].get("bind"), port) if port else None
+    
+    port = args.metrics_port if args.metrics_port is not None else config["metrics"].getint("port")
+    metrics = MetricsExporter(engine, config["metrics"].get("bind"), port) if port else None
+    
+    if args.headless:
+        raise SystemExit(run_headless(engine, stream, metrics))
+    
+    if tk is None:
+        parser.error("Tkinter is not available; use --headless")
+    root = tk.Tk()
+    app = PingMonitorApp(root, engine, stream_address=args.connect)
+    if stream and not args.connect:
+        stream.start()
+    if metrics and not args.connect:
+        metrics.start()
+    root.protocol("WM_DELETE_WINDOW", app.on_closing)
+    root.mainloop()
+
+
+if __name__ == "__main__":
+    main()
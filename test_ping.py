@@ -0,0 +1,303 @@
+import asyncio
+import json
+import os
+import queue
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+import ping
+
+
+class FakeCursor:
+    # Records statements; each answer is the rows of the first `results`
+    # entry whose key occurs in the statement
+    def __init__(self, results=None):
+        self.results = results or {}
+        self.executed = []
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.executed.append((" ".join(sql.split()), params))
+        self.rows = next((rows for key, rows in self.results.items() if key in sql), [])
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self.cur = cursor
+        self.autocommit = True
+
+    def cursor(self):
+        return self.cur
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def test_timer_wheel():
+    loop = asyncio.new_event_loop()
+    fired = []
+    try:
+        wheel = ping.TimerWheel(loop, tick=0.001, size=8)
+        wheel.schedule(0.005, fired.append, "short")
+        wheel.schedule(0.030, fired.append, "long")  # more than one turn of the wheel
+        cancelled = wheel.schedule(0.010, fired.append, "cancelled")
+        wheel.cancel(cancelled)
+        loop.run_until_complete(asyncio.sleep(0.1))
+    finally:
+        loop.close()
+    assert fired == ["short", "long"]
+    assert wheel.pending == 0
+
+
+def test_icmp_engine_loopback():
+    transport = ping.LoopbackTransport(rtt=lambda addr: None if addr == "10.0.0.2" else 0.002)
+    engine = ping.IcmpEngine(transport=transport)
+    engine.start()
+    try:
+        results = engine.ping_many(["10.0.0.1", "10.0.0.2"], timeout=0.2)
+    finally:
+        engine.close()
+    assert [result["target"] for result in results] == ["10.0.0.1", "10.0.0.2"]
+    assert results[0]["status"] and results[0]["response_time"] > 0
+    assert not results[1]["status"] and results[1]["response_time"] is None
+
+
+def test_sketch_percentile():
+    sketch = [0] * (len(ping.RTT_SKETCH_EDGES) + 1)
+    sketch[ping.RTT_SKETCH_EDGES.index(10)] = 100  # 100 samples in [7.5, 10)
+    assert ping.sketch_percentile(sketch, 0.5) == pytest.approx(8.75)
+    assert ping.sketch_percentile(sketch, 0.5, rtt_min=9.0, rtt_max=9.5) == 9.0
+    assert ping.sketch_percentile([0] * len(sketch), 0.5) is None
+
+
+def test_sample_history_covers_window_at_min_interval(tmp_path):
+    history = ping.SampleHistory(100, base=0, window=300, stretch=3)
+    for second in range(600):
+        history.record("fast", second, second % 5 != 0, 2.0)
+    times, _, _ = history.samples("fast")
+    assert times[0] == 300 and times[-1] == 599 and np.all(np.diff(times) > 0)
+    assert history.loss_rate("fast") == pytest.approx(20.0)
+    path = str(tmp_path / "history.snapshot")
+    history.snapshot(path)
+    loaded = ping.SampleHistory(100, window=300, stretch=3)
+    assert loaded.load(path)
+    assert isinstance(loaded.offsets, np.memmap)
+    assert np.array_equal(loaded.samples("fast")[0], times)
+
+
+def test_wal_replay_skips_torn_line(tmp_path):
+    wal = ping.ResultWal(str(tmp_path / "wal"))
+    wal.append(["a\t1\n", "b\t2\n"])
+    wal.close()
+    segment, = wal.sealed()
+    with open(segment, "ab") as f:
+        f.write(b"c\t3")  # crash in the middle of a row
+    rows = list(ping.ResultWal.read(segment))
+    assert [line for line, _ in rows] == ["a\t1\n", "b\t2\n"]
+    assert rows[-1][1] == len("a\t1\nb\t2\n")
+    # Resuming from a recorded offset reads only what follows
+    assert [line for line, _ in ping.ResultWal.read(segment, rows[0][1])] == ["b\t2\n"]
+    # A reopened WAL keeps the segment and writes new rows to the next one
+    wal = ping.ResultWal(str(tmp_path / "wal"))
+    wal.append(["d\t4\n"])
+    assert len(wal.sealed()) == 2 and wal.pending()
+    os.remove(segment)
+    wal.close()
+
+
+def test_parse_targets_text():
+    entries, columns, errors = ping.parse_targets("10.0.0.1, Example.COM.\n# comment\n10.0.0.1 bad..name\n")
+    assert list(entries) == ["10.0.0.1", "example.com"]
+    assert columns == ()
+    assert len(errors) == 1 and errors[0].startswith("line 3:")
+
+
+def test_parse_targets_range_and_csv():
+    entries, _, _ = ping.parse_targets("192.168.1.0/30")
+    assert list(entries) == ["192.168.1.1", "192.168.1.2"]
+    entries, columns, errors = ping.parse_targets("target,probe_interval\nhost-a,10\nhost-b,\n", "csv")
+    assert entries == {"host-a": (10.0, None, None, None), "host-b": (None, None, None, None)}
+    assert columns == ("probe_interval",)
+    assert errors == []
+
+
+def test_parse_targets_json():
+    text = json.dumps({"targets": ["a.example", {"target": "b.example", "retry_attempts": 2}, 5,
+                                   {"target": "c.example", "probe_interval": [1]}]})
+    entries, columns, errors = ping.parse_targets(text, "json")
+    assert entries == {"a.example": (None, None, None, None), "b.example": (None, 2, None, None)}
+    assert "retry_attempts" in columns
+    assert [error.split(":")[0] for error in errors] == ["item 3", "item 4"]
+    with pytest.raises(ValueError):
+        ping.parse_targets('"a.example"', "json")
+
+
+def test_event_detector_down_up():
+    detector = ping.EventDetector(down_after=2, up_after=2, group_window=0)
+    detector.observe("a", "10.0.0.1", True, 1.0, 0)
+    detector.observe("a", "10.0.0.1", False, None, 1)
+    assert detector.poll(1) == []
+    detector.observe("a", "10.0.0.1", False, None, 2)
+    assert [event["kind"] for event in detector.poll(2)] == ["down"]
+    assert detector.down == 1
+    detector.observe("a", "10.0.0.1", True, 1.0, 3)
+    detector.observe("a", "10.0.0.1", True, 1.0, 4)
+    events = detector.poll(4)
+    assert [event["kind"] for event in events] == ["up"]
+    assert events[0]["duration"] == 2
+    assert detector.down == 0
+
+
+def test_event_detector_counts_down_targets():
+    detector = ping.EventDetector(down_after=1, up_after=1, group_window=0)
+    for target in ("a", "b", "c"):
+        detector.observe(target, None, False, None, 0)
+    detector.observe("c", None, True, 1.0, 1)
+    assert detector.down == 2
+    detector.retain(["b", "c"])
+    assert detector.down == 1 and set(detector.states) == {"b", "c"}
+
+
+def test_event_detector_groups_outage():
+    detector = ping.EventDetector(down_after=1, group_window=5, group_min=3)
+    targets = [f"10.0.0.{host}" for host in (1, 2, 3)]
+    for target in targets:
+        detector.observe(target, target, True, 1.0, 0)
+        detector.observe(target, target, False, None, 1)
+    assert detector.poll(2) == []
+    events = detector.poll(6)
+    assert [event["kind"] for event in events] == ["outage"]
+    assert events[0]["subnet"] == "10.0.0.0/24" and events[0]["targets"] == targets
+    for now, target in enumerate(targets, 7):
+        detector.observe(target, target, True, 1.0, now)
+        detector.observe(target, target, True, 1.0, now)
+    assert [event["kind"] for event in detector.poll(10)] == ["outage_resolved"]
+
+
+def test_lttb_keeps_ends_and_spike():
+    x = np.arange(1000, dtype=float)
+    y = np.zeros(1000)
+    y[500] = 100.0
+    selected = ping.lttb(x, y, 50)
+    assert len(selected) == 50
+    assert selected[0] == 0 and selected[-1] == 999
+    assert 500 in selected
+    assert np.all(np.diff(selected) > 0)
+    assert len(ping.lttb(x[:10], y[:10], 50)) == 10
+
+
+def test_partition_maintenance_dates():
+    today = datetime.now(timezone.utc).date()
+
+    def bound(day):
+        return f"FOR VALUES FROM ('{day} 00:00:00+00') TO ('{day + timedelta(days=1)} 00:00:00+00')"
+
+    name = ping.PartitionRetentionJob.partition_name
+    existing = [today + timedelta(days=offset) for offset in (-31, -30, 0, 1)]
+    cur = FakeCursor({"FROM pg_inherits": [(name(day), bound(day)) for day in existing] +
+                                          [("ping_results_default", "DEFAULT")]})
+    job = ping.PartitionRetentionJob(None, queue.Queue(), ttl_days=30, premake_days=3)
+    created, dropped = job.maintain(FakeConnection(cur))
+    # Upcoming days past the last existing partition, one UTC day each
+    assert created == [name(today + timedelta(days=2)), name(today + timedelta(days=3))]
+    midnight = datetime(today.year, today.month, today.day, tzinfo=timezone.utc)
+    creates = [params for sql, params in cur.executed if "PARTITION OF ping_results" in sql]
+    assert creates == [(midnight + timedelta(days=2), midnight + timedelta(days=3)),
+                       (midnight + timedelta(days=3), midnight + timedelta(days=4))]
+    # Only the partition that ends before the retention cutoff goes
+    assert dropped == [name(today - timedelta(days=31))]
+    assert f"DROP TABLE {dropped[0]}" in [sql for sql, _ in cur.executed]
+
+
+def test_rollup_redoes_dirty_ranges():
+    at = datetime(2026, 1, 1, 10, tzinfo=timezone.utc)
+    minutes = lambda count: at + timedelta(minutes=count)
+    cur = FakeCursor({"DELETE FROM ping_rollup_dirty": [
+        (minutes(2.8), minutes(3.1)),
+        (minutes(0.5), minutes(2.2)),
+        (minutes(40), minutes(41)),  # past the 1m watermark, nothing rolled up yet
+    ]})
+    job = ping.RollupJob(None, queue.Queue())
+    watermarks = {"1m": minutes(30), "1h": minutes(120)}
+    assert job.redo_dirty(cur, watermarks) == 3
+    redone = [(sql.split()[2], params) for sql, params in cur.executed if sql.startswith("INSERT")]
+    # Overlapping minutes merge into one range, then the hour holding them
+    # is rolled up again from the minutes; the day is not rolled up yet
+    assert redone == [("ping_rollup_1m", (at, minutes(4))), ("ping_rollup_1h", (at, minutes(60)))]
+
+
+def test_scheduler_deadlines_and_backoff(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(ping.time, "monotonic", lambda: clock[0])
+    scheduler = ping.ProbeScheduler(interval=4, min_interval=1, max_interval=20, jitter=0)
+    policy = ping.RetryPolicy(attempts=1)
+    scheduler.sync(["a", "b", "c", "d"])
+    # New targets are spread over their first interval
+    assert [scheduler.state[target].due for target in "abcd"] == [100, 101, 102, 103]
+    clock[0] = 100.25
+    assert scheduler.due(policy) == {None: ["a"]}
+    assert scheduler.next_wakeup() == pytest.approx(0.75)
+    clock[0] = 100.5
+    assert scheduler.complete({"target": "a", "status": True}, policy)["attempts"] == 1
+    assert scheduler.state["a"].due == 104.5
+    # A failing target is re-checked at min_interval a few times, then
+    # backs off exponentially up to max_interval
+    gaps = []
+    for _ in range(6):
+        clock[0] = scheduler.state["b"].due
+        assert "b" in scheduler.due(policy)[None]
+        assert scheduler.complete({"target": "b", "status": False}, policy)["attempts"] == 0
+        gaps.append(scheduler.state["b"].due - clock[0])
+    assert gaps == [1, 1, 1, 8, 16, 20]
+    # Removed targets are never handed out again (a, c and d were due
+    # while b was failing and are still in flight)
+    scheduler.sync(["b"])
+    clock[0] = 200
+    assert scheduler.due(policy) == {None: ["b"]}
+    assert scheduler.complete({"target": "a", "status": True}, policy) is None
+
+
+def test_scheduler_retries_within_a_check(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(ping.time, "monotonic", lambda: clock[0])
+    scheduler = ping.ProbeScheduler(interval=4, jitter=0)
+    policy = ping.RetryPolicy(attempts=3, retry_delay=0.5)
+    scheduler.sync(["a", "b"], policies={"b": (None, None, 0.2)})
+    clock[0] = 100.25
+    assert scheduler.due(policy) == {None: ["a"]}
+    # A failed attempt is due again retry_delay later, with no result yet
+    assert scheduler.complete({"target": "a", "status": False}, policy) is None
+    assert scheduler.state["a"].due == 100.75 and scheduler.retries == 1
+    clock[0] = 100.75
+    assert scheduler.due(policy) == {None: ["a"]}
+    result = scheduler.complete({"target": "a", "status": True}, policy)
+    assert result["attempts"] == 2 and result["duration"] == 500 and result["lag"] == 0.25
+    # Per-target policies: b hedges; DNS errors are not retried
+    clock[0] = 102
+    assert scheduler.due(policy) == {0.2: ["b"]}
+    result = scheduler.complete({"target": "b", "status": False, "dns_error": "NXDOMAIN"}, policy)
+    assert result["attempts"] == 0 and scheduler.retries == 1
+    # Every attempt failing gives one failed result
+    for attempt in range(3):
+        clock[0] = scheduler.state["a"].due
+        scheduler.due(policy)
+        result = scheduler.complete({"target": "a", "status": False}, policy)
+        assert (result is None) == (attempt < 2)
+    assert result["attempts"] == 0 and scheduler.retries == 3